@@ -0,0 +1,342 @@
+"""Offline end-to-end benchmark: synthetic updates through the real handlers.
+
+Everything runs locally: a media server hands out a fixture file and a fake
+Bot API takes the uploads. In "feed" mode updates with TikTok-looking links go
+through the aiogram Dispatcher (the @bench links are served by the yt-dlp
+plugin in benchmarks/yt_dlp_plugins); "playlist" mode does the same with
+playlist links, which go out as albums; in "generic" mode process_download is
+called directly with a plain .mp4 URL, which yt-dlp's generic extractor handles.
+With --broker the handlers only queue the jobs, and download workers
+(worker.run_worker, one per shard) run them in the same process, through an
+in-memory queue or a local fake Redis server.
+
+    python -m benchmarks.run --jobs 50 --concurrency 10 --save baseline.json
+    python -m benchmarks.run --jobs 50 --concurrency 10 --compare baseline.json
+
+Every run starts with empty caches in a temporary directory.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from benchmarks.servers import MediaServer, FakeBotApi, FakeRedis
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Compared against the baseline: (key, higher is better)
+COMPARED = [('jobs_per_sec', True), ('peak_rss_mb', False), ('peak_fds', False)]
+COMPARED_PERCENTILES = ('p50', 'p95', 'p99')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--jobs', type=int, default=20, help='synthetic requests to send')
+    parser.add_argument('--concurrency', type=int, default=5, help='requests in flight at once')
+    parser.add_argument('--rate', type=float, default=0, help='new requests per second, 0 for as fast as possible')
+    parser.add_argument('--users', type=int, default=0, help='distinct users, 0 for one per request')
+    parser.add_argument('--videos', type=int, default=0, help='distinct videos, 0 for one per request')
+    parser.add_argument('--size-mb', type=float, default=5, help='size of the fixture video')
+    parser.add_argument('--media-mbps', type=float, default=0, help='media server bandwidth cap per request')
+    parser.add_argument('--upload-mbps', type=float, default=0, help='fake Bot API bandwidth cap per request')
+    parser.add_argument('--api-latency-ms', type=float, default=0, help='added to every Bot API call')
+    parser.add_argument('--mode', choices=('feed', 'playlist', 'generic'), default='feed')
+    parser.add_argument('--playlist-size', type=int, default=10, help='videos per playlist in playlist mode')
+    parser.add_argument('--quality', default='best', help="quality for generic mode ('best', '720', ...)")
+    parser.add_argument('--backend', choices=('thread', 'process'), default='thread')
+    parser.add_argument('--workers', type=int, default=4, help='DOWNLOAD_WORKERS')
+    parser.add_argument('--pipe', choices=('on', 'off'), default='on', help='PIPE_UPLOADS')
+    parser.add_argument('--accelerator', choices=('on', 'off'), default='on', help='DOWNLOAD_ACCELERATOR')
+    parser.add_argument('--segments', type=int, default=4, help='SEGMENT_CONNECTIONS per file')
+    parser.add_argument('--segment-mb', type=float, default=4, help='SEGMENT_CHUNK_SIZE')
+    parser.add_argument('--broker', choices=('off', 'memory', 'redis'), default='off',
+                        help='split the handlers from the download workers (BROKER_URL)')
+    parser.add_argument('--shards', type=int, default=1, help='BROKER_SHARDS, one worker each')
+    parser.add_argument('--timeout', type=float, default=300, help='with --broker, how long to wait for deliveries')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against a JSON file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative regression')
+    return parser.parse_args(argv)
+
+
+def configure_env(args, workdir, media_url, api_url, broker_url=None):
+    """Settings for the bot modules; must run before anything imports config."""
+    os.environ.update({
+        'BOT_TOKEN': '123456:bench',
+        'TELEGRAM_API_URL': api_url,
+        'TELEGRAM_API_LOCAL': '0',
+        'FILE_ID_CACHE_PATH': os.path.join(workdir, 'file_ids.sqlite3'),
+        'JOB_QUEUE_PATH': os.path.join(workdir, 'jobs.sqlite3'),
+        'MEDIA_CACHE_DIR': os.path.join(workdir, 'media'),
+        'COOKIE_DIR': workdir,
+        'DOWNLOAD_WORKERS': str(args.workers),
+        'MAX_CONCURRENT_JOBS': str(args.workers),
+        'DOWNLOADER_BACKEND': args.backend,
+        'PIPE_UPLOADS': '1' if args.pipe == 'on' else '0',
+        'DOWNLOAD_ACCELERATOR': '1' if args.accelerator == 'on' else '0',
+        'SEGMENT_CONNECTIONS': str(args.segments),
+        'SEGMENT_CHUNK_SIZE': str(int(args.segment_mb * 1024 * 1024)),
+        'PROGRESS_EDIT_INTERVAL': '0.5',
+        'BENCH_MEDIA_URL': media_url,
+        'BENCH_MEDIA_SIZE': str(int(args.size_mb * 1024 * 1024)),
+        'BENCH_PLAYLIST_SIZE': str(args.playlist_size),
+        'BROKER_SHARDS': str(args.shards),
+    })
+    os.environ.pop('INFO_CACHE_PATH', None)
+    if broker_url:
+        os.environ['BROKER_URL'] = broker_url
+    else:
+        os.environ.pop('BROKER_URL', None)
+    # yt-dlp finds plugins on the path; worker processes inherit PYTHONPATH
+    for path in (ROOT, PLUGIN_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    os.environ['PYTHONPATH'] = os.pathsep.join(filter(None, [PLUGIN_DIR, ROOT, os.environ.get('PYTHONPATH')]))
+
+
+class ResourceSampler:
+    """Peak RSS (this process and its worker processes) and open file descriptors."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_fds = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        self.sample()
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def sample(self):
+        if not os.path.isdir('/proc/self'):
+            # No procfs (macOS): the kernel's own high-water mark, fds unknown
+            self.peak_rss = max(self.peak_rss, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+            return
+        pids = [os.getpid()] + _children(os.getpid())
+        self.peak_rss = max(self.peak_rss, sum(_rss(pid) for pid in pids))
+        self.peak_fds = max(self.peak_fds, len(os.listdir('/proc/self/fd')))
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+    return children + [grandchild for child in children for grandchild in _children(child)]
+
+
+def _rss(pid):
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples),
+        'p50': percentile(samples, 50),
+        'p95': percentile(samples, 95),
+        'p99': percentile(samples, 99),
+    }
+
+
+async def run_benchmark(args):
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    media = MediaServer(os.urandom(int(args.size_mb * 1024 * 1024)), args.media_mbps)
+    api = FakeBotApi(args.api_latency_ms / 1000, args.upload_mbps)
+    redis = FakeRedis() if args.broker == 'redis' else None
+    await media.start()
+    await api.start()
+    if redis:
+        await redis.start()
+    broker_url = {'off': None, 'memory': 'memory://', 'redis': redis and redis.url}[args.broker]
+    configure_env(args, workdir, media.url, api.url, broker_url)
+
+    # The bot's modules read their settings at import time
+    from aiogram import Bot, Dispatcher
+    from aiogram.types import Update, Message, Chat, User
+    from handlers import messages
+    from services import metrics
+    from services.bot_api import bot_api
+    from services.broker import broker
+    from services.downloader import downloader
+    from worker import run_worker
+
+    stages = defaultdict(list)
+    metrics.add_stage_listener(lambda stage, platform, seconds: stages[stage].append(seconds))
+
+    bot = Bot(token=os.environ['BOT_TOKEN'], session=bot_api.create_session())
+    dp = Dispatcher()
+    dp.include_router(messages.router)
+
+    def synthetic_message(index):
+        user_id = index % args.users + 1 if args.users else index + 1
+        video_id = index % args.videos if args.videos else index
+        if args.mode == 'feed':
+            text = f'https://www.tiktok.com/@bench/video/{7000000000000000000 + video_id}'
+        elif args.mode == 'playlist':
+            # Playlists don't overlap unless --videos makes them repeat
+            text = f'https://www.tiktok.com/@bench?start={7000000000000000000 + video_id * args.playlist_size}'
+        else:
+            text = f'{media.url}/media/{video_id}.mp4'
+        return Message(
+            message_id=index + 1,
+            date=datetime.now(),
+            chat=Chat(id=user_id, type='private'),
+            from_user=User(id=user_id, is_bot=False, first_name='bench'),
+            text=text,
+        )
+
+    async def one_job(index, gate):
+        async with gate:
+            message = synthetic_message(index)
+            started = time.perf_counter()
+            if args.mode in ('feed', 'playlist'):
+                await dp.feed_update(bot, Update(update_id=index + 1, message=message))
+            elif broker is not None:
+                await messages.process_links(message.as_(bot), [message.text], args.quality, message.from_user.id)
+            else:
+                await messages.process_download(message.as_(bot), message.text, args.quality, message.from_user.id)
+            stages['job'].append(time.perf_counter() - started)
+
+    expected = args.jobs * (args.playlist_size if args.mode == 'playlist' else 1)
+
+    async def all_delivered():
+        # With a broker the handlers return once the job is queued; the workers deliver later
+        deadline = time.perf_counter() + args.timeout
+        while sum(api.media_sent.values()) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+    background = []
+    if broker is not None:
+        background.append(asyncio.create_task(messages.relay_status_events(bot)))
+        background += [asyncio.create_task(run_worker(bot, shard)) for shard in range(args.shards)]
+
+    sampler = ResourceSampler()
+    sampler.start()
+    gate = asyncio.Semaphore(args.concurrency)
+    started = time.perf_counter()
+    try:
+        tasks = []
+        for index in range(args.jobs):
+            tasks.append(asyncio.create_task(one_job(index, gate)))
+            if args.rate:
+                await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*tasks)
+        if broker is not None:
+            await all_delivered()
+        wall = time.perf_counter() - started
+    finally:
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if broker is not None:
+            await broker.close()
+        await sampler.stop()
+        await bot.session.close()
+        downloader.shutdown()
+        await media.stop()
+        await api.stop()
+        if redis:
+            await redis.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    delivered = sum(api.media_sent.values())
+    return {
+        'config': {key: value for key, value in vars(args).items() if key not in ('save', 'compare', 'tolerance', 'timeout')},
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'jobs': expected,
+        'delivered': delivered,
+        'failed': expected - delivered,
+        'wall_seconds': wall,
+        'jobs_per_sec': delivered / wall if wall else 0.0,
+        'peak_rss_mb': sampler.peak_rss / (1024 * 1024),
+        'peak_fds': sampler.peak_fds,
+        'bytes_downloaded': media.bytes_sent,
+        'bytes_uploaded': api.bytes_received,
+        'api_calls': dict(api.calls),
+        'broker_commands': dict(redis.commands) if redis else {},
+        'stages': {stage: summarize(samples) for stage, samples in sorted(stages.items())},
+    }
+
+
+def print_report(results):
+    print(f"\n{results['delivered']}/{results['jobs']} delivered in {results['wall_seconds']:.2f}s "
+          f"({results['jobs_per_sec']:.2f} jobs/s), peak RSS {results['peak_rss_mb']:.1f}MB, "
+          f"peak fds {results['peak_fds']}")
+    print(f"{'stage':<12} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for stage, summary in results['stages'].items():
+        print(f"{stage:<12} {summary['count']:>6} {summary['p50']:>8.3f}s {summary['p95']:>8.3f}s "
+              f"{summary['p99']:>8.3f}s")
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against baseline; return the names of metrics that regressed."""
+    rows = [(key, baseline.get(key), results.get(key), higher_is_better) for key, higher_is_better in COMPARED]
+    for stage, summary in results['stages'].items():
+        for p in COMPARED_PERCENTILES:
+            old = baseline.get('stages', {}).get(stage, {}).get(p)
+            rows.append((f'{stage}.{p}', old, summary[p], False))
+
+    if baseline.get('config') != results['config']:
+        print("\nWarning: the baseline was recorded with different settings")
+    regressions = []
+    print(f"\n{'metric':<18} {'baseline':>10} {'now':>10} {'change':>8}")
+    for name, old, new, higher_is_better in rows:
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = '  REGRESSION' if worse > tolerance else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:<18} {old:>10.3f} {new:>10.3f} {change:>+7.0%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run_benchmark(args))
+    print_report(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
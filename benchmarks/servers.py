@@ -0,0 +1,294 @@
+"""Local stand-ins for the outside world: a media server, a fake Telegram Bot API and a fake Redis.
+
+All run on the benchmark's own event loop. Request bodies are streamed and
+counted, never buffered, so they add as little as possible to the RSS the
+benchmark measures.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+CHUNK_SIZE = 64 * 1024
+
+
+class _Server:
+    def __init__(self):
+        self.app = web.Application()
+        self.port = None
+        self._runner = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    async def start(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _throttle(started: float, sent: int, mbps: float):
+    if mbps:
+        ahead = sent / (mbps * 1024 * 1024) - (time.monotonic() - started)
+        if ahead > 0:
+            await asyncio.sleep(ahead)
+
+
+def _bulk(data: bytes) -> bytes:
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+
+class MediaServer(_Server):
+    """Serves the same fixture bytes as /media/<anything>.mp4, with HEAD, Range and an optional bandwidth cap.
+
+    range_requests answers only that many Range requests with 206 and the
+    rest with the whole file, like a server (or CDN node) without ranges.
+    """
+
+    def __init__(self, fixture: bytes, mbps: float = 0, range_requests: int = None):
+        super().__init__()
+        self.fixture = fixture
+        self.mbps = mbps
+        self.range_requests = range_requests
+        self.bytes_sent = 0
+        self.app.router.add_route('*', '/media/{name}', self._media)
+
+    async def _media(self, request):
+        start, end = 0, len(self.fixture) - 1
+        status = 200
+        if (request.http_range.start is not None or request.http_range.stop is not None) \
+                and self.range_requests != 0:
+            if self.range_requests is not None:
+                self.range_requests -= 1
+            window = request.http_range
+            start = window.start or 0
+            end = min((window.stop or len(self.fixture)) - 1, end)
+            status = 206
+
+        response = web.StreamResponse(status=status, headers={
+            'Content-Type': 'video/mp4',
+            'Accept-Ranges': 'bytes',
+            'Content-Length': str(end - start + 1),
+        })
+        if status == 206:
+            response.headers['Content-Range'] = f'bytes {start}-{end}/{len(self.fixture)}'
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+
+        started = time.monotonic()
+        sent = 0
+        try:
+            for offset in range(start, end + 1, CHUNK_SIZE):
+                chunk = self.fixture[offset:min(offset + CHUNK_SIZE, end + 1)]
+                await response.write(chunk)
+                sent += len(chunk)
+                self.bytes_sent += len(chunk)
+                await _throttle(started, sent, self.mbps)
+            await response.write_eof()
+        except ConnectionResetError:
+            # yt-dlp's generic extractor reads only the start of the file to sniff it
+            pass
+        return response
+
+
+class FakeBotApi(_Server):
+    """Answers the Bot API methods the handlers use, like api.telegram.org would.
+
+    latency is added to every call; upload_mbps caps how fast request bodies
+    are read, which is what a slow upload link looks like to the bot.
+    """
+
+    def __init__(self, latency: float = 0, upload_mbps: float = 0):
+        super().__init__()
+        self.latency = latency
+        self.upload_mbps = upload_mbps
+        self.calls = Counter()
+        self.bytes_received = 0
+        self.media_sent = Counter()  # chat id -> videos/audios received
+        self.requests = []  # (method, fields) of every call, uploaded files as attach://<name>
+        self._ids = itertools.count(1000)
+        self.app.router.add_post('/bot{token}/{method}', self._method)
+
+    async def _method(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        fields = await self._read_fields(request)
+        self.requests.append((method, fields))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({'ok': True, 'result': self._result(method, fields)})
+
+    async def _read_fields(self, request):
+        if request.content_type != 'multipart/form-data':
+            return dict(await request.post())
+
+        fields = {}
+        reader = await request.multipart()
+        started = time.monotonic()
+        received = 0
+        while (part := await reader.next()) is not None:
+            if part.filename is None:
+                fields[part.name] = await part.text()
+                continue
+            # An uploaded file: count it and throw it away
+            while chunk := await part.read_chunk(CHUNK_SIZE):
+                received += len(chunk)
+                self.bytes_received += len(chunk)
+                await _throttle(started, received, self.upload_mbps)
+            fields[part.name] = f'attach://{part.filename}'
+        return fields
+
+    def _result(self, method, fields):
+        if method in ('deleteMessage', 'answerCallbackQuery', 'setWebhook', 'deleteWebhook'):
+            return True
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        if method == 'sendMediaGroup':
+            # One message per album item
+            return [self._message(dict(fields, caption=item.get('caption')), item['type'], item)
+                    for item in json.loads(fields['media'])]
+        kind = {'sendVideo': 'video', 'sendAudio': 'audio', 'sendPhoto': 'photo'}.get(method)
+        return self._message(fields, kind, fields)
+
+    def _message(self, fields, kind, media_fields):
+        chat_id = int(fields.get('chat_id') or 0)
+        message = {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if fields.get('text'):
+            message['text'] = fields['text']
+        if fields.get('caption'):
+            message['caption'] = fields['caption']
+
+        file_id = f'bench-{message["message_id"]}'
+        if kind:
+            self.media_sent[chat_id] += 1
+        if kind == 'video':
+            message['video'] = {
+                'file_id': file_id, 'file_unique_id': file_id,
+                'width': int(media_fields.get('width') or 0), 'height': int(media_fields.get('height') or 0),
+                'duration': int(float(media_fields.get('duration') or 0)),
+            }
+        elif kind == 'audio':
+            message['audio'] = {'file_id': file_id, 'file_unique_id': file_id,
+                                'duration': int(float(media_fields.get('duration') or 0))}
+        elif kind == 'photo':
+            message['photo'] = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 320, 'height': 320}]
+        return message
+
+
+class FakeRedis:
+    """Just enough of the Redis protocol for services.broker: lists with LPUSH, RPUSH, LREM, LRANGE,
+    and blocking BRPOP and BRPOPLPUSH."""
+
+    def __init__(self):
+        self.port = None
+        self.commands = Counter()
+        self._lists = defaultdict(deque)
+        self._changed = asyncio.Condition()
+        self._server = None
+        self._clients = set()
+
+    @property
+    def url(self) -> str:
+        return f'redis://127.0.0.1:{self.port}/0'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for task in self._clients:
+                task.cancel()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self._clients.add(asyncio.current_task())
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                name, args = command[0].upper(), command[1:]
+                self.commands[name] += 1
+                writer.write(await self._execute(name, args))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._clients.discard(asyncio.current_task())
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2].decode())
+        return args
+
+    async def _execute(self, name, args):
+        if name in ('PING', 'SELECT', 'AUTH'):
+            return b'+OK\r\n' if name != 'PING' else b'+PONG\r\n'
+        if name in ('LPUSH', 'RPUSH'):
+            items = self._lists[args[0]]
+            if name == 'LPUSH':
+                items.extendleft(args[1:])
+            else:
+                items.extend(args[1:])
+            async with self._changed:
+                self._changed.notify_all()
+            return b':%d\r\n' % len(items)
+        if name == 'BRPOP':
+            keys, timeout = args[:-1], float(args[-1])
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: any(self._lists[key] for key in keys)),
+                                           timeout or None)
+                except asyncio.TimeoutError:
+                    return b'*-1\r\n'
+                key = next(key for key in keys if self._lists[key])
+                value = self._lists[key].pop().encode()
+            return b'*2\r\n$%d\r\n%s\r\n$%d\r\n%s\r\n' % (len(key), key.encode(), len(value), value)
+        if name == 'BRPOPLPUSH':
+            source, destination, timeout = args[0], args[1], float(args[2])
+            async with self._changed:
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: self._lists[source]), timeout or None)
+                except asyncio.TimeoutError:
+                    return b'*-1\r\n'
+                value = self._lists[source].pop()
+                self._lists[destination].appendleft(value)
+            return _bulk(value.encode())
+        if name == 'LREM':
+            items, count, value = self._lists[args[0]], int(args[1]), args[2]
+            removed = 0
+            while value in items and (count == 0 or removed < abs(count)):
+                # Counted from the head, which is all services.broker asks for
+                items.remove(value)
+                removed += 1
+            return b':%d\r\n' % removed
+        if name == 'LRANGE':
+            items = list(self._lists[args[0]])
+            start, stop = int(args[1]), int(args[2])
+            items = items[start:(stop + 1) or None]
+            return b'*%d\r\n' % len(items) + b''.join(_bulk(item.encode()) for item in items)
+        return b'-ERR unknown command %s\r\n' % name.encode()
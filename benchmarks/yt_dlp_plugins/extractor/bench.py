@@ -0,0 +1,54 @@
+"""yt-dlp plugin: TikTok-looking links under @bench resolve to the benchmark's media server.
+
+The bot's handlers only react to real platform links, so the benchmark sends
+https://www.tiktok.com/@bench/video/<id>, and https://www.tiktok.com/@bench?start=<id>
+for a playlist of BENCH_PLAYLIST_SIZE of them. benchmarks/run.py puts this
+directory on the path (plugins take precedence over built-in extractors) and
+sets BENCH_MEDIA_URL, BENCH_MEDIA_SIZE and BENCH_PLAYLIST_SIZE.
+"""
+import functools
+import os
+
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.utils import OnDemandPagedList
+
+PLAYLIST_PAGE_SIZE = 5
+
+
+class BenchIE(InfoExtractor):
+    _VALID_URL = r'https?://(?:www\.)?tiktok\.com/@bench/video/(?P<id>\d+)'
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        return {
+            'id': video_id,
+            'title': f'Benchmark video {video_id}',
+            'duration': 30,
+            'formats': [{
+                'format_id': 'h264-540p',
+                'url': f"{os.environ['BENCH_MEDIA_URL']}/media/{video_id}.mp4",
+                'ext': 'mp4',
+                'protocol': 'https' if os.environ['BENCH_MEDIA_URL'].startswith('https') else 'http',
+                'vcodec': 'avc1.4d401f',
+                'acodec': 'mp4a.40.2',
+                'width': 960,
+                'height': 540,
+                'filesize': int(os.environ['BENCH_MEDIA_SIZE']),
+            }],
+        }
+
+
+class BenchPlaylistIE(InfoExtractor):
+    _VALID_URL = r'https?://(?:www\.)?tiktok\.com/@bench/?(?:\?start=(?P<id>\d+))?$'
+
+    def _real_extract(self, url):
+        start = int(self._match_id(url) or 0)
+        size = int(os.environ.get('BENCH_PLAYLIST_SIZE', 10))
+        # Paged like a real profile, so the bot only lists what it downloads
+        entries = OnDemandPagedList(functools.partial(self._page, start, size), PLAYLIST_PAGE_SIZE)
+        return self.playlist_result(entries, f'bench-{start}', f'Benchmark playlist {start}')
+
+    def _page(self, start, size, page):
+        first = page * PLAYLIST_PAGE_SIZE
+        for index in range(first, min(first + PLAYLIST_PAGE_SIZE, size)):
+            yield self.url_result(f'https://www.tiktok.com/@bench/video/{start + index}', BenchIE)
@@ -1,26 +1,53 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from config import BOT_TOKEN
-from handlers import commands, messages
+from aiogram.types import Update
+from config import BOT_TOKEN, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, PORT, BROKER_SHARDS
+from services.broker import broker, InProcessBroker
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    from services.webserver import WebServer
+
+    async def handle_update(data):
+        await dp.feed_update(bot, Update.model_validate(data, context={"bot": bot}))
+
+    server = WebServer(handle_update)
+    await server.start("0.0.0.0", PORT)
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    server.ready = True
+    print("Bot started (webhook)...")
+
+    try:
+        await server.wait_for_signal()
+    finally:
+        # The webhook stays registered, other replicas keep receiving updates
+        await server.drain()
+        await server.stop()
+        await bot.session.close()
+
 async def main():
     if not BOT_TOKEN:
         print("Error: BOT_TOKEN is not set in .env file")
         return
 
-    from aiogram.client.session.aiohttp import AiohttpSession
-    from aiohttp import ClientTimeout
-    
-    # Increase timeout for large file uploads
-    # total=None disables the total operation timeout
-    # connect=60 gives 60s to establish connection
-    # sock_read=600 gives 10 mins for reading data (uploading)
-    timeout = ClientTimeout(total=None, connect=60, sock_read=600)
-    session = AiohttpSession(timeout=timeout)
+    # Imported here, not at the top: download worker processes re-import this
+    # file, and they need none of it
+    from handlers import commands, messages
+    from services.bot_api import bot_api
+    from services.lifecycle import startup
+
+    startup()
+
+    # Public api.telegram.org or a local telegram-bot-api server, with upload
+    # timeouts tuned per backend (BOT_API_CONNECT_TIMEOUT / BOT_API_READ_TIMEOUT)
+    session = bot_api.create_session()
     bot = Bot(token=BOT_TOKEN, session=session)
     dp = Dispatcher()
 
@@ -28,8 +55,36 @@ async def main():
     dp.include_router(commands.router)
     dp.include_router(messages.router)
 
+    # With a broker this process only dispatches; worker.py runs the downloads
+    # (in this process too for memory://, nothing else can reach its queues)
+    background = []
+    if broker is not None:
+        background.append(asyncio.create_task(messages.relay_status_events(bot)))
+        if isinstance(broker, InProcessBroker):
+            from worker import run_worker
+            background += [asyncio.create_task(run_worker(bot, shard)) for shard in range(BROKER_SHARDS)]
+
+    # Downloads the last restart interrupted (see services.job_queue); workers resume their own
+    if broker is None or isinstance(broker, InProcessBroker):
+        resumed = await messages.resume_jobs(bot)
+        if resumed:
+            print(f"Resuming {resumed} interrupted download(s)...")
+
+    if WEBHOOK_URL:
+        await run_webhook(bot, dp)
+        return
+
+    # Health checks and /metrics; updates still come from polling
+    from services.webserver import WebServer
+    server = WebServer()
+    await server.start("0.0.0.0", PORT)
+    server.ready = True
+
     print("Bot started...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await server.stop()
 
 if __name__ == "__main__":
     try:
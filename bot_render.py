@@ -11,8 +11,19 @@ import os  # This helps us read settings from the computer
 import logging  # This helps us write messages about what the bot is doing
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup  # Tools to work with Telegram
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes  # More Telegram tools
-from http.server import HTTPServer, BaseHTTPRequestHandler  # Tools to create a simple web server
-from threading import Thread  # Tool to run multiple things at once
+import asyncio  # Tool to run many things at once without waiting
+from aiohttp import web  # Tool to create a simple web server
+from pathlib import Path  # Tool to point at files on disk
+from utils.urls import extract_urls, canonicalize  # Tools to find and clean up video links
+from services.bot_api import bot_api  # Which Telegram server to use, and its file size limit
+from services.webserver import WebServer  # Our web server (health checks and webhook)
+from services.downloader import downloader  # Downloads videos in the background (shared with bot.py)
+from services.lifecycle import startup  # Cleans up after the last run when the bot starts
+from services import metrics  # Timings and counters for the /metrics page
+from services.format_planner import FormatTooLarge  # Raised when no version of a video is small enough
+from services.transcode import TranscodeError  # Raised when a video can't be compressed small enough
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET  # Webhook settings
+from config import CONCURRENT_UPDATES  # How many messages we handle at the same time
 
 # ============================================
 # STEP 2: Set up logging (like a diary for the bot)
@@ -41,32 +52,19 @@ MONETAG_LINK = "https://otieu.com/4/10256428"
 PORT = int(os.environ.get("PORT", 10000))
 
 # ============================================
-# STEP 3.5: Create a simple web server (for Render)
+# STEP 3.5: The web page Render checks (for Render)
 # ============================================
-class HealthCheckHandler(BaseHTTPRequestHandler):
+async def health_page(request):
     """
-    This is a simple web server that Render can check
+    This is a simple web page that Render can check
     It's like a "I'm alive!" signal
+    It is served by the same web server that receives Telegram updates
+    in webhook mode (see services/webserver.py), so no extra thread is needed
     """
-    def do_GET(self):
-        # When someone visits our web address, say "Bot is running!"
-        self.send_response(200)
-        self.send_header('Content-type', 'text/html')
-        self.end_headers()
-        self.wfile.write(b'<h1>Telegram Bot is Running!</h1><p>Bot Status: Active</p>')
-    
-    def log_message(self, format, *args):
-        # Don't print every web request (keeps logs clean)
-        return
-
-def run_health_server():
-    """
-    Start the web server on the port Render expects
-    This runs in the background while the bot runs
-    """
-    server = HTTPServer(('0.0.0.0', PORT), HealthCheckHandler)
-    logger.info(f"Health check server running on port {PORT}")
-    server.serve_forever()
+    return web.Response(
+        text='<h1>Telegram Bot is Running!</h1><p>Bot Status: Active</p>',
+        content_type='text/html'
+    )
 
 # ============================================
 # STEP 4: Define what happens when user sends /start
@@ -128,15 +126,14 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Get the user's ID
     user_id = update.effective_user.id
     
-    # Get the message they sent (the URL)
-    url = update.message.text
+    # Find the links in the message they sent
+    urls = extract_urls(update.message.text)
     
-    # Write in our diary what URL they sent
-    logger.info(f"User {user_id} sent URL: {url}")
+    # Write in our diary what they sent
+    logger.info(f"User {user_id} sent: {update.message.text}")
     
-    # Check if the URL is from YouTube, TikTok, or Instagram
-    # We look for these words in the URL
-    if not any(platform in url.lower() for platform in ['youtube.com', 'youtu.be', 'tiktok.com', 'instagram.com', 'reels']):
+    # Check if there is a YouTube, TikTok, or Instagram link in it
+    if not urls:
         # If it's not a valid URL, tell them
         await update.message.reply_text(
             "❌ Please send a valid video URL from:\n"
@@ -146,106 +143,75 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return  # Stop here, don't do anything else
     
+    # Clean up the link (short links are followed, tracking junk is removed)
+    parsed = await canonicalize(urls[0])
+    url = parsed.url
+    
     # Tell the user we're starting the download
     status_message = await update.message.reply_text("⏳ Downloading video... Please wait!")
     
+    # This is filled in once the download is done, so the clean-up at the end knows what to give back
+    result = None
+    
     try:
-        # Import yt-dlp (the tool that downloads videos)
-        import yt_dlp
-        import os
-        import tempfile
-        
-        # Create a temporary folder to store the video
-        temp_dir = tempfile.mkdtemp()
-        output_path = os.path.join(temp_dir, 'video.%(ext)s')
-        
-        # Check if we have YouTube cookies from environment variable
-        youtube_cookies = os.environ.get("YOUTUBE_COOKIES")
-        instagram_cookies = os.environ.get("INSTAGRAM_COOKIES")
-        cookies_file = None
-        
-        # Determine which cookies to use based on the URL
-        if 'youtube.com' in url.lower() or 'youtu.be' in url.lower():
-            if youtube_cookies:
-                cookies_file = os.path.join(temp_dir, 'cookies.txt')
-                with open(cookies_file, 'w') as f:
-                    f.write(youtube_cookies)
-                logger.info("Using YouTube cookies from environment")
-        elif 'instagram.com' in url.lower():
-            if instagram_cookies:
-                cookies_file = os.path.join(temp_dir, 'cookies.txt')
-                with open(cookies_file, 'w') as f:
-                    f.write(instagram_cookies)
-                logger.info("Using Instagram cookies from environment")
-        
-        # Configure yt-dlp settings
-        ydl_opts = {
-            # Get best quality available (up to 1080p), fallback to lower if needed
-            'format': 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080]/best',
-            'outtmpl': output_path,
-            'quiet': True,
-            'no_warnings': True,
-            # Merge video and audio into single file
-            'merge_output_format': 'mp4',
-            # Additional options
+        # Cookies (YOUTUBE_COOKIES, INSTAGRAM_COOKIES, ...) are loaded once when the bot starts
+        # and picked by the downloader itself (see services/cookies.py)
+        extra_opts = {
             'nocheckcertificate': True,
             'geo_bypass': True,
         }
         
-        # Add cookies if available
-        if cookies_file:
-            ydl_opts['cookiefile'] = cookies_file
-        else:
-            # Fallback to Android API if no cookies
-            ydl_opts['extractor_args'] = {
-                'youtube': {
-                    'player_client': ['android'],
-                    'player_skip': ['webpage', 'configs'],
-                }
-            }
-        
-        # Download the video
+        # Download the video (up to 1080p)
+        # The downloader works on its own worker threads, so the bot keeps answering everyone else
+        # Videos over the size limit are compressed to fit (see services/transcode.py)
         logger.info(f"Starting download for URL: {url}")
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            filename = ydl.prepare_filename(info)
-        
-        # Clean up cookies file if it was created
-        if cookies_file and os.path.exists(cookies_file):
-            os.remove(cookies_file)
+        result = await downloader.download_video(url, '1080', extra_opts=extra_opts)
+        filename = result.path
         
         # Update status: Download complete, now uploading
         await status_message.edit_text("✅ Download complete! Uploading to Telegram...")
         
-        # Check file size (Telegram has a 50MB limit for bots)
-        file_size = os.path.getsize(filename)
-        if file_size > 50 * 1024 * 1024:  # 50MB in bytes
+        # Check file size (50MB for bots, 2000MB with our own Bot API server)
+        file_size = await asyncio.to_thread(os.path.getsize, filename)
+        limit_mb = bot_api.upload_limit // (1024 * 1024)
+        if file_size > bot_api.upload_limit:
             await status_message.edit_text(
-                "❌ Sorry, this video is too large (over 50MB).\n"
-                "Telegram bots can only send files up to 50MB."
+                f"❌ Sorry, this video is too large (over {limit_mb}MB).\n"
+                f"Telegram bots can only send files up to {limit_mb}MB."
             )
-            # Clean up the file
-            os.remove(filename)
-            os.rmdir(temp_dir)
-            return
+            return  # The clean-up below still runs
         
         # Send the video to the user
         logger.info(f"Uploading video to user {user_id}")
-        with open(filename, 'rb') as video_file:
+        if bot_api.is_local:
+            # Our own Bot API server reads the file straight from disk
+            video = Path(filename)
+        else:
+            # Read the file on a helper thread, the bot would freeze while reading it otherwise
+            video = await asyncio.to_thread(Path(filename).read_bytes)
+        # metrics.timed measures how long the upload takes (see the /metrics page)
+        with metrics.timed('upload', parsed.platform or 'other'):
             await update.message.reply_video(
-                video=video_file,
+                video=video,
+                filename=os.path.basename(filename),
+                thumb=result.thumbnail,  # A small JPEG made in memory, or None (see services/thumbnails.py)
                 caption="✅ Here's your video!\n\n💡 Share this bot with friends!",
+                # The real size and length (measured with ffprobe), so Telegram shows the video the right shape
+                width=result.metadata.get('width'),
+                height=result.metadata.get('height'),
+                duration=int(result.metadata['duration']) if result.metadata.get('duration') else None,
                 supports_streaming=True
             )
+        metrics.BYTES.labels('uploaded').inc(file_size)
         
         # Delete the status message
         await status_message.delete()
-        
-        # Clean up: Delete the temporary file and folder
-        os.remove(filename)
-        os.rmdir(temp_dir)
         logger.info(f"Successfully sent video to user {user_id}")
         
+    except (FormatTooLarge, TranscodeError) as e:
+        # The video is over the limit and can't be made small enough
+        await status_message.edit_text(f"❌ {e}")
+        
     except Exception as e:
         # If something goes wrong, tell the user
         logger.error(f"Error downloading video: {str(e)}")
@@ -257,6 +223,12 @@ async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"• A shorter video\n"
             f"• A public video (not private)"
         )
+        
+    finally:
+        # Clean up, even when something went wrong above
+        # The video stays in the media cache, we just say we're done with it
+        if result:
+            downloader.release(result.path)
 
 # ============================================
 # STEP 7: Define what happens when there's an error
@@ -271,6 +243,47 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
 # ============================================
 # STEP 8: The main function - this starts everything!
 # ============================================
+async def run(application: Application):
+    """
+    Runs the web server and the bot together on one event loop
+    Webhook mode: Telegram sends updates to our web server (faster, several copies can run)
+    Polling mode: we keep asking Telegram for new updates
+    """
+    # Telegram pushes updates to us in webhook mode; we hand them to the bot's queue
+    async def handle_update(data):
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    server = WebServer(handle_update if WEBHOOK_URL else None)
+    server.add_route('GET', '/', health_page)
+
+    # IMPORTANT: Start the web server FIRST
+    # This lets Render detect the port immediately (fixes timeout issue)
+    await server.start('0.0.0.0', PORT)
+
+    async with application:  # Connects to Telegram (and disconnects at the end)
+        await application.start()
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES
+            )
+            logger.info("Bot is now running and receiving updates by webhook!")
+        else:
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            logger.info("Bot is now running and polling for messages!")
+        server.ready = True
+
+        # Wait until Render asks us to stop (SIGTERM), then finish what we started
+        await server.wait_for_signal()
+        logger.info("Shutting down, finishing in-flight downloads...")
+        await server.drain()
+        if application.updater:
+            await application.updater.stop()
+        await application.stop()  # Waits for updates that are still being handled
+
+    await server.stop()
+
 def main():
     """
     This is the main function that starts the bot
@@ -281,22 +294,20 @@ def main():
         logger.error("TELEGRAM_BOT_TOKEN not set!")
         return  # Stop if we don't have the password
     
-    # IMPORTANT: Start the health check server FIRST
-    # This lets Render detect the port immediately (fixes timeout issue)
-    logger.info("Starting health check server...")
-    health_thread = Thread(target=run_health_server, daemon=True)
-    health_thread.start()
-    
-    # Give the server a moment to start
-    import time
-    time.sleep(2)
-    logger.info(f"Health check server running on port {PORT}")
-    
-    # Now start the bot
+    # Now build the bot
     logger.info("Starting Telegram bot...")
+
+    # Tidy up what the last run left behind (half-finished downloads) before we start
+    startup()
     
     # Create the bot application (like building the bot)
-    application = Application.builder().token(TOKEN).build()
+    # bot_api decides which Telegram server we talk to (the public one or our own)
+    builder = bot_api.configure_builder(Application.builder().token(TOKEN))
+    # Handle several users at once, so one slow download doesn't make everyone else wait
+    builder = builder.concurrent_updates(CONCURRENT_UPDATES)
+    if WEBHOOK_URL:
+        builder = builder.updater(None)  # Updates come from our web server, not from polling
+    application = builder.build()
     
     # Tell the bot what to do when users send different things:
     # - When they send /start, run the start() function
@@ -311,9 +322,8 @@ def main():
     # - If anything goes wrong, run the error_handler() function
     application.add_error_handler(error_handler)
     
-    # Start the bot! It will now listen for messages
-    logger.info("Bot is now running and polling for messages!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Start the bot and the web server!
+    asyncio.run(run(application))
 
 # ============================================
 # STEP 9: Actually start the bot when we run this file
@@ -1,6 +1,122 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+# Telegram file_id cache (resend already-uploaded media without downloading again)
+FILE_ID_CACHE_PATH = os.getenv("FILE_ID_CACHE_PATH", "cache/file_ids.sqlite3")
+FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", 30 * 24 * 3600))
+
+# Durable job queue: unfinished downloads are run again after a restart
+JOB_QUEUE_PATH = os.getenv("JOB_QUEUE_PATH", "cache/jobs.sqlite3")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))  # runs before a job that keeps dying is given up
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 24 * 3600))  # seconds finished jobs are kept
+
+# On-disk media cache (reuse downloaded files across chats and requests)
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "cache/media")
+MEDIA_CACHE_MAX_BYTES = int(os.getenv("MEDIA_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+MEDIA_CACHE_POLICY = os.getenv("MEDIA_CACHE_POLICY", "lru")  # lru or lfu
+
+# Job workspaces: bytes all running downloads may reserve, and disk space that must stay free
+WORKSPACE_MAX_BYTES = int(os.getenv("WORKSPACE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+WORKSPACE_MIN_FREE_BYTES = int(os.getenv("WORKSPACE_MIN_FREE_BYTES", 512 * 1024 * 1024))
+WORKSPACE_ADMIT_TIMEOUT = float(os.getenv("WORKSPACE_ADMIT_TIMEOUT", 300))  # seconds a job waits for disk space
+# Optional tmpfs directory (e.g. /dev/shm/ytbot) for media up to WORKSPACE_TMPFS_MAX_FILE bytes
+WORKSPACE_TMPFS_DIR = os.getenv("WORKSPACE_TMPFS_DIR")
+WORKSPACE_TMPFS_MAX_FILE = int(os.getenv("WORKSPACE_TMPFS_MAX_FILE", 64 * 1024 * 1024))
+WORKSPACE_TMPFS_MAX_BYTES = int(os.getenv("WORKSPACE_TMPFS_MAX_BYTES", 256 * 1024 * 1024))
+WORKSPACE_JANITOR_INTERVAL = float(os.getenv("WORKSPACE_JANITOR_INTERVAL", 10 * 60))
+WORKSPACE_STALE_AFTER = float(os.getenv("WORKSPACE_STALE_AFTER", 60 * 60))  # leftovers older than this are deleted
+
+# Download scheduling
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 4))
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", DOWNLOAD_WORKERS))
+MAX_JOBS_PER_USER = int(os.getenv("MAX_JOBS_PER_USER", 1))
+DOWNLOADER_BACKEND = os.getenv("DOWNLOADER_BACKEND", "thread")  # thread or process
+PROCESS_POOL_MAX_TASKS = int(os.getenv("PROCESS_POOL_MAX_TASKS", 50))  # recycle worker processes after N jobs
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", 16))  # updates bot_render.py handles at the same time
+
+# Split roles: bot.py dispatches jobs through a broker to worker.py processes (memory:// or redis://host:6379/0)
+BROKER_URL = os.getenv("BROKER_URL")
+BROKER_SHARDS = int(os.getenv("BROKER_SHARDS", 1))  # job queues; a video always goes to the same one
+WORKER_JOBS = int(os.getenv("WORKER_JOBS", 2 * MAX_CONCURRENT_JOBS))  # jobs a worker takes off its queue at once
+# Names the broker list of jobs a worker has taken: the same across its restarts, different for every worker
+WORKER_NAME = os.getenv("WORKER_NAME") or f"{socket.gethostname()}:{os.path.abspath(JOB_QUEUE_PATH)}"
+
+# Batches: playlists, carousels and messages with several links
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 50))  # videos taken from one batch at most
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", 3))  # downloads of one batch running at once
+
+# Download accelerator: several connections per file, since CDNs throttle each connection
+DOWNLOAD_ACCELERATOR = os.getenv("DOWNLOAD_ACCELERATOR", "0") == "1"
+SEGMENT_CONNECTIONS = int(os.getenv("SEGMENT_CONNECTIONS", 4))  # parallel Range requests per progressive file
+SEGMENT_CHUNK_SIZE = int(os.getenv("SEGMENT_CHUNK_SIZE", 4 * 1024 * 1024))  # bytes per Range request
+CONCURRENT_FRAGMENTS = int(os.getenv("CONCURRENT_FRAGMENTS", 4))  # parallel DASH/HLS fragments per download
+HTTP_CHUNK_SIZE = int(os.getenv("HTTP_CHUNK_SIZE", 10 * 1024 * 1024))  # yt-dlp's own chunked HTTP downloads
+DOWNLOAD_BUFFER_SIZE = int(os.getenv("DOWNLOAD_BUFFER_SIZE", 256 * 1024))
+MAX_CONNECTIONS_PER_HOST = int(os.getenv("MAX_CONNECTIONS_PER_HOST", 8))  # per worker process, all downloads
+MAX_SEGMENT_CONNECTIONS = int(os.getenv("MAX_SEGMENT_CONNECTIONS", 32))  # per worker process, all hosts
+
+# ffmpeg jobs (audio conversion): run at most FFMPEG_WORKERS at once, each with FFMPEG_THREADS threads
+# and a lower CPU priority (FFMPEG_NICE, 0-19) than the bot itself
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+FFPROBE_PATH = os.getenv("FFPROBE_PATH", "ffprobe")
+FFMPEG_WORKERS = int(os.getenv("FFMPEG_WORKERS", 2))
+FFMPEG_THREADS = int(os.getenv("FFMPEG_THREADS", 2))
+FFMPEG_NICE = int(os.getenv("FFMPEG_NICE", 10))
+FFMPEG_TIMEOUT = float(os.getenv("FFMPEG_TIMEOUT", 15 * 60))  # seconds before an ffmpeg job is killed
+
+# Re-encode videos over the upload limit (two-pass x264) instead of refusing them; CPU heavy, opt-in
+TRANSCODE_OVERSIZE = os.getenv("TRANSCODE_OVERSIZE", "0") == "1"
+TRANSCODE_CONCURRENCY = int(os.getenv("TRANSCODE_CONCURRENCY", 1))  # encodes at once, within FFMPEG_WORKERS
+TRANSCODE_PRESET = os.getenv("TRANSCODE_PRESET", "veryfast")  # x264 preset: CPU time against quality
+TRANSCODE_MAX_DURATION = float(os.getenv("TRANSCODE_MAX_DURATION", 20 * 60))  # longer videos are refused
+TRANSCODE_MIN_VIDEO_KBPS = int(os.getenv("TRANSCODE_MIN_VIDEO_KBPS", 200))  # below this the result isn't watchable
+TRANSCODE_SOURCE_HEIGHT = int(os.getenv("TRANSCODE_SOURCE_HEIGHT", 720))  # resolution downloaded for re-encoding
+TRANSCODE_TIMEOUT = float(os.getenv("TRANSCODE_TIMEOUT", 20 * 60))  # both passes together
+
+# Metadata cache for extracted info dicts (format URLs expire, keep the TTL short)
+INFO_CACHE_TTL = int(os.getenv("INFO_CACHE_TTL", 30 * 60))
+INFO_CACHE_NEGATIVE_TTL = int(os.getenv("INFO_CACHE_NEGATIVE_TTL", 5 * 60))
+INFO_CACHE_MAX_ENTRIES = int(os.getenv("INFO_CACHE_MAX_ENTRIES", 1000))
+INFO_CACHE_PATH = os.getenv("INFO_CACHE_PATH")  # optional SQLite file, memory only when unset
+
+# Telegram-ready JPEG thumbnails, made in memory and kept by video id
+THUMBNAIL_CACHE_ENTRIES = int(os.getenv("THUMBNAIL_CACHE_ENTRIES", 512))
+THUMBNAIL_FETCH_TIMEOUT = float(os.getenv("THUMBNAIL_FETCH_TIMEOUT", 15))
+
+# Logged-in cookies: YOUTUBE_COOKIES, YOUTUBE_COOKIES_2, ... (same for INSTAGRAM_COOKIES)
+# and the youtube_cookies*.txt / instagram_cookies*.txt files in COOKIE_DIR
+COOKIE_DIR = os.getenv("COOKIE_DIR", ".")
+COOKIE_ROTATION = os.getenv("COOKIE_ROTATION", "round_robin")  # round_robin or lru
+COOKIE_COOLDOWN = float(os.getenv("COOKIE_COOLDOWN", 15 * 60))  # seconds an account rests after a 429 or login wall
+
+# Minimum seconds between two edits of the same status message
+PROGRESS_EDIT_INTERVAL = float(os.getenv("PROGRESS_EDIT_INTERVAL", 3))
+
+# Bot API server: the public api.telegram.org by default, or a self-hosted
+# telegram-bot-api (e.g. http://localhost:8081). In local mode (--local) files
+# are sent by path and the upload limit is 2000MB instead of 50MB.
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+TELEGRAM_API_LOCAL = os.getenv("TELEGRAM_API_LOCAL", "0") == "1"
+# A local server is next door but answers a sendVideo only once it has uploaded the file
+# (up to 2000MB) to Telegram itself; api.telegram.org answers once it has the request body
+BOT_API_CONNECT_TIMEOUT = float(os.getenv("BOT_API_CONNECT_TIMEOUT", 10 if TELEGRAM_API_LOCAL else 60))
+BOT_API_READ_TIMEOUT = float(os.getenv("BOT_API_READ_TIMEOUT", 3600 if TELEGRAM_API_LOCAL else 600))
+
+# Largest file the bot may upload
+UPLOAD_LIMIT_BYTES = int(os.getenv("UPLOAD_LIMIT_BYTES", (2000 if TELEGRAM_API_LOCAL else 50) * 1024 * 1024))
+
+# Stream progressive files into the upload while they download
+PIPE_UPLOADS = os.getenv("PIPE_UPLOADS", "1") == "1"
+PIPE_BUFFER_CHUNKS = int(os.getenv("PIPE_BUFFER_CHUNKS", 16))  # in-memory chunks between download and upload
+
+# Webhook mode (instead of long polling) when WEBHOOK_URL is set, e.g. https://my-bot.onrender.com
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # checked against X-Telegram-Bot-Api-Secret-Token
+PORT = int(os.getenv("PORT", 10000))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 30))  # seconds to finish in-flight updates on SIGTERM
@@ -1,138 +1,524 @@
 from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, FSInputFile, BufferedInputFile
-from services.downloader import downloader
-from utils.progress import ProgressFileReader
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
+from aiogram.types import InputMediaAudio, InputMediaPhoto, InputMediaVideo, Chat
+from aiogram.exceptions import TelegramBadRequest
+from config import UPLOAD_LIMIT_BYTES, BATCH_PARALLELISM, BROKER_SHARDS
+from services.audio import telegram_tags
+from services.batch import MEDIA_GROUP_SIZE, BatchProgress, expand, fetch_ordered, media_kind
+from services.broker import broker, BrokerError, InProcessBroker, EVENTS_QUEUE, jobs_queue, shard_for
+from services.downloader import downloader, PlaylistLink
+from services.file_id_cache import file_id_cache
+from services.job_queue import job_queue, JobTakenOver, BATCH, DOWNLOAD, QUEUED, EXTRACTING, DOWNLOADING, UPLOADING
+from services.format_planner import FormatTooLarge
+from services import metrics
+from services.pipe import PipeUnavailable
+from services.scheduler import scheduler, job_priority
+from services.thumbnails import thumbnail_cache
+from services.transcode import TranscodeError
+from services.bot_api import bot_api
+from utils.progress import progress_broker
+from utils.urls import extract_urls, detect_platform, canonicalize, is_playlist
+import asyncio
+import logging
 import os
 import time
-import asyncio
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
-# Regex patterns for supported platforms
-YOUTUBE_PATTERN = r'(https?://)?(www\.)?(youtube|youtu|youtube-nocookie)\.(com|be)/.+'
-TIKTOK_PATTERN = r'(https?://)?(www\.)?(tiktok)\.com/.+'
-INSTAGRAM_PATTERN = r'(https?://)?(www\.)?(instagram)\.com/.+'
+def platform_links(platform):
+    """Filter matching messages with links to platform; the links are passed to the handler as `urls`."""
+    return F.text.func(lambda text: [url for url in extract_urls(text) if detect_platform(url) == platform] or None).as_("urls")
 
-@router.message(F.text.regexp(YOUTUBE_PATTERN))
-async def handle_youtube_url(message: Message):
+@router.message(platform_links('youtube'))
+async def handle_youtube_url(message: Message, urls: list):
     await message.reply(
         "YouTube link detected! 📹\nChoose format:",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Video (Best)", callback_data=f"dl_video_best")],
             [InlineKeyboardButton(text="Video (720p)", callback_data=f"dl_video_720")],
-            [InlineKeyboardButton(text="Audio (MP3)", callback_data=f"dl_audio")]
+            [InlineKeyboardButton(text="Audio", callback_data=f"dl_audio")]
         ])
     )
 
-@router.message(F.text.regexp(TIKTOK_PATTERN))
-async def handle_tiktok_url(message: Message):
+@router.message(platform_links('tiktok'))
+async def handle_tiktok_url(message: Message, urls: list):
     await message.reply(
         "TikTok link detected! 🎵\nDownloading without watermark...",
     )
-    await process_download(message, message.text, "best")
+    await process_links(message, urls, "best", message.from_user.id)
 
-@router.message(F.text.regexp(INSTAGRAM_PATTERN))
-async def handle_instagram_url(message: Message):
+@router.message(platform_links('instagram'))
+async def handle_instagram_url(message: Message, urls: list):
     await message.reply(
         "Instagram link detected! 📸\nDownloading...",
     )
-    await process_download(message, message.text, "best")
+    await process_links(message, urls, "best", message.from_user.id)
 
 @router.callback_query(F.data.startswith("dl_"))
 async def handle_callback(callback: CallbackQuery):
     action = callback.data.split("_")[1] # video or audio
     quality = callback.data.split("_")[2] if len(callback.data.split("_")) > 2 else "best"
     
-    if callback.message.reply_to_message:
-        url = callback.message.reply_to_message.text
+    urls = extract_urls(callback.message.reply_to_message.text) if callback.message.reply_to_message else []
+    if urls:
         await callback.message.edit_text(f"Downloading {action} ({quality})...")
-        await process_download(callback.message, url, quality if action == 'video' else 'audio')
+        await process_links(callback.message, urls, quality if action == 'video' else 'audio', callback.from_user.id)
     else:
         await callback.message.edit_text("Error: Could not find original link.")
 
-async def process_download(message: Message, url: str, quality: str):
-    status_msg = await message.answer("Initializing download... 0%")
-    last_update_time = 0
-
-    def progress_hook(d):
-        nonlocal last_update_time
-        if d['status'] == 'downloading':
-            current_time = time.time()
-            if current_time - last_update_time > 2: # Update every 2 seconds
-                percent = d.get('_percent_str', '0%').strip()
-                try:
-                    # Use create_task to avoid blocking the download thread
-                    asyncio.create_task(status_msg.edit_text(f"Downloading... {percent} ⬇️"))
-                    last_update_time = current_time
-                except Exception:
-                    pass
+async def send_cached(message: Message, cache_key: str, quality: str) -> bool:
+    cached = file_id_cache.get(cache_key, quality)
+    metrics.cache_lookup('file_id', cached is not None)
+    if not cached:
+        return False
+
+    file_id, kind, caption = cached
+    try:
+        if kind == 'audio':
+            await message.answer_audio(file_id, caption=caption)
+        elif kind == 'photo':
+            await message.answer_photo(file_id, caption=caption)
+        else:
+            await message.answer_video(file_id, caption=caption)
+        return True
+    except TelegramBadRequest:
+        # The file_id is no longer valid (deleted or from another bot), fall back to a fresh download
+        file_id_cache.invalidate(cache_key, quality)
+        return False
+
+def video_fields(metadata: dict) -> dict:
+    # Real dimensions keep Telegram's player from showing black bars; it needs whole seconds
+    fields = {key: metadata[key] for key in ('width', 'height') if metadata.get(key)}
+    if metadata.get('duration'):
+        fields['duration'] = int(metadata['duration'])
+    return fields
+
+def thumbnail_input(thumbnail: bytes):
+    # Made in memory by services.thumbnails, uploaded from memory
+    return BufferedInputFile(thumbnail, 'thumbnail.jpg') if thumbnail else None
+
+def remember_file_id(sent: Message, cache_key: str, quality: str, caption: str):
+    media = sent.audio if quality == 'audio' else (sent.video or sent.document)
+    if media:
+        file_id_cache.put(cache_key, quality, media.file_id, 'audio' if quality == 'audio' else 'video', caption)
+
+async def send_piped(message: Message, url: str, quality: str, progress, job_id: int = None):
+    """Upload while downloading when the source allows it; None means use the regular path.
+
+    Raises JobTakenOver when the job may not be sent (any more), see job_queue.set_state.
+    """
+    if bot_api.is_local:
+        # A local Bot API server reads files from disk, nothing to gain from streaming
+        return None
+    source = await downloader.pipe_source(url, quality)
+    if not source:
+        return None
 
+    media_file = await downloader.pipe_file(source, progress.upload)
     try:
-        file_path, title, thumbnail_path = await downloader.download_video(url, quality, progress_hook)
+        # The upload starts with the download here; the regular path checks this again before sending
+        if job_id is not None and not job_queue.set_state(job_id, UPLOADING):
+            raise JobTakenOver()
+        # The thumbnail is made while the media request connects
+        _, thumbnail = await asyncio.gather(media_file.open(), thumbnail_cache.get(source.metadata))
+        with metrics.timed('pipe', metrics.platform_label(url)):
+            return await message.answer_video(
+                media_file,
+                caption=source.title,
+                thumbnail=thumbnail_input(thumbnail),
+                supports_streaming=True,
+                **video_fields(source.metadata),
+            )
+    except PipeUnavailable:
+        return None
+    except Exception:
+        if media_file.failure is not None:
+            # The download side broke, not Telegram: retry the regular way
+            return None
+        raise
+    finally:
+        await media_file.close()
+        # A complete stream is kept in the media cache, so a fallback doesn't download twice
+        downloader.finish_pipe(media_file)
+
+async def process_links(message: Message, urls: list, quality: str, user_id: int = None):
+    """One link is a regular download, several links or a playlist a batch."""
+    if broker is not None:
+        await enqueue_links(message, urls, quality, user_id)
+    elif len(urls) > 1 or is_playlist(urls[0]):
+        await process_batch(message, urls, quality, user_id)
+    else:
+        await process_download(message, urls[0], quality, user_id)
+
+async def enqueue_links(message: Message, urls: list, quality: str, user_id: int = None):
+    """Hand the links to a download worker (worker.py), on the shard of the first video."""
+    parsed = await canonicalize(urls[0])
+    status_msg = await message.answer("⏳ Queued...")
+    job = {
+        'kind': BATCH if len(urls) > 1 or is_playlist(parsed.url) else DOWNLOAD,
+        'urls': urls if len(urls) > 1 else [parsed.url],
+        'quality': quality,
+        'chat_id': message.chat.id,
+        'chat_type': message.chat.type,
+        'user_id': user_id,
+        'status_message_id': status_msg.message_id,
+    }
+    if isinstance(broker, InProcessBroker):
+        # Its queues die with this process; recorded here, a restart resumes the job (resume_jobs)
+        job['job_id'] = job_queue.add(message.chat.id, message.chat.type, user_id, '\n'.join(job['urls']), quality,
+                                      status_msg.message_id, kind=job['kind'])
+    try:
+        await broker.push(jobs_queue(shard_for(parsed.key, BROKER_SHARDS)), job)
+    except BrokerError as e:
+        await status_msg.edit_text(f"Error: {e}")
+
+async def relay_status_events(bot, broker=broker):
+    """Apply the status message edits workers send back through the broker, in order per message."""
+    last_edit = {}
+    while True:
+        try:
+            event = await broker.pop(EVENTS_QUEUE)
+        except BrokerError as e:
+            logger.warning(f"Can't read status events: {e}")
+            await asyncio.sleep(1)
+            continue
+        if event is None:
+            continue
+        key = (event['chat_id'], event['message_id'])
+        task = asyncio.create_task(apply_status_event(bot, event, last_edit.get(key)))
+        last_edit[key] = task
+        task.add_done_callback(lambda done, key=key: last_edit.get(key) is done and last_edit.pop(key))
+
+async def apply_status_event(bot, event: dict, previous: asyncio.Task = None):
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        if event['op'] == 'delete':
+            await bot.delete_message(event['chat_id'], event['message_id'])
+        else:
+            await bot.edit_message_text(event['text'], chat_id=event['chat_id'], message_id=event['message_id'])
+    except Exception:
+        # Like a progress edit: a status message that can't be changed isn't worth failing for
+        pass
+
+async def process_download(message: Message, url: str, quality: str, user_id: int = None, job_id: int = None,
+                           status_msg=None):
+    """Download url and send it; job_id continues a job from services.job_queue (after a restart).
+
+    status_msg is an existing status message to use (a worker's RemoteStatus) instead of a new one.
+    """
+    parsed = await canonicalize(url)
+    url, cache_key = parsed.url, parsed.key
+    if await send_cached(message, cache_key, quality):
+        if job_id is not None:
+            job_queue.complete(job_id)
+        if status_msg is not None:
+            await status_msg.delete()
+        return
+
+    if status_msg is None:
+        status_msg = await message.answer("Initializing download... 0%")
+    # Download hooks and the upload reader report here; the broker edits status_msg
+    progress = progress_broker.track(status_msg)
+    # Recorded from here on, so a restart runs the job again instead of dropping it
+    if job_id is None:
+        job_id = job_queue.add(message.chat.id, message.chat.type, user_id, url, quality, status_msg.message_id)
+    else:
+        job_queue.set_state(job_id, QUEUED, status_message_id=status_msg.message_id)
+
+    async def queue_position(position):
+        progress.set_text(f"⏳ You are #{position} in queue...")
+
+    downloading = []
+
+    def download_hook(d):
+        if d.get('status') == 'downloading' and not downloading:
+            downloading.append(True)
+            job_queue.set_state(job_id, DOWNLOADING)
+        progress.hook(d)
+
+    file_path = None
+    playlist = False
+    platform = metrics.platform_label(url)
+    started = time.perf_counter()
+    metrics.ACTIVE_JOBS.inc()
+    try:
+        # The chat stands in for the user when the caller didn't say who asked
+        async with scheduler.slot(user_id or message.chat.id, job_priority(url, quality), queue_position):
+            metrics.observe('queue', platform, time.perf_counter() - started)
+            job_queue.set_state(job_id, EXTRACTING)
+            sent = await send_piped(message, url, quality, progress, job_id)
+            if sent is None:
+                result = await downloader.download_video(url, quality, download_hook)
+
+        if sent is not None:
+            job_queue.complete(job_id)
+            remember_file_id(sent, cache_key, quality, sent.caption)
+            progress.close()
+            await status_msg.delete()
+            metrics.observe('total', platform, time.perf_counter() - started)
+            return
+
+        file_path, title = result.path, result.title
         
-        # Check file size (Telegram limit 50MB for bots without local server)
+        # The planner works from estimates, and files are only re-encoded to fit when TRANSCODE_OVERSIZE is on
         file_size = os.path.getsize(file_path)
         file_size_mb = file_size / (1024 * 1024)
         
-        if file_size > 50 * 1024 * 1024:
-            await status_msg.edit_text(f"⚠️ File is too large ({file_size_mb:.1f}MB). Telegram bots can only send up to 50MB directly.")
-            os.remove(file_path)
-            if thumbnail_path and os.path.exists(thumbnail_path):
-                os.remove(thumbnail_path)
+        if file_size > UPLOAD_LIMIT_BYTES:
+            progress.close()
+            job_queue.fail(job_id, "file too large")
+            await status_msg.edit_text(f"⚠️ File is too large ({file_size_mb:.1f}MB). Telegram bots can only send up to {UPLOAD_LIMIT_BYTES // (1024 * 1024)}MB directly.")
+            downloader.release(file_path)
             return
 
-        # Real-time upload progress
-        async def upload_progress(current, total):
-            percent = (current / total) * 100
-            uploaded_mb = current / (1024 * 1024)
-            total_mb = total / (1024 * 1024)
-            
-            try:
-                # Update every 5% or 3 seconds (handled by wrapper)
-                await status_msg.edit_text(
-                    f"Uploading... {percent:.1f}% ⬆️\n"
-                    f"({uploaded_mb:.1f}MB / {total_mb:.1f}MB)"
-                )
-            except Exception:
-                pass
+        if not job_queue.set_state(job_id, UPLOADING):
+            raise JobTakenOver()
 
-        try:
-            # We use BufferedInputFile with our custom reader
-            # But BufferedInputFile expects bytes, not a file-like object usually?
-            # Actually FSInputFile is path-based. BufferedInputFile takes bytes.
-            # aiogram doesn't expose a way to pass a file-like object directly to FSInputFile.
-            # However, we can use BufferedInputFile(file, filename=...) where file is our reader.
-            # Let's verify if BufferedInputFile accepts a binary IO. 
-            # Yes, it accepts bytes or BinaryIO.
-            
-            reader = ProgressFileReader(file_path, upload_progress)
-            
-            # Note: BufferedInputFile reads the whole file into memory if passed bytes, 
-            # but if passed an IO object, it *should* stream it.
-            # Wait, aiogram's BufferedInputFile might read it all.
-            # Let's check if we can pass the reader to FSInputFile? No, FSInputFile takes a path.
-            # We have to use BufferedInputFile with the reader.
-            
-            media_file = BufferedInputFile(reader, filename=os.path.basename(file_path))
-            thumbnail_file = FSInputFile(thumbnail_path) if thumbnail_path else None
+        # Streams the file from disk in fixed-size chunks (memory per upload stays constant),
+        # or just passes the path to a local Bot API server
+        media_file = bot_api.input_file(file_path, progress.upload)
+        thumbnail_file = thumbnail_input(result.thumbnail)
+        if bot_api.is_local:
+            progress.set_text("Uploading... ⬆️")
 
+        with metrics.timed('upload', platform):
             if quality == 'audio':
-                await message.answer_audio(media_file, caption=title, thumbnail=thumbnail_file)
+                sent = await message.answer_audio(media_file, caption=title, thumbnail=thumbnail_file,
+                                                  **telegram_tags(result.metadata))
             else:
-                await message.answer_video(media_file, caption=title, thumbnail=thumbnail_file, width=1280, height=720)
-            
-            reader.close()
-            
-        finally:
-            pass
+                sent = await message.answer_video(media_file, caption=title, thumbnail=thumbnail_file,
+                                                  supports_streaming=True, **video_fields(result.metadata))
+        job_queue.complete(job_id)
+        remember_file_id(sent, cache_key, quality, title)
             
+        progress.close()
         await status_msg.delete()
+        metrics.observe('total', platform, time.perf_counter() - started)
         
-        # Cleanup
-        if os.path.exists(file_path):
-            os.remove(file_path)
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            os.remove(thumbnail_path)
+        # Cleanup: files stay in the media cache for the next request
+        downloader.release(file_path)
         
+    except JobTakenOver:
+        # Whoever has it now sends it, or has already
+        progress.close()
+        if file_path:
+            downloader.release(file_path)
+        await status_msg.delete()
+    except PlaylistLink:
+        # Only the extraction tells that an Instagram post is a carousel
+        progress.close()
+        job_queue.complete(job_id)
+        await status_msg.delete()
+        playlist = True
+    except (FormatTooLarge, TranscodeError) as e:
+        progress.close()
+        job_queue.fail(job_id, str(e))
+        await status_msg.edit_text(f"⚠️ {e}")
     except Exception as e:
+        progress.close()
+        job_queue.fail(job_id, str(e))
+        if file_path:
+            downloader.release(file_path)
         await status_msg.edit_text(f"Error: {str(e)}")
+    finally:
+        metrics.ACTIVE_JOBS.dec()
+
+    if playlist:
+        await process_batch(message, [url], quality, user_id)
+
+def album_item(kind: str, media, caption: str, metadata: dict = None, thumbnail: bytes = None):
+    """One file of a media group; media is a file_id or what bot_api.input_file() returns."""
+    metadata = metadata or {}
+    if kind == 'audio':
+        return InputMediaAudio(media=media, caption=caption, thumbnail=thumbnail_input(thumbnail),
+                               **telegram_tags(metadata))
+    if kind == 'photo':
+        return InputMediaPhoto(media=media, caption=caption)
+    return InputMediaVideo(media=media, caption=caption, thumbnail=thumbnail_input(thumbnail),
+                           supports_streaming=True, **video_fields(metadata))
+
+async def send_album(message: Message, album: list) -> list:
+    """Send album_item()s with one sendMediaGroup call; Telegram wants at least two, so one goes alone."""
+    if len(album) > 1:
+        return await message.answer_media_group(album)
+    item = album[0]
+    send = {'audio': message.answer_audio, 'photo': message.answer_photo, 'video': message.answer_video}[item.type]
+    fields = {name: getattr(item, name) for name in item.model_fields_set if name not in ('type', 'media')}
+    return [await send(item.media, **fields)]
+
+async def process_batch(message: Message, urls: list, quality: str, user_id: int = None, status_msg=None,
+                        job_id: int = None):
+    """Send every video behind urls (playlists, carousels, several links) as albums, with one status message.
+
+    Recorded in services.job_queue as one job, job_id continues it (after a restart).
+    """
+    if status_msg is None:
+        status_msg = await message.answer("📦 Looking for videos...")
+    progress = progress_broker.track(status_msg)
+    if job_id is None:
+        job_id = job_queue.add(message.chat.id, message.chat.type, user_id, '\n'.join(urls), quality,
+                               status_msg.message_id, kind=BATCH)
+    else:
+        job_queue.set_state(job_id, QUEUED, status_message_id=status_msg.message_id)
+    batch = BatchProgress(progress)
+    platform = metrics.platform_label(urls[0])
+    started = time.perf_counter()
+    errors = []
+    taken_over = False
+    uploading = []
+    # The next album: InputMedia items, and (cache key, kind, caption, path or None) for each
+    album, album_files = [], []
+
+    async def queue_position(position):
+        progress.set_text(f"⏳ You are #{position} in queue...")
+
+    async def entries():
+        async for entry in expand(urls, quality):
+            batch.found += 1
+            yield entry
+        batch.expanding = False
+        batch.update()
+
+    async def fetch(entry):
+        try:
+            if entry.error is not None:
+                raise entry.error
+            if entry.cached:
+                result = None
+            else:
+                result = await downloader.download_video(entry.url, quality, batch.hook(id(entry)), info=entry.info)
+                size = os.path.getsize(result.path)
+                if size > UPLOAD_LIMIT_BYTES:
+                    downloader.release(result.path)
+                    raise FormatTooLarge(size, UPLOAD_LIMIT_BYTES)
+        except Exception:
+            batch.finish(id(entry), failed=True)
+            raise
+        batch.finish(id(entry))
+        return result
+
+    async def send_next_album():
+        if not album:
+            return
+        # From the first album on, running the batch again could deliver files twice
+        if not uploading:
+            if not job_queue.set_state(job_id, UPLOADING):
+                raise JobTakenOver()
+            uploading.append(True)
+        try:
+            with metrics.timed('upload', platform):
+                sent = await send_album(message, album)
+            for sent_message, (key, kind, caption, _) in zip(sent, album_files):
+                media = sent_message.audio or sent_message.video or sent_message.document or \
+                    (sent_message.photo[-1] if sent_message.photo else None)
+                if media:
+                    file_id_cache.put(key, quality, media.file_id, kind, caption)
+            batch.sent += len(sent)
+        except Exception as e:
+            if isinstance(e, TelegramBadRequest):
+                # Perhaps a stale file_id; the next try uploads those files again
+                for key, _, _, path in album_files:
+                    if path is None:
+                        file_id_cache.invalidate(key, quality)
+            errors.append(e)
+            batch.failed += len(album)
+        finally:
+            for _, _, _, path in album_files:
+                if path:
+                    downloader.release(path)
+            album.clear()
+            album_files.clear()
+            batch.update()
+
+    metrics.ACTIVE_JOBS.inc()
+    try:
+        # A batch takes one of the user's slots; BATCH_PARALLELISM bounds its downloads inside it
+        async with scheduler.slot(user_id or message.chat.id, job_priority(urls[0], quality), queue_position):
+            metrics.observe('queue', platform, time.perf_counter() - started)
+            job_queue.set_state(job_id, EXTRACTING)
+            batch.update()
+            async for entry, result in fetch_ordered(entries(), fetch, BATCH_PARALLELISM):
+                if isinstance(result, Exception):
+                    errors.append(result)
+                elif result is None:
+                    file_id, kind, caption = entry.cached
+                    album.append(album_item(kind, file_id, caption))
+                    album_files.append((entry.key, kind, caption, None))
+                else:
+                    kind = media_kind(quality, result.path)
+                    album.append(album_item(kind, bot_api.input_file(result.path), result.title,
+                                            result.metadata, result.thumbnail))
+                    album_files.append((entry.key, kind, result.title, result.path))
+                if len(album) == MEDIA_GROUP_SIZE:
+                    await send_next_album()
+            await send_next_album()
+    except JobTakenOver:
+        taken_over = True
+    except Exception as e:
+        errors.append(e)
+    finally:
+        for _, _, _, path in album_files:
+            if path:
+                downloader.release(path)
+        progress.close()
+        metrics.ACTIVE_JOBS.dec()
+
+    if taken_over:
+        # Whoever has it now sends it, or has already
+        await status_msg.delete()
+        return
+    if errors and not batch.sent:
+        job_queue.fail(job_id, str(errors[0]))
+    else:
+        job_queue.complete(job_id)
+
+    metrics.observe('total', platform, time.perf_counter() - started)
+    if not batch.found and not errors:
+        await status_msg.edit_text("Nothing to download there.")
+    elif not errors:
+        await status_msg.delete()
+    elif batch.sent:
+        await status_msg.edit_text(f"✅ Sent {batch.sent} of {batch.found}. "
+                                   f"{batch.failed} failed, e.g.: {errors[0]}")
+    else:
+        await status_msg.edit_text(f"Error: {errors[0]}")
+
+# Jobs resumed after a restart run on their own, not as part of an update
+_resumed_jobs = set()
+
+async def resume_jobs(bot):
+    """Run the downloads and batches a restart interrupted again; partial files are picked up where they stopped."""
+    resumed, given_up, uploading = job_queue.recover()
+    for job in given_up:
+        try:
+            await bot.send_message(job.chat_id, f"⚠️ Your download of {' '.join(job.urls)} was interrupted "
+                                                f"too many times. Please send the link again.")
+        except Exception:
+            pass
+    for job in uploading:
+        try:
+            if job.status_message_id:
+                await bot.delete_message(job.chat_id, job.status_message_id)
+            await bot.send_message(job.chat_id, f"⚠️ Sending {' '.join(job.urls)} was interrupted. "
+                                                f"If it didn't arrive, please send the link again.")
+        except Exception:
+            pass
+    for job in resumed:
+        if job.status_message_id:
+            try:
+                await bot.delete_message(job.chat_id, job.status_message_id)
+            except Exception:
+                pass
+        message = Message(message_id=job.status_message_id or 0, date=datetime.now(),
+                          chat=Chat(id=job.chat_id, type=job.chat_type)).as_(bot)
+        if job.kind == BATCH:
+            task = asyncio.create_task(process_batch(message, job.urls, job.quality, job.user_id, job_id=job.id))
+        else:
+            task = asyncio.create_task(process_download(message, job.url, job.quality, job.user_id, job.id))
+        _resumed_jobs.add(task)
+        task.add_done_callback(_resumed_jobs.discard)
+    return len(resumed)
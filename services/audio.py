@@ -0,0 +1,123 @@
+"""Turn a downloaded audio stream into a file Telegram's music player accepts.
+
+sendAudio plays MP3 and M4A. AAC, which YouTube and most sites serve, only
+needs a new container: ffmpeg stream-copies it into M4A in a fraction of a
+second without touching quality. MP3 sources are copied as they are.
+Anything else (Opus, Vorbis, ...) is transcoded to MP3, as before.
+"""
+import os
+from dataclasses import dataclass
+
+from services import metrics
+from services.ffmpeg import FFmpegError, ffmpeg_pool
+from services.format_planner import AUDIO_TRANSCODE_KBPS
+
+# CPU seconds per second of audio for an MP3 transcode, until the first real transcode is measured
+DEFAULT_TRANSCODE_COST = 0.02
+# Weight of the newest transcode in the running cost estimate
+COST_SMOOTHING = 0.2
+
+
+def copy_container(metadata: dict):
+    """Extension to stream-copy the audio into, or None when it must be transcoded.
+
+    Direct links often come without codec information; their extension is
+    trusted then, and convert() falls back to a transcode if that was wrong.
+    """
+    acodec = (metadata.get('acodec') or '').lower()
+    if acodec.startswith(('mp4a', 'aac')):
+        return 'm4a'
+    if acodec.startswith('mp3'):
+        return 'mp3'
+    if acodec in ('', 'unknown') and metadata.get('ext') in ('m4a', 'mp3'):
+        return metadata['ext']
+    return None
+
+
+def telegram_tags(metadata: dict) -> dict:
+    """title, performer and duration for sendAudio, from the info dict (or jobs.metadata)."""
+    tags = {
+        'title': metadata.get('track') or metadata.get('title'),
+        'performer': metadata.get('artist') or metadata.get('creator') or metadata.get('uploader'),
+        'duration': int(metadata['duration']) if metadata.get('duration') else None,
+    }
+    return {key: value for key, value in tags.items() if value}
+
+
+@dataclass
+class AudioResult:
+    path: str
+    operation: str  # copy or transcode
+    seconds: float
+    cpu_seconds: float = None
+    cpu_seconds_saved: float = 0.0  # estimated, against transcoding the same audio
+
+
+class AudioConverter:
+    """Converts downloads with an FFmpegPool and keeps track of what a transcode costs.
+
+    The cost per second of audio is learned from real transcodes, so the CPU
+    time a stream copy saved is estimated from this machine's own numbers.
+    """
+
+    def __init__(self, pool=ffmpeg_pool, bitrate_kbps: int = AUDIO_TRANSCODE_KBPS):
+        self.pool = pool
+        self.bitrate_kbps = bitrate_kbps
+        self.transcode_cost = DEFAULT_TRANSCODE_COST
+
+    async def convert(self, path: str, metadata: dict) -> AudioResult:
+        """Write the audio of path as M4A or MP3 next to it and delete path."""
+        container = copy_container(metadata)
+        if container:
+            try:
+                return await self._convert(path, metadata, container)
+            except FFmpegError:
+                # The codec wasn't what the extractor said
+                pass
+        return await self._convert(path, metadata, None)
+
+    async def _convert(self, path, metadata, container):
+        operation = 'copy' if container else 'transcode'
+        base, ext = os.path.splitext(path)
+        target = f"{base}.{container or 'mp3'}"
+        # ffmpeg can't write over its own input
+        output = f"{base}.out.{container or 'mp3'}" if target == path else target
+
+        options = ['-vn', '-map', '0:a:0']
+        if container:
+            options += ['-c:a', 'copy']
+            if container == 'm4a':
+                # Moov atom first, so Telegram can start playing before the whole file is there
+                options += ['-movflags', '+faststart']
+        else:
+            options += ['-c:a', 'libmp3lame', '-b:a', f'{self.bitrate_kbps}k']
+        tags = telegram_tags(metadata)
+        for tag, key in (('title', 'title'), ('artist', 'performer')):
+            if tags.get(key):
+                options += ['-metadata', f'{tag}={tags[key]}']
+        if (container or 'mp3') == 'mp3':
+            options += ['-id3v2_version', '3']
+
+        try:
+            run = await self.pool.run(['-i', path], options + [output], operation=f'audio_{operation}')
+        except BaseException:
+            if os.path.exists(output):
+                os.remove(output)
+            raise
+        os.replace(output, target)
+        if target != path:
+            os.remove(path)
+
+        result = AudioResult(target, operation, run.wall_seconds, run.cpu_seconds)
+        duration = metadata.get('duration')
+        if run.cpu_seconds is not None and duration:
+            if container:
+                result.cpu_seconds_saved = max(duration * self.transcode_cost - run.cpu_seconds, 0.0)
+                metrics.AUDIO_CPU_SAVED.observe(result.cpu_seconds_saved)
+            else:
+                cost = run.cpu_seconds / duration
+                self.transcode_cost += COST_SMOOTHING * (cost - self.transcode_cost)
+        return result
+
+
+audio_converter = AudioConverter()
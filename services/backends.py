@@ -0,0 +1,86 @@
+"""Where the blocking functions in services.jobs get executed.
+
+ThreadBackend runs them on a thread pool, which is enough while downloads are
+network-bound. ProcessBackend runs them in worker processes so pure-Python
+extraction (JSON, player JS, signature deciphering) can use every core
+instead of fighting over the GIL.
+"""
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from services import metrics, pool_worker
+
+
+class ThreadBackend:
+    def __init__(self, workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='yt-dlp')
+        metrics.EXECUTOR_WORKERS.set(workers)
+
+    async def run(self, fn, *args, progress_hook=None):
+        loop = asyncio.get_running_loop()
+        with metrics.EXECUTOR_JOBS.track_inprogress():
+            return await loop.run_in_executor(self.executor, functools.partial(fn, *args, progress_hook=progress_hook))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ProcessBackend:
+    """Runs jobs in a process pool and relays progress events back over a queue.
+
+    Workers are replaced after max_tasks_per_child jobs so leaks in extractors
+    can't grow a worker's memory forever. Progress hooks are invoked on a relay
+    thread, just like the thread backend invokes them on a download thread.
+    Raising from a hook can't reach into the worker, so a download whose
+    callers all went away runs to completion (and still lands in the cache).
+    """
+
+    def __init__(self, workers: int, max_tasks_per_child: int):
+        context = multiprocessing.get_context('spawn')
+        self._queue = context.Queue()
+        self._hooks = {}
+        self._ids = itertools.count()
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=pool_worker.init,
+            initargs=(self._queue,),
+            max_tasks_per_child=max_tasks_per_child,
+        )
+        metrics.EXECUTOR_WORKERS.set(workers)
+        self._relay = threading.Thread(target=self._relay_progress, name='progress-relay', daemon=True)
+        self._relay.start()
+
+    def _relay_progress(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job_id, d = item
+            hook = self._hooks.get(job_id)
+            if hook:
+                try:
+                    hook(d)
+                except Exception:
+                    pass
+
+    async def run(self, fn, *args, progress_hook=None):
+        job_id = None
+        if progress_hook:
+            job_id = next(self._ids)
+            self._hooks[job_id] = progress_hook
+
+        loop = asyncio.get_running_loop()
+        try:
+            with metrics.EXECUTOR_JOBS.track_inprogress():
+                return await loop.run_in_executor(self.executor, pool_worker.run, fn, args, job_id)
+        finally:
+            self._hooks.pop(job_id, None)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self._queue.put(None)
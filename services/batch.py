@@ -0,0 +1,176 @@
+"""Playlists, carousels and messages with several links, handled as one batch.
+
+expand() turns the links into entries lazily: yt-dlp lists a playlist page by
+page, and only as far as the downloads have got. fetch_ordered() downloads a
+few entries at once and hands them back in their original order, so the
+handler can send them as albums of up to MEDIA_GROUP_SIZE, one sendMediaGroup
+call per album. BatchProgress sums everything up in one status message.
+"""
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+
+import yt_dlp
+
+from config import BATCH_MAX_ITEMS
+from services import jobs, metrics
+from services.downloader import downloader as default_downloader
+from services.file_id_cache import file_id_cache
+from utils.urls import canonical_key, canonicalize, detect_platform
+
+# Telegram's limit per sendMediaGroup
+MEDIA_GROUP_SIZE = 10
+PHOTO_EXTS = ('jpg', 'jpeg', 'png', 'webp')
+
+
+@dataclass
+class BatchEntry:
+    url: str
+    key: str  # file_id cache key
+    info: dict = None  # already extracted, so the download skips extraction
+    cached: tuple = None  # (file_id, kind, caption) of an earlier upload
+    error: Exception = None  # the link couldn't be expanded
+
+
+async def expand(urls: list, quality: str, limit: int = BATCH_MAX_ITEMS, downloader=default_downloader):
+    """BatchEntry for every video behind urls, at most limit of them, pulled from yt-dlp as they are consumed."""
+    count = 0
+    for url in urls:
+        parsed = await canonicalize(url)
+        if parsed.video_id and parsed.platform == 'youtube':
+            # Always a single video; yt-dlp runs once, in the download
+            entries = [BatchEntry(parsed.url, parsed.key)]
+        else:
+            entries = _expand(parsed.url, parsed.key, downloader, limit - count)
+        async for entry in _aiter(entries):
+            if entry.error is None and entry.cached is None:
+                entry.cached = file_id_cache.get(entry.key, quality)
+                metrics.cache_lookup('file_id', entry.cached is not None)
+            yield entry
+            count += 1
+            if count >= limit:
+                return
+
+
+async def _aiter(entries):
+    if isinstance(entries, list):
+        for entry in entries:
+            yield entry
+    else:
+        async for entry in entries:
+            yield entry
+
+
+async def _expand(url, key, downloader, limit):
+    account = downloader.cookies.checkout(detect_platform(url))
+    entries = jobs.iter_entries(url, downloader.ydl_opts, account.cookies if account else None, limit)
+    try:
+        while True:
+            try:
+                # Each step may fetch the next page of the playlist
+                entry = await asyncio.to_thread(next, entries, None)
+            except yt_dlp.utils.DownloadError as e:
+                downloader.cookies.report_failure(account, e)
+                metrics.count_error('extract', e)
+                yield BatchEntry(url, key, error=e)
+                return
+            if entry is None:
+                return
+            if entry.get('_type') in ('url', 'url_transparent'):
+                yield BatchEntry(entry['url'], canonical_key(entry['url']))
+            elif entry.get('playlist_index') is None:
+                # url was a single video after all
+                yield BatchEntry(url, key, info=entry)
+            else:
+                yield BatchEntry(url, f"{(entry.get('extractor_key') or '').lower()}:{entry.get('id')}", info=entry)
+    finally:
+        try:
+            entries.close()
+        except ValueError:
+            # Still running on its thread (we were cancelled); it stops at the next step
+            pass
+
+
+async def fetch_ordered(entries, fetch, parallelism: int):
+    """Yield (entry, result or exception) in the order of entries, with up to parallelism fetch(entry) running.
+
+    The next entry is only pulled once the oldest one is handed out, so a
+    long playlist is never expanded, or downloaded, far ahead of the sending.
+    """
+    pending = deque()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < parallelism:
+                try:
+                    entry = await entries.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.append((entry, asyncio.ensure_future(fetch(entry))))
+            if not pending:
+                return
+            entry, task = pending.popleft()
+            try:
+                result = await task
+            except Exception as e:
+                result = e
+            yield entry, result
+    finally:
+        for _, task in pending:
+            task.cancel()
+        await entries.aclose()
+
+
+def media_kind(quality: str, path: str) -> str:
+    """audio, photo or video: how a downloaded file goes into an album."""
+    if quality == 'audio':
+        return 'audio'
+    return 'photo' if path.rsplit('.', 1)[-1].lower() in PHOTO_EXTS else 'video'
+
+
+class BatchProgress:
+    """Counters of one batch, rendered into its status message through a ProgressJob.
+
+    hook() returns a yt-dlp progress hook per entry; like ProgressJob, they
+    may run on any thread and only store numbers.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.found = 0
+        self.downloaded = 0
+        self.failed = 0
+        self.sent = 0
+        self.expanding = True
+        self._bytes = {}
+
+    def hook(self, index: int):
+        def progress_hook(d):
+            if d.get('status') == 'downloading':
+                self._bytes[index] = d.get('downloaded_bytes') or 0
+                self.update()
+        return progress_hook
+
+    def finish(self, index: int, failed: bool = False):
+        self._bytes.pop(index, None)
+        if failed:
+            self.failed += 1
+        else:
+            self.downloaded += 1
+        self.update()
+
+    def update(self):
+        self.job.set_text(self.render())
+
+    def render(self) -> str:
+        found = f"{self.found}+" if self.expanding else str(self.found)
+        text = f"📦 {self.downloaded}/{found} downloaded"
+        if self.failed:
+            text += f", {self.failed} failed"
+        if self.sent:
+            text += f", {self.sent} sent"
+        active = list(self._bytes.values())
+        if active:
+            text += f"\n⬇️ {len(active)} downloading ({sum(active) / (1024 * 1024):.1f}MB so far)"
+        return text
@@ -0,0 +1,58 @@
+"""Settings for the Bot API server the bots talk to.
+
+Both bots build their HTTP clients from here, so switching to a self-hosted
+telegram-bot-api server is a matter of configuration.
+"""
+import os
+from dataclasses import dataclass
+
+from config import (
+    TELEGRAM_API_URL, TELEGRAM_API_LOCAL, BOT_API_CONNECT_TIMEOUT, BOT_API_READ_TIMEOUT, UPLOAD_LIMIT_BYTES,
+)
+
+
+@dataclass
+class BotApiBackend:
+    base_url: str = None  # None means api.telegram.org
+    is_local: bool = False
+    upload_limit: int = UPLOAD_LIMIT_BYTES
+    connect_timeout: float = BOT_API_CONNECT_TIMEOUT
+    read_timeout: float = BOT_API_READ_TIMEOUT
+
+    def create_session(self):
+        """aiohttp session for aiogram with this backend's server and timeouts."""
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+        from aiohttp import ClientTimeout
+
+        # total=None disables the total operation timeout, uploads can take a while;
+        # sock_read is how long we wait for data, e.g. Telegram's reply after an upload
+        timeout = ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.read_timeout)
+        api = TelegramAPIServer.from_base(self.base_url, is_local=self.is_local) if self.base_url else PRODUCTION
+        return AiohttpSession(api=api, timeout=timeout)
+
+    def configure_builder(self, builder):
+        """Apply this backend to a python-telegram-bot ApplicationBuilder."""
+        builder = builder.connect_timeout(self.connect_timeout).read_timeout(self.read_timeout)
+        builder = builder.write_timeout(self.read_timeout)
+        if self.base_url:
+            base = self.base_url.rstrip('/')
+            builder = builder.base_url(f"{base}/bot").base_file_url(f"{base}/file/bot")
+        if self.is_local:
+            builder = builder.local_mode(True)
+        return builder
+
+    def input_file(self, path: str, progress_callback=None):
+        """What to pass to answer_video/answer_audio for a file on disk.
+
+        A local server reads the file itself, so only its path is sent; otherwise
+        the bytes are streamed in the request body.
+        """
+        if self.is_local:
+            return f"file://{os.path.abspath(path)}"
+
+        from utils.progress import ProgressInputFile
+        return ProgressInputFile(path, progress_callback)
+
+
+bot_api = BotApiBackend(TELEGRAM_API_URL, TELEGRAM_API_LOCAL)
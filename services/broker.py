@@ -0,0 +1,235 @@
+"""Queues between the dispatcher (bot.py, receives updates) and the download workers (worker.py).
+
+The dispatcher pushes each job onto the queue of one shard, chosen from the
+canonical video id, so the same video always lands on the same workers and
+their media, info and file_id caches stay hot. Workers push the edits of the
+job's status message back onto one events queue, which the dispatcher
+applies. Messages are JSON.
+
+Workers take() jobs rather than pop() them: a taken job stays on the
+worker's own list until it is ack()ed, so a worker killed in between finds
+it again on its next start (taken()).
+
+InProcessBroker keeps the queues in memory, for running both roles in one
+process. RedisBroker uses Redis lists over a small RESP client, so anything
+speaking the Redis protocol (Redis, Valkey, KeyDB, a stand-in in tests) works.
+"""
+import asyncio
+import hashlib
+import json
+from collections import defaultdict
+from urllib.parse import urlparse, unquote
+
+from config import BROKER_URL
+
+EVENTS_QUEUE = 'bot:events'
+CONNECT_TIMEOUT = 10
+
+
+def jobs_queue(shard: int) -> str:
+    return f'bot:jobs:{shard}'
+
+
+def taken_list(queue: str, holder: str) -> str:
+    return f'{queue}:taken:{holder}'
+
+
+def shard_for(key: str, shards: int) -> int:
+    """Shard of a canonical video key (utils.urls.ParsedURL.key); stable across processes and restarts."""
+    return int(hashlib.sha1(key.encode()).hexdigest()[:8], 16) % shards
+
+
+class BrokerError(Exception):
+    """The broker refused a command or can't be reached."""
+
+
+class Broker:
+    async def push(self, queue: str, message: dict):
+        """Append message to queue."""
+        raise NotImplementedError
+
+    async def pop(self, queue: str, timeout: float = 0):
+        """Oldest message of queue, waiting up to timeout seconds (0: forever); None on timeout."""
+        raise NotImplementedError
+
+    async def take(self, queue: str, holder: str, timeout: float = 0):
+        """Like pop(), but the message also moves to holder's taken list until ack()."""
+        raise NotImplementedError
+
+    async def ack(self, queue: str, holder: str, message: dict):
+        """Drop a message taken from queue off holder's taken list."""
+        raise NotImplementedError
+
+    async def taken(self, queue: str, holder: str) -> list:
+        """Messages holder took from queue and never acked, oldest first."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class InProcessBroker(Broker):
+    def __init__(self):
+        self._queues = defaultdict(asyncio.Queue)
+        self._taken = defaultdict(list)
+
+    async def push(self, queue: str, message: dict):
+        # Through JSON like the other brokers, so nothing works here that wouldn't work across processes
+        self._queues[queue].put_nowait(json.dumps(message))
+
+    async def pop(self, queue: str, timeout: float = 0):
+        try:
+            data = await asyncio.wait_for(self._queues[queue].get(), timeout or None)
+        except asyncio.TimeoutError:
+            return None
+        return json.loads(data)
+
+    async def take(self, queue: str, holder: str, timeout: float = 0):
+        message = await self.pop(queue, timeout)
+        if message is not None:
+            self._taken[taken_list(queue, holder)].append(json.dumps(message))
+        return message
+
+    async def ack(self, queue: str, holder: str, message: dict):
+        taken = self._taken[taken_list(queue, holder)]
+        data = json.dumps(message)
+        if data in taken:
+            taken.remove(data)
+
+    async def taken(self, queue: str, holder: str) -> list:
+        return [json.loads(data) for data in self._taken[taken_list(queue, holder)]]
+
+
+class RedisBroker(Broker):
+    """Queues as Redis lists: LPUSH to add, BRPOP to pop, BRPOPLPUSH to take.
+
+    ack() removes the message from the taken list by value; json.loads and
+    json.dumps round-trip what push() wrote, so that is the same string.
+
+    A blocked BRPOP holds its connection, so connections are pooled and
+    every command takes one of its own.
+    """
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self._idle = []
+
+    async def push(self, queue: str, message: dict):
+        await self._command('LPUSH', queue, json.dumps(message))
+
+    async def pop(self, queue: str, timeout: float = 0):
+        reply = await self._command('BRPOP', queue, f'{timeout:g}')
+        if reply is None:
+            return None
+        return json.loads(reply[1])
+
+    async def take(self, queue: str, holder: str, timeout: float = 0):
+        # BRPOPLPUSH rather than BLMOVE: the same thing, and servers before Redis 6.2 have it too
+        reply = await self._command('BRPOPLPUSH', queue, taken_list(queue, holder), f'{timeout:g}')
+        if reply is None:
+            return None
+        return json.loads(reply)
+
+    async def ack(self, queue: str, holder: str, message: dict):
+        await self._command('LREM', taken_list(queue, holder), 1, json.dumps(message))
+
+    async def taken(self, queue: str, holder: str) -> list:
+        taken = await self._command('LRANGE', taken_list(queue, holder), 0, -1)
+        # Pushed onto the head, so the oldest is last
+        return [json.loads(data) for data in reversed(taken)]
+
+    async def close(self):
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+    async def _command(self, *args):
+        connection = self._idle.pop() if self._idle else await self._connect()
+        reader, writer = connection
+        try:
+            writer.write(_encode(args))
+            await writer.drain()
+            reply = await _read_reply(reader)
+        except (OSError, asyncio.IncompleteReadError) as e:
+            writer.close()
+            raise BrokerError(f"Lost the connection to the broker: {e}") from e
+        except BaseException:
+            # Cancelled mid-command (e.g. in BRPOP) or an error reply: the connection's state is unknown
+            writer.close()
+            raise
+        self._idle.append(connection)
+        return reply
+
+    async def _connect(self):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise BrokerError(f"Can't connect to the broker at {self.host}:{self.port}: {e}") from e
+        setup = []
+        if self.password:
+            setup.append(('AUTH', self.password))
+        if self.db:
+            setup.append(('SELECT', self.db))
+        try:
+            for command in setup:
+                writer.write(_encode(command))
+                await writer.drain()
+                await _read_reply(reader)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+
+def _encode(args) -> bytes:
+    parts = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(parts)
+
+
+async def _read_reply(reader):
+    line = await reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise BrokerError('The broker closed the connection')
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        raise BrokerError(rest.decode(errors='replace'))
+    if kind == b':':
+        return int(rest)
+    if kind == b'$':
+        length = int(rest)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b'*':
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(length)]
+    if kind == b'_':
+        # RESP3 null
+        return None
+    raise BrokerError(f'Unexpected reply from the broker: {line[:80]!r}')
+
+
+def create_broker(url: str):
+    """Broker for BROKER_URL: None (no split, the bot downloads itself), memory:// or redis://."""
+    if not url:
+        return None
+    scheme = urlparse(url).scheme
+    if scheme == 'memory':
+        return InProcessBroker()
+    if scheme == 'redis':
+        return RedisBroker(url)
+    raise ValueError(f"Unsupported BROKER_URL scheme: {scheme!r} (use memory:// or redis://)")
+
+
+broker = create_broker(BROKER_URL)
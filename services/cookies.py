@@ -0,0 +1,137 @@
+"""Pool of logged-in cookie sets, one or more accounts per platform.
+
+Each cookie set is parsed once at startup and handed to yt-dlp as a list of
+Cookie objects, so nothing is written to disk per request. Accounts are used
+in turn to spread the load, and an account that hits a rate limit or a bot
+check is left alone for a cooldown.
+"""
+import glob
+import io
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+
+from yt_dlp.cookies import YoutubeDLCookieJar
+
+from config import COOKIE_DIR, COOKIE_ROTATION, COOKIE_COOLDOWN
+
+logger = logging.getLogger(__name__)
+
+PLATFORMS = ('youtube', 'instagram')
+
+# Errors that mean "this account is burnt for now", not "this video is broken". Content that
+# needs a login ("Sign in to confirm your age", "log in to see this post") says nothing about the
+# account; that is left to the info cache's negative entries, or one such video cools every account down
+ACCOUNT_FAILURES = re.compile(
+    r"http error 429|too many requests|rate.?limit reached|confirm you(?:'|\u2019)?re not a bot"
+    r"|cookies are no longer valid|checkpoint required",
+    re.IGNORECASE,
+)
+
+
+@dataclass(eq=False)
+class CookieAccount:
+    platform: str
+    name: str  # env variable or file the cookies came from, for logs
+    cookies: list = field(default_factory=list)  # http.cookiejar.Cookie objects, picklable
+    last_used: float = 0.0
+    unhealthy_until: float = 0.0
+    failures: int = 0
+
+    @property
+    def healthy(self) -> bool:
+        return self.unhealthy_until <= time.time()
+
+
+def parse_cookies(text: str) -> list:
+    """Parse a Netscape cookies.txt (what extract_cookies.py writes) into Cookie objects."""
+    jar = YoutubeDLCookieJar()
+    jar.load(io.StringIO(text))
+    return list(jar)
+
+
+def load_accounts(directory: str = COOKIE_DIR, environ=os.environ) -> list:
+    """Cookie sets from YOUTUBE_COOKIES, YOUTUBE_COOKIES_2, ... and youtube_cookies*.txt
+    (same for Instagram); a broken set is logged and skipped."""
+    sources = []
+    for platform in PLATFORMS:
+        prefix = f'{platform.upper()}_COOKIES'
+        names = [name for name in environ if re.fullmatch(rf'{prefix}(?:_\d+)?', name) and environ[name].strip()]
+        for name in sorted(names, key=lambda name: int(name[len(prefix) + 1:] or 1)):
+            sources.append((platform, name, environ[name]))
+        for path in sorted(glob.glob(os.path.join(directory, f'{platform}_cookies*.txt'))):
+            with open(path) as f:
+                sources.append((platform, os.path.basename(path), f.read()))
+
+    accounts = []
+    for platform, name, text in sources:
+        try:
+            cookies = parse_cookies(text)
+        except Exception as e:
+            logger.warning(f"Skipping {platform} cookies from {name}: {e}")
+            continue
+        if cookies:
+            accounts.append(CookieAccount(platform, name, cookies))
+    return accounts
+
+
+class CookiePool:
+    """Hands out cookie accounts per platform, round-robin or least recently used.
+
+    Used from the event loop only. checkout() returns None when a platform has
+    no accounts or all of them are cooling down; the download then runs
+    without cookies, as it did before accounts existed.
+    """
+
+    def __init__(self, accounts: list, rotation: str = COOKIE_ROTATION, cooldown: float = COOKIE_COOLDOWN):
+        self.rotation = rotation
+        self.cooldown = cooldown
+        self._accounts = {}
+        self._next = {}
+        for account in accounts:
+            self._accounts.setdefault(account.platform, []).append(account)
+
+    def checkout(self, platform: str):
+        accounts = self._accounts.get(platform) or []
+        healthy = [account for account in accounts if account.healthy]
+        if not healthy:
+            return None
+
+        if self.rotation == 'lru':
+            account = min(healthy, key=lambda account: account.last_used)
+        else:
+            # Round-robin over the whole list, skipping accounts that are cooling down
+            start = self._next.get(platform, 0)
+            account = next(accounts[(start + i) % len(accounts)] for i in range(len(accounts))
+                           if accounts[(start + i) % len(accounts)].healthy)
+            self._next[platform] = (accounts.index(account) + 1) % len(accounts)
+        account.last_used = time.time()
+        return account
+
+    def report_failure(self, account, error: Exception) -> bool:
+        """Put account on cooldown if error is its fault; return whether it was."""
+        if account is None or not ACCOUNT_FAILURES.search(str(error)):
+            return False
+        account.failures += 1
+        account.unhealthy_until = time.time() + self.cooldown
+        logger.warning(f"{account.platform} cookies from {account.name} cooling down for "
+                       f"{self.cooldown:.0f}s after: {str(error)[:200]}")
+        return True
+
+    def report_success(self, account):
+        if account is not None:
+            account.failures = 0
+
+    def stats(self):
+        return {
+            platform: {
+                'accounts': len(accounts),
+                'healthy': sum(account.healthy for account in accounts),
+            }
+            for platform, accounts in self._accounts.items()
+        }
+
+
+cookie_pool = CookiePool(load_accounts())
@@ -1,16 +1,73 @@
 import yt_dlp
+import math
 import os
 import asyncio
+import threading
+import time
+from config import DOWNLOAD_WORKERS, DOWNLOADER_BACKEND, PROCESS_POOL_MAX_TASKS, UPLOAD_LIMIT_BYTES, PIPE_UPLOADS
+from config import (
+    DOWNLOAD_ACCELERATOR, SEGMENT_CONNECTIONS, SEGMENT_CHUNK_SIZE, CONCURRENT_FRAGMENTS, HTTP_CHUNK_SIZE,
+    DOWNLOAD_BUFFER_SIZE, TRANSCODE_SOURCE_HEIGHT,
+)
+from services import jobs, metrics
+from services.audio import audio_converter
+from services.backends import ThreadBackend, ProcessBackend
+from services.cookies import cookie_pool
+from services.ffmpeg import FFmpegError, probe
+from services.format_planner import FormatTooLarge, plan_formats, selection_size
+from services.info_cache import info_cache
+from services.jobs import DownloadJob, DownloadResult
+from services.media_cache import media_cache
+from services.segmented import SegmentSettings
+from services.thumbnails import thumbnail_cache
+from services.transcode import transcoder
+from services.workspace import workspaces
+from services.pipe import PipeSource, PipeInputFile, cookie_header
+from utils.urls import canonical_key, detect_platform
+
+class PlaylistLink(Exception):
+    """The link stands for several videos (playlist, carousel); see services.batch."""
+
+class _Flight:
+    """One running download shared by every caller asking for the same video and quality."""
 
-class Downloader:
     def __init__(self):
+        self.task = None
+        self.hooks = []
+        self.waiters = 0
+        self.cancelled = threading.Event()
+
+    def progress_hook(self, d):
+        # Runs on the download thread; raising here is how yt-dlp aborts a download
+        if self.cancelled.is_set():
+            raise yt_dlp.utils.DownloadCancelled()
+        for hook in list(self.hooks):
+            try:
+                hook(d)
+            except Exception:
+                pass
+
+class Downloader:
+    def __init__(self, cache=media_cache, infos=info_cache, cookies=cookie_pool, workspaces=workspaces,
+                 thumbnails=thumbnail_cache, audio=audio_converter, transcoder=transcoder):
+        self.cache = cache
+        self.audio = audio
+        self.transcoder = transcoder
+        self.thumbnails = thumbnails
+        self.infos = infos
+        self.cookies = cookies
+        self.workspaces = workspaces
+        self._inflight = {}
+        # Piped uploads running, by media cache key: resolved once the stream is over (see finish_pipe)
+        self._pipes = {}
+        self._backend = None
         self.ydl_opts = {
             'format': 'best',
-            'outtmpl': 'downloads/%(title)s.%(ext)s',
             'noplaylist': True,
+            # A playlist slipping through costs one listing, not an extraction of every video in it
+            'extract_flat': 'in_playlist',
             'quiet': True,
-            'quiet': True,
-            'writethumbnail': True,
+            'noprogress': True,
             'extractor_args': {
                 'youtube': {
                     'player_client': ['android_creator', 'android', 'ios'],
@@ -18,48 +75,342 @@ class Downloader:
             },
             'merge_output_format': 'mp4',
         }
+        self.segments = None
+        if DOWNLOAD_ACCELERATOR:
+            self.ydl_opts.update({
+                'concurrent_fragment_downloads': CONCURRENT_FRAGMENTS,
+                'http_chunk_size': HTTP_CHUNK_SIZE,
+                'buffersize': DOWNLOAD_BUFFER_SIZE,
+            })
+            self.segments = SegmentSettings(SEGMENT_CONNECTIONS, SEGMENT_CHUNK_SIZE, DOWNLOAD_BUFFER_SIZE)
+
+    @property
+    def backend(self):
+        # Dedicated pool so downloads don't compete with the loop's default executor.
+        # Started on first use, not on import: nothing else importing this module wants a pool
+        if self._backend is None:
+            if DOWNLOADER_BACKEND == 'process':
+                self._backend = ProcessBackend(DOWNLOAD_WORKERS, PROCESS_POOL_MAX_TASKS)
+            else:
+                self._backend = ThreadBackend(DOWNLOAD_WORKERS)
+        return self._backend
+
+    def shutdown(self):
+        if self._backend is not None:
+            self._backend.shutdown()
+            self._backend = None
 
     async def get_info(self, url):
-        loop = asyncio.get_event_loop()
-        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-            return await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=False))
+        info, _ = await self._extract(url, self.ydl_opts)
+        return info
+
+    async def _extract(self, url, opts):
+        """Return (info, cookie account to download with, or None)."""
+        key = canonical_key(url)
+        platform = detect_platform(url)
+        account = self.cookies.checkout(platform)
+        info = self.infos.get(key)
+        metrics.cache_lookup('info', info is not None)
+        if info is not None:
+            if info.get('_type') in ('playlist', 'multi_video'):
+                raise PlaylistLink(url)
+            return info, account
+
+        retried = False
+        while True:
+            try:
+                with metrics.timed('extract', platform or 'other'):
+                    info = await self.backend.run(jobs.extract_info, url, opts, account.cookies if account else None)
+                break
+            except yt_dlp.utils.DownloadError as e:
+                if self.cookies.report_failure(account, e) and not retried:
+                    # That account is resting now, try once more with the next one (or none)
+                    retried = True
+                    account = self.cookies.checkout(platform)
+                    continue
+                self.infos.put_failure(key, e)
+                raise
+        self.cookies.report_success(account)
+        info = self.infos.put(key, info)
+        if info.get('_type') in ('playlist', 'multi_video'):
+            raise PlaylistLink(url)
+        return info, account
+
+    async def download_video(self, url, quality='best', progress_hook=None, extra_opts=None, info=None):
+        """Download url, joining an identical download that is already running.
+
+        extra_opts are merged into the yt-dlp options (e.g. a cookiefile); they
+        must not change which bytes are downloaded, since a caller joining a
+        running download doesn't get its own. info skips the extraction for a
+        video that is already extracted (see jobs.iter_entries). Every caller
+        gets its own cache reference on the returned file and must hand it
+        back with release(). Raises PlaylistLink for a link to several videos.
+        """
+        # Carousel items share their post's link, only the info tells them apart
+        video = f"{info.get('extractor_key')}:{info.get('id')}" if info else canonical_key(url)
+        key = (video, quality)
+        flight = self._inflight.get(key)
+        # A "hit" joins a download that is already running
+        metrics.cache_lookup('inflight', flight is not None)
+        if flight is None:
+            flight = _Flight()
+            self._inflight[key] = flight
+            flight.task = asyncio.ensure_future(self._run_flight(key, flight, url, quality, extra_opts, info))
 
-    async def download_video(self, url, quality='best', progress_hook=None):
-        opts = self.ydl_opts.copy()
-        
         if progress_hook:
-            opts['progress_hooks'] = [progress_hook]
+            flight.hooks.append(progress_hook)
+        flight.waiters += 1
+        try:
+            # shield: one caller going away must not cancel the download for the others
+            result = await asyncio.shield(flight.task)
+            self.cache.retain(result.path)
+            return result
+        finally:
+            flight.waiters -= 1
+            if progress_hook in flight.hooks:
+                flight.hooks.remove(progress_hook)
+            if flight.waiters == 0:
+                if not flight.task.done():
+                    # Last interested caller is gone, stop the download
+                    flight.cancelled.set()
+                    flight.task.cancel()
+                elif not flight.task.cancelled() and flight.task.exception() is None:
+                    # Drop the reference the shared download itself was holding
+                    self.cache.release(flight.task.result().path)
+
+    async def _run_flight(self, key, flight, url, quality, extra_opts=None, info=None):
+        try:
+            return await self._download(url, quality, flight.progress_hook, extra_opts, info)
+        finally:
+            # Unregister before waiters wake up so new callers go to the media cache
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+
+    def _build_opts(self, quality, extra_opts=None):
+        opts = self.ydl_opts.copy()
+        opts.update(extra_opts or {})
 
         if quality == 'audio':
-            opts['format'] = 'bestaudio/best'
-            opts['postprocessors'] = [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'mp3',
-                'preferredquality': '192',
-            }]
+            # AAC only needs a remux afterwards (see services.audio), anything else a transcode
+            opts['format'] = 'bestaudio[acodec^=mp4a]/bestaudio/best'
         elif quality != 'best':
-             opts['format'] = f'bestvideo[height<={quality}]+bestaudio/best[height<={quality}]'
-        
-        loop = asyncio.get_event_loop()
-        with yt_dlp.YoutubeDL(opts) as ydl:
-            info = await loop.run_in_executor(None, lambda: ydl.extract_info(url, download=True))
-            filename = ydl.prepare_filename(info)
-            
-            # Handle thumbnail
-            thumbnail_path = None
-            if info.get('thumbnail'):
-                # yt-dlp saves thumbnail as filename.jpg/webp etc.
-                # We need to find it.
-                base_filename = os.path.splitext(filename)[0]
-                for ext in ['jpg', 'jpeg', 'png', 'webp']:
-                    potential_thumb = f"{base_filename}.{ext}"
-                    if os.path.exists(potential_thumb):
-                        thumbnail_path = potential_thumb
-                        break
-
-            if quality == 'audio':
-                filename = os.path.splitext(filename)[0] + '.mp3'
-                
-            return filename, info.get('title'), thumbnail_path
+             opts['format'] = f'bestvideo[height<={quality}]+bestaudio/best[height<={quality}]/best'
+        return opts
+
+    async def _prepare(self, url, quality, extra_opts=None, info=None):
+        """Extract url (unless info is given) and settle the exact format.
+
+        Returns (info, opts, media cache key, cookie account).
+        """
+        opts = self._build_opts(quality, extra_opts)
+        if info is None:
+            info, account = await self._extract(url, opts)
+        else:
+            account = self.cookies.checkout(detect_platform(url))
+
+        # Choose a concrete format that fits the upload limit now, instead of
+        # finding out after the whole download (raises FormatTooLarge)
+        try:
+            plan = plan_formats(info, quality, UPLOAD_LIMIT_BYTES)
+        except FormatTooLarge:
+            if quality == 'audio' or not self.transcoder.can_fit(info.get('duration'), UPLOAD_LIMIT_BYTES):
+                raise
+            # Download a version worth re-encoding; it is shrunk to fit afterwards
+            height = min(int(quality), TRANSCODE_SOURCE_HEIGHT) if quality.isdigit() else TRANSCODE_SOURCE_HEIGHT
+            plan = plan_formats(info, str(height), math.inf)
+        if plan:
+            opts['format'] = plan.selector
+
+        # Same video + same format selector means the same bytes, so serve it from disk
+        format_selector = opts['format'] + (':audio' if quality == 'audio' else '')
+        key = self.cache.make_key(info.get('extractor_key'), info.get('id'), format_selector)
+        return info, opts, key, account
+
+    async def _download(self, url, quality, progress_hook, extra_opts=None, info=None):
+        info, opts, key, account = await self._prepare(url, quality, extra_opts, info)
+        # Fetched and resized while the video downloads, it's ready long before the upload
+        thumbnail = asyncio.ensure_future(self.thumbnails.get(info))
+        try:
+            return await self._download_media(url, quality, progress_hook, info, opts, key, account, thumbnail)
+        finally:
+            thumbnail.cancel()
+
+    async def _download_media(self, url, quality, progress_hook, info, opts, key, account, thumbnail):
+        cached = self.cache.acquire(key)
+        metrics.cache_lookup('media', cached is not None)
+        if cached:
+            metadata = jobs.metadata(info)
+            if quality != 'audio':
+                if cached.metadata is None:
+                    # Published before probes were kept with the entry
+                    cached.metadata = await self._probed(cached.path)
+                metadata.update(cached.metadata)
+            return DownloadResult(cached.path, info.get('title'), await thumbnail, metadata)
+
+        # Merging, audio conversion and re-encoding write a second file next to the download
+        size = selection_size(info, opts['format'])
+        if size and (quality == 'audio' or '+' in opts['format']):
+            size *= 2
+        if size and size > UPLOAD_LIMIT_BYTES:
+            size += UPLOAD_LIMIT_BYTES
+        try:
+            # The workspace is deleted on the way out (after publish() its files live in the cache),
+            # unless cancelled: it is named after the media, so the job run again after a restart resumes it
+            async with self.workspaces.workspace(size, name=key) as workspace:
+                job = DownloadJob(info, opts, workspace.path, cookies=account.cookies if account else [],
+                                  segments=self.segments)
+                result = await self.backend.run(jobs.download, job, progress_hook=progress_hook)
+                downloaded = os.path.getsize(result.path)
+                if quality == 'audio':
+                    converted = await self.audio.convert(result.path, result.metadata)
+                    result.path = converted.path
+                    result.timings['postprocess'] = result.timings.get('postprocess', 0) + converted.seconds
+                    probed = None
+                else:
+                    probed = await self._fit(result, progress_hook)
+                cached = self.cache.publish(key, workspace.path, result.path, result.title, probed)
+        except Exception as e:
+            metrics.count_error('download', e)
+            if isinstance(e, yt_dlp.utils.DownloadError):
+                self.cookies.report_failure(account, e)
+            raise
+
+        platform = metrics.platform_label(url)
+        for stage, seconds in result.timings.items():
+            metrics.observe(stage, platform, seconds)
+        metrics.BYTES.labels('downloaded').inc(downloaded)
+        return DownloadResult(cached.path, result.title, await thumbnail, result.metadata)
+
+    async def _fit(self, result, progress_hook=None):
+        """Re-encode a video over the upload limit (when enabled) and put its real dimensions in the metadata.
+
+        Returns what ffprobe found, for the media cache to keep.
+        """
+        try:
+            media = await probe(result.path)
+        except FFmpegError:
+            media = None
+        if os.path.getsize(result.path) > UPLOAD_LIMIT_BYTES and self.transcoder.enabled:
+            if progress_hook:
+                progress_hook({'status': 'transcoding'})
+            started = time.monotonic()
+            result.path = await self.transcoder.fit(result.path, UPLOAD_LIMIT_BYTES, media)
+            result.timings['transcode'] = time.monotonic() - started
+            media = await probe(result.path)
+        probed = media.metadata() if media else {}
+        result.metadata.update(probed)
+        return probed
+
+    @staticmethod
+    async def _probed(path) -> dict:
+        """The width, height and duration ffprobe finds in path."""
+        try:
+            media = await probe(path)
+        except FFmpegError:
+            # No ffprobe: the extractor's numbers will have to do
+            return {}
+        return media.metadata()
+
+    async def pipe_source(self, url, quality):
+        """Return a PipeSource if url is a single progressive HTTP file that can be
+        streamed straight into the upload, otherwise None."""
+        if not PIPE_UPLOADS or quality == 'audio':
+            return None
+        flight_key = (canonical_key(url), quality)
+        if flight_key in self._inflight:
+            # Already being downloaded (or piped): join that through download_video instead
+            return None
+
+        info, opts, key, _ = await self._prepare(url, quality)
+        if self.cache.contains(key) or flight_key in self._inflight:
+            # Already on disk, the regular path is cheaper
+            return None
+
+        formats = info.get('formats') or []
+        fmt = next((f for f in formats if f.get('format_id') == opts['format']), None)
+        if fmt is None and not formats:
+            # A single-format result: its fields are at the top level (see info_cache.trim_info)
+            fmt = info
+        elif fmt is None and len(formats) == 1:
+            # No plan was made, but there is nothing else yt-dlp could pick either. The top-level
+            # fields are no guide: they are the pick for whichever quality was extracted first
+            fmt = formats[0]
+        if not fmt or fmt.get('protocol') not in ('http', 'https') or not fmt.get('url'):
+            return None
+        if fmt.get('vcodec') == 'none' or fmt.get('acodec') == 'none':
+            # Needs a merge with another stream
+            return None
+        if (fmt.get('filesize') or 0) > UPLOAD_LIMIT_BYTES:
+            # Has to be re-encoded first
+            return None
+
+        headers = dict(fmt.get('http_headers') or {})
+        if fmt.get('cookies'):
+            headers['Cookie'] = cookie_header(fmt['cookies'])
+        source = PipeSource(
+            url=fmt['url'],
+            filename=f"{info.get('id')}.{fmt.get('ext') or 'mp4'}",
+            title=info.get('title'),
+            cache_key=key,
+            headers=headers,
+            size=fmt.get('filesize'),
+            metadata=dict(jobs.metadata(info), **{key: fmt[key] for key in ('width', 'height') if fmt.get(key)}),
+        )
+        # Registered as the download of this video, so callers arriving meanwhile wait for the
+        # pipe's file instead of fetching the same bytes a second time
+        done = asyncio.get_running_loop().create_future()
+        self._pipes[key] = done
+        flight = _Flight()
+        self._inflight[flight_key] = flight
+        flight.task = asyncio.ensure_future(self._follow_pipe(flight_key, flight, done, url, quality, info))
+        return source
+
+    async def _follow_pipe(self, key, flight, done, url, quality, info):
+        """Flight of a piped upload: callers who joined it get the file the pipe leaves in the media cache."""
+        try:
+            await done
+        finally:
+            if self._inflight.get(key) is flight:
+                del self._inflight[key]
+        if flight.waiters == 0:
+            # Nobody joined; nothing to hand out
+            return None
+        # A complete stream was published to the media cache; after a failed one this downloads again
+        return await self._download(url, quality, flight.progress_hook, info=info)
+
+    async def pipe_file(self, source, progress_callback=None):
+        """PipeInputFile for source, spilling to a job workspace; hand it to finish_pipe() when done."""
+        try:
+            workspace = await self.workspaces.open(source.size)
+        except BaseException:
+            self._end_pipe(source)
+            raise
+        return PipeInputFile(source, UPLOAD_LIMIT_BYTES, os.path.join(workspace.path, source.filename),
+                             progress_callback)
+
+    def finish_pipe(self, media_file):
+        """Keep a completely streamed file in the media cache, drop partial spills."""
+        staging = os.path.dirname(media_file.spill_path)
+        try:
+            if media_file.complete:
+                # Not probed: the numbers the file was just sent with, the extractor's
+                source = media_file.source
+                probed = {key: source.metadata[key] for key in ('width', 'height', 'duration')
+                          if key in source.metadata}
+                cached = self.cache.publish(source.cache_key, staging, media_file.spill_path, source.title, probed)
+                self.cache.release(cached.path)
+        finally:
+            self.workspaces.close(staging)
+            self._end_pipe(media_file.source)
+
+    def _end_pipe(self, source):
+        done = self._pipes.pop(source.cache_key, None)
+        if done is not None and not done.done():
+            done.set_result(None)
+
+    def release(self, file_path):
+        """Tell the cache a file returned by download_video is no longer in use."""
+        self.cache.release(file_path)
 
 downloader = Downloader()
+metrics.INFLIGHT_DOWNLOADS.set_function(lambda: len(downloader._inflight))
@@ -0,0 +1,200 @@
+"""A bounded pool of ffmpeg child processes with CPU accounting.
+
+At most `workers` ffmpeg processes run at once, each capped to `threads`
+threads and started under nice, so a few long encodes can't starve the event
+loop or the download workers. The CPU time of every run is read from
+os.wait4, which reports what the child (and only the child) really used.
+probe() asks ffprobe what a media file really contains.
+"""
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from config import FFMPEG_PATH, FFPROBE_PATH, FFMPEG_WORKERS, FFMPEG_THREADS, FFMPEG_NICE, FFMPEG_TIMEOUT
+from services import metrics
+
+# ffmpeg's complaints are short with -loglevel error; keep the tail for the exception
+STDERR_TAIL = 2000
+PROBE_TIMEOUT = 30
+
+
+class FFmpegError(Exception):
+    """ffmpeg failed, timed out or isn't installed."""
+
+
+@dataclass
+class FFmpegRun:
+    cpu_seconds: float  # user + system time of the ffmpeg process, None where os.wait4 is missing
+    wall_seconds: float
+
+
+@dataclass
+class MediaProbe:
+    duration: float = None
+    width: int = None  # as displayed, i.e. after applying the rotation
+    height: int = None
+    vcodec: str = None
+    acodec: str = None
+    bitrate: int = None  # bits per second, whole file
+
+    def metadata(self) -> dict:
+        """The fields Telegram's sendVideo takes, in jobs.metadata style."""
+        fields = {'width': self.width, 'height': self.height, 'duration': self.duration}
+        return {key: value for key, value in fields.items() if value}
+
+
+async def probe(path: str, binary: str = FFPROBE_PATH) -> MediaProbe:
+    """Duration, dimensions and codecs of a media file; raises FFmpegError when ffprobe can't tell."""
+    command = [binary, '-v', 'error', '-print_format', 'json', '-show_format', '-show_streams', path]
+    try:
+        completed = await asyncio.to_thread(subprocess.run, command, capture_output=True, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise FFmpegError(f"Can't run {binary}: {e}") from e
+    if completed.returncode != 0:
+        raise FFmpegError(f"ffprobe failed: {completed.stderr.decode(errors='replace').strip()[-STDERR_TAIL:]}")
+    try:
+        data = json.loads(completed.stdout)
+    except ValueError as e:
+        raise FFmpegError(f"ffprobe printed something that isn't JSON: {e}") from e
+
+    streams = data.get('streams') or []
+    # Cover art is a video stream too
+    video = next((s for s in streams if s.get('codec_type') == 'video'
+                  and not (s.get('disposition') or {}).get('attached_pic')), None)
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), None)
+    container = data.get('format') or {}
+    result = MediaProbe(
+        duration=_number(container.get('duration')) or _number((video or audio or {}).get('duration')),
+        vcodec=video.get('codec_name') if video else None,
+        acodec=audio.get('codec_name') if audio else None,
+        bitrate=int(_number(container.get('bit_rate')) or 0) or None,
+    )
+    if video:
+        result.width, result.height = video.get('width'), video.get('height')
+        if _rotation(video) % 180 == 90:
+            # Phones store portrait video as rotated landscape
+            result.width, result.height = result.height, result.width
+    return result
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rotation(stream):
+    for side_data in stream.get('side_data_list') or []:
+        if 'rotation' in side_data:
+            return int(_number(side_data['rotation']) or 0)
+    return int(_number((stream.get('tags') or {}).get('rotate')) or 0)
+
+
+class FFmpegPool:
+    def __init__(self, workers: int, threads: int, niceness: int = 0, timeout: float = None,
+                 binary: str = FFMPEG_PATH):
+        self.threads = threads
+        self.niceness = niceness
+        self.timeout = timeout
+        self.binary = binary
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ffmpeg')
+
+    def command(self, inputs: list, outputs: list) -> list:
+        """Full command line: global options, the thread cap for decoding and encoding, then the arguments."""
+        threads = ['-threads', str(self.threads)] if self.threads else []
+        command = [self.binary, '-hide_banner', '-nostdin', '-loglevel', 'error', '-y',
+                   *threads, *inputs, *threads, *outputs]
+        nice = shutil.which('nice') if self.niceness else None
+        if nice:
+            # nice execs ffmpeg in place, so wait4 still sees ffmpeg's own usage
+            command = [nice, '-n', str(self.niceness), *command]
+        return command
+
+    async def run(self, inputs: list, outputs: list, operation: str = 'other', timeout: float = None) -> FFmpegRun:
+        """Run ffmpeg with inputs (e.g. ['-i', path]) and outputs (options and the output path).
+
+        Waits for a free worker first. Cancelling the caller kills the process.
+        """
+        command = self.command(inputs, outputs)
+        process = {}
+        loop = asyncio.get_running_loop()
+        with metrics.FFMPEG_JOBS.track_inprogress():
+            future = loop.run_in_executor(self.executor, self._run, command, timeout or self.timeout, process)
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                _kill(process)
+                # The killed run fails, nobody is waiting for that error any more
+                future.add_done_callback(lambda f: f.cancelled() or f.exception())
+                raise
+        if result.cpu_seconds is not None:
+            metrics.FFMPEG_CPU_SECONDS.labels(operation).inc(result.cpu_seconds)
+        return result
+
+    def _run(self, command, timeout, process):
+        start = time.monotonic()
+        if process.get('cancelled'):
+            # Cancelled while waiting for a worker
+            raise FFmpegError("ffmpeg job cancelled")
+        try:
+            child = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.PIPE)
+        except OSError as e:
+            raise FFmpegError(f"Can't run {command[0]}: {e}") from e
+        process['child'] = child
+        if process.get('cancelled'):
+            _kill(process)
+
+        timer = None
+        timed_out = threading.Event()
+        if timeout:
+            def expire():
+                timed_out.set()
+                _kill(process)
+            timer = threading.Timer(timeout, expire)
+            timer.start()
+        try:
+            stderr = child.stderr.read()
+            child.stderr.close()
+            cpu_seconds = None
+            try:
+                _, status, usage = os.wait4(child.pid, 0)
+                # Tell Popen the child is reaped, it would wait on a reused pid otherwise
+                child.returncode = os.waitstatus_to_exitcode(status)
+                cpu_seconds = usage.ru_utime + usage.ru_stime
+            except (AttributeError, ChildProcessError):
+                # No wait4 (Windows), or kill() reaped the child first
+                child.wait()
+        finally:
+            if timer:
+                timer.cancel()
+
+        if timed_out.is_set():
+            raise FFmpegError(f"ffmpeg took longer than {timeout:.0f}s and was stopped")
+        if child.returncode != 0:
+            message = stderr.decode(errors='replace').strip()[-STDERR_TAIL:]
+            raise FFmpegError(f"ffmpeg exited with {child.returncode}: {message}")
+        return FFmpegRun(cpu_seconds, time.monotonic() - start)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _kill(process):
+    process['cancelled'] = True
+    child = process.get('child')
+    if child is not None and child.returncode is None:
+        try:
+            child.kill()
+        except OSError:
+            pass
+
+
+ffmpeg_pool = FFmpegPool(FFMPEG_WORKERS, FFMPEG_THREADS, FFMPEG_NICE, FFMPEG_TIMEOUT)
@@ -0,0 +1,87 @@
+import os
+import sqlite3
+import threading
+import time
+
+from config import FILE_ID_CACHE_PATH, FILE_ID_CACHE_TTL
+
+
+class FileIdCache:
+    """Maps (canonical video key, quality) to the Telegram file_id of an earlier upload.
+
+    Telegram keeps uploaded files around, so resending by file_id costs a single
+    API call instead of a full download plus upload.
+    """
+
+    def __init__(self, path: str, ttl: int):
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        # Opened on first use, not on import: pool workers and tools import this module too
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS file_ids ("
+                " key TEXT NOT NULL,"
+                " quality TEXT NOT NULL,"
+                " file_id TEXT NOT NULL,"
+                " kind TEXT NOT NULL,"
+                " caption TEXT,"
+                " created_at REAL NOT NULL,"
+                " PRIMARY KEY (key, quality))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str, quality: str):
+        """Return (file_id, kind, caption) for a fresh entry, or None."""
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT file_id, kind, caption, created_at FROM file_ids WHERE key = ? AND quality = ?",
+                (key, quality),
+            ).fetchone()
+
+            if row and time.time() - row[3] <= self.ttl:
+                return row[0], row[1], row[2]
+
+            if row:
+                # Expired: drop it so the next upload stores a fresh id
+                conn.execute("DELETE FROM file_ids WHERE key = ? AND quality = ?", (key, quality))
+                conn.commit()
+            return None
+
+    def put(self, key: str, quality: str, file_id: str, kind: str, caption: str = None):
+        with self._lock:
+            conn = self._db()
+            conn.execute(
+                "INSERT OR REPLACE INTO file_ids (key, quality, file_id, kind, caption, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, quality, file_id, kind, caption, time.time()),
+            )
+            conn.commit()
+
+    def invalidate(self, key: str, quality: str = None):
+        with self._lock:
+            conn = self._db()
+            if quality is None:
+                conn.execute("DELETE FROM file_ids WHERE key = ?", (key,))
+            else:
+                conn.execute("DELETE FROM file_ids WHERE key = ? AND quality = ?", (key, quality))
+            conn.commit()
+
+    def purge_expired(self):
+        """Drop every expired entry; get() only drops the ones it is asked for."""
+        with self._lock:
+            conn = self._db()
+            conn.execute("DELETE FROM file_ids WHERE created_at < ?", (time.time() - self.ttl,))
+            conn.commit()
+
+
+file_id_cache = FileIdCache(FILE_ID_CACHE_PATH, FILE_ID_CACHE_TTL)
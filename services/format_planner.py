@@ -0,0 +1,154 @@
+"""Pick the format to download from the info dict, before any bytes are fetched.
+
+yt-dlp's selector strings can't express "the best that fits in N bytes", so
+without this the size limit is only checked after a full download and merge.
+"""
+from dataclasses import dataclass
+
+# Sizes estimated from bitrate are a bit optimistic, leave room for container overhead
+BITRATE_OVERHEAD = 1.05
+
+# Bitrate of the MP3 produced for audio that can't be stream-copied (see services.audio)
+AUDIO_TRANSCODE_KBPS = 192
+
+
+class FormatTooLarge(Exception):
+    """No format of the video fits into the upload budget."""
+
+    def __init__(self, smallest: int, budget: int):
+        self.smallest = smallest
+        self.budget = budget
+        super().__init__(
+            f"This video is too large for Telegram: the smallest version is about "
+            f"{smallest / (1024 * 1024):.0f}MB and bots can only send up to {budget / (1024 * 1024):.0f}MB. "
+            f"Try a lower quality or audio only."
+        )
+
+
+@dataclass
+class FormatPlan:
+    selector: str
+    size: int = None  # estimated bytes, None when the extractor gave nothing to go on
+    height: int = None
+    progressive: bool = False  # one file with audio and video, no ffmpeg merge
+
+
+def estimate_size(fmt: dict, duration: float):
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if size:
+        return int(size)
+    if fmt.get('tbr') and duration:
+        return int(fmt['tbr'] * 1000 / 8 * duration * BITRATE_OVERHEAD)
+    return None
+
+
+def selection_size(info: dict, selector: str):
+    """Estimated bytes of the formats in a 'video+audio' style selector, None if any is unknown."""
+    formats = {fmt.get('format_id'): fmt for fmt in info.get('formats') or []}
+    total = 0
+    for format_id in selector.split('+'):
+        size = estimate_size(formats.get(format_id) or {}, info.get('duration'))
+        if not size:
+            return None
+        total += size
+    return total
+
+
+def _has_video(fmt):
+    return fmt.get('vcodec') not in (None, 'none')
+
+
+def _has_audio(fmt):
+    return fmt.get('acodec') not in (None, 'none')
+
+
+def _is_h264_mp4(fmt):
+    return fmt.get('ext') == 'mp4' and (fmt.get('vcodec') or '').startswith(('avc1', 'h264'))
+
+
+def _is_aac(fmt):
+    return (fmt.get('acodec') or '').startswith('mp4a') or fmt.get('ext') == 'm4a'
+
+
+def _downloadable(fmt):
+    return fmt.get('format_id') and not fmt.get('has_drm') and fmt.get('protocol') != 'mhtml'
+
+
+def plan_formats(info: dict, quality: str, budget: int):
+    """Return the FormatPlan for quality, None to keep yt-dlp's own selection, or raise FormatTooLarge."""
+    formats = [fmt for fmt in info.get('formats') or [] if _downloadable(fmt)]
+    if not formats:
+        # Single-format extractors (direct links, some Instagram posts)
+        return None
+
+    duration = info.get('duration')
+    if quality == 'audio':
+        return _plan_audio(formats, duration, budget)
+
+    max_height = int(quality) if quality.isdigit() else None
+    candidates = []
+
+    for fmt in formats:
+        if not _has_video(fmt) or (max_height and (fmt.get('height') or 0) > max_height):
+            continue
+        if _has_audio(fmt):
+            candidates.append(FormatPlan(fmt['format_id'], estimate_size(fmt, duration), fmt.get('height'),
+                                         progressive=True))
+
+    audio_only = [fmt for fmt in formats if _has_audio(fmt) and not _has_video(fmt)]
+    if audio_only:
+        # AAC muxes into MP4 without re-encoding; fall back to whatever audio is smallest
+        aac = [fmt for fmt in audio_only if _is_aac(fmt)] or audio_only
+        audio = min(aac, key=lambda fmt: estimate_size(fmt, duration) or 0)
+        audio_size = estimate_size(audio, duration)
+        for fmt in formats:
+            if not _has_video(fmt) or _has_audio(fmt) or not _is_h264_mp4(fmt):
+                continue
+            if max_height and (fmt.get('height') or 0) > max_height:
+                continue
+            video_size = estimate_size(fmt, duration)
+            size = video_size + audio_size if video_size and audio_size else None
+            candidates.append(FormatPlan(f"{fmt['format_id']}+{audio['format_id']}", size, fmt.get('height')))
+
+    if not candidates:
+        return None
+
+    fitting = [plan for plan in candidates if plan.size is None or plan.size <= budget]
+    if not fitting:
+        raise FormatTooLarge(min(plan.size for plan in candidates), budget)
+
+    def rank(plan):
+        sized = plan.size is not None
+        # Highest resolution first; at equal height a progressive H.264 file (no merge) wins,
+        # then known sizes over guesses, then the smaller file
+        progressive_h264 = plan.progressive and _is_h264_mp4(_format(formats, plan.selector))
+        return (plan.height or 0, progressive_h264, sized, -(plan.size or 0))
+
+    return max(fitting, key=rank)
+
+
+def _plan_audio(formats, duration, budget):
+    audio_only = [fmt for fmt in formats if _has_audio(fmt) and not _has_video(fmt)]
+    if not audio_only:
+        return None
+
+    # AAC is only remuxed, which is much cheaper than a transcode and loses nothing
+    aac = [fmt for fmt in audio_only if _is_aac(fmt)]
+    best = max(aac or audio_only, key=lambda fmt: fmt.get('abr') or fmt.get('tbr') or 0)
+    source_size = estimate_size(best, duration)
+    if _is_aac(best) or (best.get('acodec') or '').startswith('mp3'):
+        # Stream copy: the output is as large as the source
+        size = source_size
+    else:
+        # Re-encoded to a fixed bitrate, so the source doesn't change the output size
+        size = int(AUDIO_TRANSCODE_KBPS * 1000 / 8 * duration) if duration else None
+    if size and size > budget:
+        raise FormatTooLarge(size, budget)
+    return FormatPlan(best['format_id'], source_size)
+
+
+def _format(formats, format_id):
+    for fmt in formats:
+        if fmt['format_id'] == format_id:
+            return fmt
+    return {}
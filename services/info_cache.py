@@ -0,0 +1,157 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import yt_dlp
+
+from config import INFO_CACHE_PATH, INFO_CACHE_TTL, INFO_CACHE_NEGATIVE_TTL, INFO_CACHE_MAX_ENTRIES
+
+# Format fields yt-dlp needs to re-run format selection and download from a cached info dict
+FORMAT_KEYS = (
+    'format_id', 'format', 'format_note', 'url', 'manifest_url', 'fragment_base_url', 'fragments',
+    'protocol', 'ext', 'video_ext', 'audio_ext', 'container', 'vcodec', 'acodec', 'width', 'height',
+    'fps', 'tbr', 'vbr', 'abr', 'asr', 'audio_channels', 'filesize', 'filesize_approx', 'quality',
+    'preference', 'source_preference', 'language', 'language_preference', 'dynamic_range',
+    'http_headers', 'cookies', 'downloader_options', 'resolution', 'aspect_ratio', 'has_drm',
+)
+
+# Top-level fields that are large and never used by the bot
+DROPPED_KEYS = (
+    'subtitles', 'automatic_captions', 'heatmap', 'chapters', 'requested_formats',
+    'requested_downloads', 'requested_subtitles', 'description', 'tags', 'categories',
+)
+
+# Failures that won't fix themselves within minutes; anything else is retried normally
+KNOWN_FAILURES = re.compile(
+    r'video unavailable|private video|this video is private|not available in your country'
+    r'|geo.?restrict|blocked it in your country|has been removed|no longer available'
+    r'|account (?:has been )?terminated|members-only|unsupported url|http error 404'
+    r'|sign in to confirm your age|age.?restricted|log in to see',
+    re.IGNORECASE,
+)
+
+
+def trim_info(info: dict) -> dict:
+    """Keep what yt-dlp needs to download later, so cache entries stay small."""
+    trimmed = {key: value for key, value in info.items() if key not in DROPPED_KEYS}
+    if 'formats' not in info:
+        # A single-format result (direct links): the format fields are at the top level
+        return trimmed
+    trimmed['formats'] = [
+        {key: fmt[key] for key in FORMAT_KEYS if key in fmt}
+        for fmt in info.get('formats') or []
+        # Storyboards are image grids, never downloadable media
+        if fmt.get('protocol') != 'mhtml' and not fmt.get('has_drm')
+    ]
+    if info.get('thumbnails'):
+        trimmed['thumbnails'] = info['thumbnails'][-3:]
+    return trimmed
+
+
+class InfoCache:
+    """Info dicts from Downloader.get_info keyed by canonical video id.
+
+    Successful extractions are kept for ttl seconds in an LRU bounded to
+    max_entries, and optionally in SQLite so they survive restarts. Known
+    permanent failures (private, removed, geo-blocked) are cached for
+    negative_ttl so resending a dead link fails instantly.
+    """
+
+    def __init__(self, ttl: int, negative_ttl: int, max_entries: int, path: str = None):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        """The SQLite connection, opened on first use; None without a path."""
+        if self._conn is None and self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS info ("
+                " key TEXT PRIMARY KEY,"
+                " info TEXT,"
+                " error TEXT,"
+                " expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str):
+        """Return a cached info dict, raise the cached DownloadError, or return None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            conn = self._db()
+            if entry is None and conn is not None:
+                row = conn.execute("SELECT info, error, expires_at FROM info WHERE key = ?", (key,)).fetchone()
+                if row:
+                    entry = (json.loads(row[0]) if row[0] else None, row[1], row[2])
+                    self._remember(key, entry)
+
+            if entry is None or entry[2] < time.time():
+                if entry is not None:
+                    self._forget(key)
+                return None
+
+            self._entries.move_to_end(key)
+            info, error, _ = entry
+
+        if error:
+            raise yt_dlp.utils.DownloadError(error)
+        return info
+
+    def put(self, key: str, info: dict) -> dict:
+        info = trim_info(info)
+        self._store(key, (info, None, time.time() + self.ttl))
+        return info
+
+    def put_failure(self, key: str, error: Exception) -> bool:
+        """Cache error if it is a known permanent failure; return whether it was cached."""
+        message = str(error)
+        if not KNOWN_FAILURES.search(message):
+            return False
+        self._store(key, (None, message, time.time() + self.negative_ttl))
+        return True
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._forget(key)
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._remember(key, entry)
+            conn = self._db()
+            if conn is not None:
+                info, error, expires_at = entry
+                conn.execute(
+                    "INSERT OR REPLACE INTO info (key, info, error, expires_at) VALUES (?, ?, ?, ?)",
+                    (key, json.dumps(info) if info is not None else None, error, expires_at),
+                )
+                conn.execute("DELETE FROM info WHERE expires_at < ?", (time.time(),))
+                conn.commit()
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+        conn = self._db()
+        if conn is not None:
+            conn.execute("DELETE FROM info WHERE key = ?", (key,))
+            conn.commit()
+
+
+info_cache = InfoCache(INFO_CACHE_TTL, INFO_CACHE_NEGATIVE_TTL, INFO_CACHE_MAX_ENTRIES, INFO_CACHE_PATH)
@@ -0,0 +1,198 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+
+from config import JOB_QUEUE_PATH, JOB_MAX_ATTEMPTS, JOB_RETENTION
+
+QUEUED = 'queued'
+EXTRACTING = 'extracting'
+DOWNLOADING = 'downloading'
+UPLOADING = 'uploading'
+DONE = 'done'
+FAILED = 'failed'
+FINISHED = (DONE, FAILED)
+
+# What a job is: one link sent as one file, or links sent as albums (services.batch)
+DOWNLOAD = 'download'
+BATCH = 'batch'
+
+
+class JobTakenOver(Exception):
+    """The job finished or was taken over elsewhere in the meantime; sending now could deliver it twice."""
+
+
+@dataclass
+class Job:
+    id: int
+    chat_id: int
+    chat_type: str
+    user_id: int
+    url: str
+    quality: str
+    state: str
+    status_message_id: int = None
+    attempts: int = 1
+    kind: str = DOWNLOAD
+
+    @property
+    def urls(self) -> list:
+        """The job's links; a batch keeps one per line of url."""
+        return self.url.split('\n')
+
+
+class JobQueue:
+    """Durable record of download jobs, so a restart doesn't lose them.
+
+    Every job is a row that moves through queued, extracting, downloading and
+    uploading to done (or failed). Rows that never got there belong to jobs a
+    restart killed; recover() hands them to the new process once, and its
+    downloads resume from the partial files left on disk. Each process owns
+    the rows it runs (boot), and state changes only apply to owned, unfinished
+    rows, so a job is completed at most once. Delivery is at most once too:
+    a job killed while uploading may have reached the user already (Telegram
+    accepted the file, the row wasn't updated yet), so recover() doesn't run
+    it again, the user is asked instead; for a batch that is as soon as its
+    first album is being sent. One bot process per queue file:
+    recover() takes over every unfinished job of other boots.
+    """
+
+    def __init__(self, path: str, max_attempts: int, retention: int):
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.path = path
+        self.boot = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _db(self):
+        # Opened on first use, not on import: pool workers and tools import this module too
+        if self._conn is not None:
+            return self._conn
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL: a write is one append to the log, and readers never block it
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " chat_id INTEGER NOT NULL,"
+            " chat_type TEXT NOT NULL,"
+            " user_id INTEGER,"
+            " url TEXT NOT NULL,"
+            " quality TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " status_message_id INTEGER,"
+            " attempts INTEGER NOT NULL DEFAULT 1,"
+            " boot TEXT NOT NULL,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " kind TEXT NOT NULL DEFAULT 'download')"
+        )
+        if 'kind' not in {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}:
+            # A queue file from before batches were recorded
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'download'")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self._conn.commit()
+        return self._conn
+
+    def add(self, chat_id: int, chat_type: str, user_id: int, url: str, quality: str,
+            status_message_id: int = None, kind: str = DOWNLOAD) -> int:
+        """Record a new job; url is a batch's links joined by newlines."""
+        now = time.time()
+        with self._lock:
+            conn = self._db()
+            cursor = conn.execute(
+                "INSERT INTO jobs (chat_id, chat_type, user_id, url, quality, state, status_message_id, boot,"
+                " created_at, updated_at, kind) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (chat_id, chat_type, user_id, url, quality, QUEUED, status_message_id, self.boot, now, now, kind),
+            )
+            conn.commit()
+            return cursor.lastrowid
+
+    def set_state(self, job_id: int, state: str, error: str = None, status_message_id: int = None) -> bool:
+        """Move an unfinished job this process owns to state; False if it isn't one (any more)."""
+        with self._lock:
+            conn = self._db()
+            cursor = conn.execute(
+                "UPDATE jobs SET state = ?, error = COALESCE(?, error),"
+                " status_message_id = COALESCE(?, status_message_id), updated_at = ?"
+                " WHERE id = ? AND boot = ? AND state NOT IN (?, ?)",
+                (state, error, status_message_id, time.time(), job_id, self.boot, *FINISHED),
+            )
+            conn.commit()
+            return cursor.rowcount == 1
+
+    def knows(self, chat_id: int, status_message_id: int) -> bool:
+        """Whether the job with this status message was recorded (by any process using the file)."""
+        with self._lock:
+            conn = self._db()
+            return conn.execute("SELECT 1 FROM jobs WHERE chat_id = ? AND status_message_id = ?",
+                                (chat_id, status_message_id)).fetchone() is not None
+
+    def complete(self, job_id: int) -> bool:
+        """Mark a job delivered; True only for the one call that did it."""
+        return self.set_state(job_id, DONE)
+
+    def fail(self, job_id: int, error: str) -> bool:
+        return self.set_state(job_id, FAILED, error)
+
+    def recover(self):
+        """Claim the unfinished jobs of earlier processes.
+
+        Returns (jobs to run again, jobs given up, jobs interrupted while
+        uploading); the last two are marked failed. Finished jobs older than
+        retention are deleted on the way.
+        """
+        with self._lock:
+            conn = self._db()
+            now = time.time()
+            # IMMEDIATE: two processes starting at once must not both claim a job
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, chat_id, chat_type, user_id, url, quality, state, status_message_id, attempts, kind"
+                    " FROM jobs WHERE state NOT IN (?, ?) AND boot != ? ORDER BY id",
+                    (*FINISHED, self.boot),
+                ).fetchall()
+                resumed, given_up, uploading = [], [], []
+                for row in rows:
+                    job = Job(*row)
+                    if job.state == UPLOADING:
+                        # Perhaps delivered already; sending it again could deliver it twice
+                        conn.execute(
+                            "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                            (FAILED, "interrupted while uploading", now, job.id),
+                        )
+                        uploading.append(job)
+                        continue
+                    if job.attempts >= self.max_attempts:
+                        conn.execute(
+                            "UPDATE jobs SET state = ?, error = ?, updated_at = ? WHERE id = ?",
+                            (FAILED, f"interrupted {job.attempts} times", now, job.id),
+                        )
+                        given_up.append(job)
+                        continue
+                    job.attempts += 1
+                    job.state = QUEUED
+                    conn.execute(
+                        "UPDATE jobs SET state = ?, attempts = ?, boot = ?, updated_at = ? WHERE id = ?",
+                        (QUEUED, job.attempts, self.boot, now, job.id),
+                    )
+                    resumed.append(job)
+                conn.execute("DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                             (*FINISHED, now - self.retention))
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+        return resumed, given_up, uploading
+
+
+job_queue = JobQueue(JOB_QUEUE_PATH, JOB_MAX_ATTEMPTS, JOB_RETENTION)
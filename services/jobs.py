@@ -0,0 +1,175 @@
+"""Blocking yt-dlp work, kept free of bot state so it can run in a thread or a worker process.
+
+Everything passed in and out of these functions is picklable.
+"""
+import itertools
+import os
+import time
+from dataclasses import dataclass, field
+
+import yt_dlp
+
+from services import segmented
+
+# Info dict fields handed back to the bot alongside the file
+METADATA_KEYS = (
+    'id', 'extractor_key', 'webpage_url', 'title', 'uploader', 'duration',
+    'width', 'height', 'ext', 'filesize', 'filesize_approx', 'thumbnail', 'thumbnails',
+    'vcodec', 'acodec', 'track', 'artist', 'creator',
+)
+
+# Progress fields relayed across process boundaries (the full dict holds the info dict)
+PROGRESS_KEYS = (
+    'status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate', 'elapsed',
+    'eta', 'speed', '_percent_str', 'filename', 'fragment_index', 'fragment_count',
+)
+
+
+@dataclass
+class DownloadJob:
+    info: dict
+    opts: dict
+    staging: str
+    cookies: list = field(default_factory=list)  # see services.cookies
+    segments: segmented.SegmentSettings = None  # parallel Range download of progressive files, None to disable
+
+
+@dataclass
+class DownloadResult:
+    path: str
+    title: str
+    thumbnail: bytes = None  # JPEG, see services.thumbnails
+    metadata: dict = field(default_factory=dict)
+    timings: dict = field(default_factory=dict)  # seconds per stage, see services.metrics
+
+
+def metadata(info: dict) -> dict:
+    return {key: info.get(key) for key in METADATA_KEYS if info.get(key) is not None}
+
+
+def trim_progress(d: dict) -> dict:
+    return {key: d[key] for key in PROGRESS_KEYS if key in d}
+
+
+def _add_cookies(ydl, cookies):
+    # Straight into the jar, no cookies.txt to write and parse again per job
+    for cookie in cookies or ():
+        ydl.cookiejar.set_cookie(cookie)
+
+
+def extract_info(url: str, opts: dict, cookies: list = None, progress_hook=None) -> dict:
+    """Run extraction only and return a JSON-safe info dict."""
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        _add_cookies(ydl, cookies)
+        return ydl.sanitize_info(ydl.extract_info(url, download=False))
+
+
+def iter_entries(url: str, opts: dict, cookies: list = None, limit: int = None):
+    """Yield the videos behind url one by one, as JSON-safe dicts; a single video yields itself.
+
+    Playlist items that are only references come out as yt-dlp url results
+    ({'_type': 'url', 'url': ...}) and are extracted when they are downloaded;
+    items the site already described in full (carousels) come out extracted.
+    Pages of long playlists are only fetched as the generator is consumed.
+    A generator can't cross a process boundary: this runs on a thread.
+    """
+    opts = dict(opts, noplaylist=False, extract_flat='in_playlist')
+    ydl = yt_dlp.YoutubeDL(opts)
+    try:
+        _add_cookies(ydl, cookies)
+        result = ydl.extract_info(url, download=False, process=False)
+        while result.get('_type') == 'url':
+            # A redirect to the real page
+            result = ydl.extract_info(result['url'], download=False, process=False, ie_key=result.get('ie_key'))
+        if result.get('_type') not in ('playlist', 'multi_video'):
+            yield ydl.sanitize_info(ydl.process_ie_result(result, download=False))
+            return
+
+        for index, entry in enumerate(itertools.islice(_lazy_entries(result.get('entries')), limit), 1):
+            if not entry:
+                continue
+            if entry.get('_type') in ('url', 'url_transparent'):
+                yield ydl.sanitize_info(entry)
+                continue
+            for key in ('extractor', 'extractor_key'):
+                entry.setdefault(key, result.get(key))
+            entry.setdefault('playlist_index', index)
+            yield ydl.sanitize_info(ydl.process_ie_result(entry, download=False))
+    finally:
+        ydl.close()
+
+
+def _lazy_entries(entries, page_size: int = 20):
+    if isinstance(entries, yt_dlp.utils.PagedList):
+        # getslice() on the whole list would fetch every page up front
+        for start in itertools.count(0, page_size):
+            page = entries.getslice(start, start + page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+    else:
+        yield from entries or ()
+
+
+def _single_format(info: dict, selector: str):
+    """The format dict when selector names exactly one format, e.g. a FormatPlan for a progressive file."""
+    for fmt in info.get('formats') or []:
+        if fmt.get('format_id') == selector:
+            return fmt
+    return None
+
+
+def _download_segmented(ydl, job: DownloadJob, hook):
+    """Fetch a single-file format over parallel ranges to the name yt-dlp will look for.
+
+    yt-dlp then finds the file already downloaded and goes on with
+    post-processing. Anything else is left to yt-dlp. Without job.segments
+    this only clears what an earlier segmented try of the file left.
+    """
+    fmt = _single_format(job.info, job.opts.get('format'))
+    if not fmt or fmt.get('protocol') not in ('http', 'https') or not fmt.get('url'):
+        return
+    path = ydl.prepare_filename(dict(job.info, **fmt))
+    size = fmt.get('filesize') or fmt.get('filesize_approx')
+    if not job.segments or (size and size <= job.segments.chunk_size):
+        # One request anyway; an earlier segmented try of this file can't be resumed by yt-dlp
+        segmented.discard_partial(path)
+        return
+
+    try:
+        segmented.download(ydl, fmt['url'], path, fmt.get('http_headers') or {}, job.segments, hook)
+    except segmented.RangeUnsupported:
+        # yt-dlp downloads it in one stream; it must not find a preallocated .part to "resume"
+        segmented.discard_partial(path)
+
+
+def download(job: DownloadJob, progress_hook=None) -> DownloadResult:
+    """Download an already extracted video into job.staging."""
+    opts = dict(job.opts, outtmpl=os.path.join(job.staging, '%(id)s.%(ext)s'))
+    start = time.monotonic()
+    downloaded_at = []
+
+    def hook(d):
+        # Everything after the last finished file is post-processing (merge, convert)
+        if d.get('status') == 'finished':
+            downloaded_at.append(time.monotonic())
+        if progress_hook:
+            progress_hook(d)
+
+    opts['progress_hooks'] = [hook]
+
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        _add_cookies(ydl, job.cookies)
+        _download_segmented(ydl, job, hook)
+        info = ydl.process_ie_result(job.info, download=True)
+        filename = ydl.prepare_filename(info)
+
+    # Final path after merging/post-processing, when yt-dlp reports it
+    downloads = info.get('requested_downloads') or []
+    if downloads and downloads[-1].get('filepath'):
+        filename = downloads[-1]['filepath']
+
+    end = time.monotonic()
+    download_end = downloaded_at[-1] if downloaded_at else end
+    timings = {'download': download_end - start, 'postprocess': end - download_end}
+    return DownloadResult(filename, info.get('title'), None, metadata(info), timings)
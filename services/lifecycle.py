@@ -0,0 +1,15 @@
+"""Startup work for the process that owns this node's caches.
+
+Importing the bot's modules has no side effects (worker processes and tools
+import them too); cleaning up after a previous run happens here instead,
+called once from main() of bot.py, worker.py and bot_render.py.
+"""
+from services.file_id_cache import file_id_cache
+from services.media_cache import media_cache
+from services.workspace import workspaces
+
+
+def startup():
+    media_cache.startup()
+    workspaces.startup()
+    file_id_cache.purge_expired()
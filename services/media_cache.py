@@ -0,0 +1,327 @@
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from config import MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_POLICY
+
+META_FILE = 'meta.json'
+STAGING_DIR = '.staging'
+# Staging directories holding the partial files of an interrupted job, kept for the job's next run
+RESUMABLE_PREFIX = 'resume-'
+
+
+def owner_prefix() -> str:
+    """Name prefix of the staging directories this process creates, so others can tell whose they are."""
+    return f'{os.getpid()}-'
+
+
+def owner_alive(name: str) -> bool:
+    """Whether the process a staging directory is tagged with still runs; None when it isn't tagged."""
+    pid, sep, _ = name.partition('-')
+    if not sep or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def lock_dir(path: str):
+    """Claim a resumable staging directory: the fd holding the lock, or None while another job has it.
+
+    The lock goes away with the fd (close it, or the process ends), so a
+    directory left by a crashed process is free to claim.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+@dataclass
+class CachedMedia:
+    key: str
+    path: str
+    title: str = None
+    # What ffprobe found when the entry was published; None for entries published without it
+    metadata: dict = None
+
+
+@dataclass
+class _Entry:
+    directory: str
+    size: int
+    media: str
+    title: str = None
+    metadata: dict = None
+    refs: int = 0
+    hits: int = 0
+
+
+class MediaCache:
+    """Content-addressed on-disk cache of downloaded media with a byte budget.
+
+    Every entry is a directory named after the hash of extractor + video id +
+    format selector. Entries are published atomically by renaming a fully
+    written staging directory into place, and entries that are still being
+    sent (refs > 0) are never evicted.
+
+    Processes on one node may share the directory: an entry another process
+    published is picked up on a miss, and a publish that finds the entry
+    there already keeps it. Each process only knows its own references,
+    though, and enforces max_bytes on its own.
+    """
+
+    def __init__(self, root: str, max_bytes: int, policy: str = 'lru'):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # The index is read from disk on first use, importing this module must not touch the disk
+        self._loaded = False
+
+    @staticmethod
+    def make_key(extractor: str, video_id: str, format_selector: str) -> str:
+        raw = f"{extractor}\0{video_id}\0{format_selector}"
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def startup(self):
+        """Clean up after a previous run and load the index; call once, from main()."""
+        # Crashed jobs and publishes leave staging directories behind; partial downloads are resumed
+        # instead. Other processes sharing the directory may be using theirs right now.
+        staging = os.path.join(self.root, STAGING_DIR)
+        os.makedirs(staging, exist_ok=True)
+        for name in os.listdir(staging):
+            path = os.path.join(staging, name)
+            if owner_alive(name) is False:
+                shutil.rmtree(path, ignore_errors=True)
+            elif name.startswith(RESUMABLE_PREFIX) and os.path.exists(os.path.join(path, META_FILE)):
+                fd = lock_dir(path)
+                if fd is not None:
+                    shutil.rmtree(path, ignore_errors=True)
+                    os.close(fd)
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        # Called with the lock held by everything that reads the index
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.root, exist_ok=True)
+
+        found = []
+        for name in os.listdir(self.root):
+            directory = os.path.join(self.root, name)
+            meta_path = os.path.join(directory, META_FILE)
+            if name.startswith('.') or not os.path.isfile(meta_path):
+                continue
+            entry = _read_entry(directory)
+            if entry is None:
+                shutil.rmtree(directory, ignore_errors=True)
+                continue
+            found.append((os.path.getmtime(meta_path), name, entry))
+
+        # Oldest first so the OrderedDict ends up in LRU order
+        for _, name, entry in sorted(found, key=lambda item: item[0]):
+            self._add(name, entry)
+
+    def _add(self, key, entry):
+        self._entries[key] = entry
+        self.total_bytes += entry.size
+
+    def _find(self, key):
+        """The entry for key, including one another process sharing the directory has published since."""
+        entry = self._entries.get(key)
+        if entry is None and os.path.isfile(os.path.join(self.root, key, META_FILE)):
+            entry = _read_entry(os.path.join(self.root, key))
+            if entry is not None:
+                self._add(key, entry)
+        return entry
+
+    def staging_dir(self) -> str:
+        """Create a private directory, on the cache's filesystem, for a download in progress."""
+        staging = os.path.join(self.root, STAGING_DIR)
+        os.makedirs(staging, exist_ok=True)
+        return tempfile.mkdtemp(prefix=owner_prefix(), dir=staging)
+
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            self._load()
+            return self._find(key) is not None
+
+    def acquire(self, key: str):
+        """Return the cached media for key with a reference held, or None on a miss."""
+        with self._lock:
+            self._load()
+            entry = self._find(key)
+            if entry is None:
+                return None
+            entry.refs += 1
+            entry.hits += 1
+            self._entries.move_to_end(key)
+            # The meta file's mtime is the recency used to rebuild LRU order on restart
+            try:
+                os.utime(os.path.join(entry.directory, META_FILE))
+            except OSError:
+                pass
+            return self._as_media(key, entry)
+
+    def publish(self, key: str, staging: str, media_path: str, title: str = None, metadata: dict = None):
+        """Move a finished staging directory into the cache and return it with a reference held.
+
+        metadata (the media's probed dimensions and duration) is kept in the
+        meta file and handed out with every hit, so hits don't probe again.
+        """
+        meta = {
+            'media': os.path.relpath(media_path, staging),
+            'title': title,
+            'metadata': metadata,
+            'created_at': time.time(),
+        }
+        with open(os.path.join(staging, META_FILE), 'w') as f:
+            json.dump(meta, f)
+
+        # The slow parts, copying off tmpfs and adding up the size, happen before taking the lock
+        staging = self._local(staging)
+        new = _read_entry(staging)
+        target = os.path.join(self.root, key)
+        new.directory = target
+        moved = False
+        with self._lock:
+            self._load()
+            if self._find(key) is None:
+                moved = self._move(staging, target)
+                if moved:
+                    self._add(key, new)
+                else:
+                    # Published by another process just now
+                    self._find(key)
+
+            entry = self._entries[key]
+            entry.refs += 1
+            self._entries.move_to_end(key)
+            media = self._as_media(key, entry)
+            evicted = self._evict()
+        if not moved:
+            # Somebody else published the same media first (perhaps another process), keep theirs
+            shutil.rmtree(staging, ignore_errors=True)
+        _remove(evicted)
+        return media
+
+    def _local(self, staging) -> str:
+        """staging if it is on the cache's filesystem, otherwise a copy of it there (staged on tmpfs)."""
+        os.makedirs(self.root, exist_ok=True)
+        if os.stat(staging).st_dev == os.stat(self.root).st_dev:
+            return staging
+        copy = self.staging_dir()
+        shutil.copytree(staging, copy, dirs_exist_ok=True)
+        shutil.rmtree(staging, ignore_errors=True)
+        return copy
+
+    @staticmethod
+    def _move(staging, target) -> bool:
+        """Rename staging to target; False if target exists already."""
+        try:
+            os.rename(staging, target)
+            return True
+        except OSError as e:
+            if e.errno in (errno.EEXIST, errno.ENOTEMPTY):
+                return False
+            raise
+
+    def retain(self, path: str) -> bool:
+        """Take an extra reference on a file that is already held by someone else."""
+        key = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            entry.refs += 1
+            return True
+
+    def release(self, path: str):
+        """Drop the reference taken by acquire/publish for a file inside a cache entry."""
+        key = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None or entry.refs == 0:
+                return
+            entry.refs -= 1
+            evicted = self._evict()
+        _remove(evicted)
+
+    def _as_media(self, key: str, entry: _Entry) -> CachedMedia:
+        return CachedMedia(key, os.path.join(entry.directory, entry.media), entry.title, entry.metadata)
+
+    def _evict(self) -> list:
+        """Drop entries over the budget from the index; returns their directories, for _remove() after the lock."""
+        evicted = []
+        if self.total_bytes <= self.max_bytes:
+            return evicted
+
+        candidates = [(key, entry) for key, entry in self._entries.items() if entry.refs == 0]
+        if self.policy == 'lfu':
+            # Stable sort keeps LRU order among entries with the same hit count
+            candidates.sort(key=lambda item: item[1].hits)
+
+        for key, entry in candidates:
+            if self.total_bytes <= self.max_bytes:
+                break
+            del self._entries[key]
+            self.total_bytes -= entry.size
+            # Out of the way at once (a rename), so publishing the same key again doesn't meet it
+            trash = os.path.join(self.root, STAGING_DIR, f'{owner_prefix()}evicted-{key}')
+            try:
+                os.rename(entry.directory, trash)
+            except OSError:
+                shutil.rmtree(entry.directory, ignore_errors=True)
+                continue
+            evicted.append(trash)
+        return evicted
+
+
+def _remove(directories):
+    for directory in directories:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _read_entry(directory: str):
+    try:
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return _Entry(directory, _dir_size(directory), meta['media'], meta.get('title'), meta.get('metadata'))
+
+
+def _dir_size(directory: str) -> int:
+    total = 0
+    for base, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(base, name))
+            except OSError:
+                pass
+    return total
+
+
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_MAX_BYTES, MEDIA_CACHE_POLICY)
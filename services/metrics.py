@@ -0,0 +1,82 @@
+"""Prometheus metrics for the download pipeline, served at /metrics by services.webserver.
+
+Stage names: queue (waiting for a scheduler slot), extract, download,
+postprocess (ffmpeg merge/convert), transcode (re-encoding to fit the upload
+limit), thumbnail, upload, pipe (download and upload streamed together) and
+total. Cache hit ratios come from cache_lookups_total, e.g.
+rate(...{result="hit"}) / rate(...).
+"""
+import time
+from contextlib import contextmanager
+
+import yt_dlp
+from prometheus_client import Counter, Gauge, Histogram
+
+from utils.urls import detect_platform
+
+STAGE_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+STAGE_SECONDS = Histogram(
+    'bot_stage_seconds', 'Time spent in each pipeline stage', ['stage', 'platform'], buckets=STAGE_BUCKETS,
+)
+BYTES = Counter('bot_bytes_total', 'Media bytes downloaded from sources and uploaded to Telegram', ['direction'])
+ERRORS = Counter('bot_errors_total', 'Failures by stage and error class (yt-dlp errors by their cause)',
+                 ['stage', 'error'])
+CACHE_LOOKUPS = Counter('bot_cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+ACTIVE_JOBS = Gauge('bot_active_jobs', 'Requests being handled, queued ones included')
+QUEUED_JOBS = Gauge('bot_queued_jobs', 'Requests waiting for a scheduler slot')
+INFLIGHT_DOWNLOADS = Gauge('bot_inflight_downloads', 'Distinct downloads running (after deduplication)')
+EXECUTOR_JOBS = Gauge('bot_executor_jobs', 'Jobs submitted to the download backend, running or waiting')
+EXECUTOR_WORKERS = Gauge('bot_executor_workers', 'Workers of the download backend')
+FFMPEG_JOBS = Gauge('bot_ffmpeg_jobs', 'ffmpeg jobs submitted to the pool, running or waiting')
+FFMPEG_CPU_SECONDS = Counter('bot_ffmpeg_cpu_seconds_total', 'CPU seconds used by ffmpeg child processes',
+                             ['operation'])
+AUDIO_CPU_SAVED = Histogram('bot_audio_cpu_seconds_saved', 'Estimated ffmpeg CPU seconds saved per audio job '
+                            'by stream copy instead of transcoding', buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+WORKSPACE_RESERVED_BYTES = Gauge('bot_workspace_reserved_bytes', 'Disk bytes reserved by running jobs')
+
+# Called as listener(stage, platform, seconds) for every observation, e.g. by benchmarks/
+_stage_listeners = []
+
+
+def platform_label(url: str) -> str:
+    return detect_platform(url) or 'other'
+
+
+def error_class(error: BaseException) -> str:
+    """Class name of error; for yt-dlp's DownloadError the class of the error it wraps."""
+    if isinstance(error, yt_dlp.utils.DownloadError) and error.exc_info and error.exc_info[1] is not None:
+        error = error.exc_info[1]
+    return type(error).__name__
+
+
+def add_stage_listener(listener):
+    """Also hand every stage timing to listener; histograms can't give exact percentiles."""
+    _stage_listeners.append(listener)
+
+
+def observe(stage: str, platform: str, seconds: float):
+    STAGE_SECONDS.labels(stage, platform).observe(seconds)
+    for listener in _stage_listeners:
+        listener(stage, platform, seconds)
+
+
+def count_error(stage: str, error: BaseException):
+    ERRORS.labels(stage, error_class(error)).inc()
+
+
+def cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+@contextmanager
+def timed(stage: str, platform: str):
+    """Time the block as stage, and count it as an error of stage if it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        count_error(stage, e)
+        raise
+    finally:
+        observe(stage, platform, time.perf_counter() - start)
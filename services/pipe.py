@@ -0,0 +1,154 @@
+"""Upload a progressive media file to Telegram while it is still downloading.
+
+Without this the user waits for download time plus upload time. With it the
+HTTP response body is fed straight into the multipart upload through a small
+bounded queue, so the slower side sets the pace for both.
+"""
+import asyncio
+import os
+import typing
+from dataclasses import dataclass, field
+
+import aiofiles
+import aiohttp
+from aiogram.types import InputFile
+
+from config import PIPE_BUFFER_CHUNKS
+from services import metrics
+from utils.progress import UPLOAD_CHUNK_SIZE
+
+PIPE_TIMEOUT = aiohttp.ClientTimeout(total=None, connect=30, sock_read=60)
+
+# Cookie attributes in yt-dlp's serialized 'cookies' field, everything else is name=value
+COOKIE_ATTRIBUTES = {'domain', 'path', 'secure', 'expires', 'version'}
+
+
+class PipeUnavailable(Exception):
+    """The source can't be piped (no size, too large, bad response); use the normal download path."""
+
+
+@dataclass
+class PipeSource:
+    url: str
+    filename: str
+    title: str
+    cache_key: str
+    headers: dict = field(default_factory=dict)
+    size: int = None  # exact size from the extractor, when it knows it
+    metadata: dict = field(default_factory=dict)
+
+
+def cookie_header(cookies: str) -> str:
+    """Turn yt-dlp's serialized format cookies into a Cookie request header."""
+    pairs = []
+    for part in (cookies or '').split('; '):
+        name, _, value = part.partition('=')
+        if name and name.lower() not in COOKIE_ATTRIBUTES:
+            pairs.append(f'{name}={value}')
+    return '; '.join(pairs)
+
+
+class PipeInputFile(InputFile):
+    """InputFile whose bytes come from an HTTP download in progress.
+
+    open() must be called first: it starts the request and checks the size
+    against limit before anything is sent to Telegram. Every chunk is also
+    written to spill_path, so a failed upload of a complete download can be
+    retried from disk and the file can go to the media cache afterwards.
+    """
+
+    def __init__(self, source: PipeSource, limit: int, spill_path: str = None,
+                 progress_callback: typing.Callable[[int, int], None] = None,
+                 buffer_chunks: int = PIPE_BUFFER_CHUNKS, chunk_size: int = UPLOAD_CHUNK_SIZE):
+        super().__init__(filename=source.filename, chunk_size=chunk_size)
+        self.source = source
+        self.limit = limit
+        self.spill_path = spill_path
+        self.progress_callback = progress_callback
+        self.buffer_chunks = buffer_chunks
+        self.total_size = None
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.complete = False
+        self.failure = None
+        self._session = None
+        self._response = None
+
+    async def open(self):
+        self._session = aiohttp.ClientSession(timeout=PIPE_TIMEOUT)
+        try:
+            self._response = await self._session.get(self.source.url, headers=self.source.headers)
+            if self._response.status != 200:
+                raise PipeUnavailable(f"HTTP {self._response.status}")
+
+            size = self._response.content_length
+            if size is None or (self.source.size and size != self.source.size):
+                raise PipeUnavailable("size is not known up front")
+            if size > self.limit:
+                raise PipeUnavailable(f"{size} bytes is over the upload limit")
+            self.total_size = size
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            await self.close()
+            raise PipeUnavailable(str(e)) from e
+        except PipeUnavailable:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self._response is not None:
+            self._response.release()
+        if self._session is not None:
+            await self._session.close()
+
+    async def read(self, bot) -> typing.AsyncGenerator[bytes, None]:
+        if self._response is None or self.bytes_received:
+            # A retry after the stream was consumed: serve the spill file if it is complete
+            async for chunk in self._read_spill():
+                yield chunk
+            return
+
+        queue = asyncio.Queue(maxsize=self.buffer_chunks)
+        producer = asyncio.create_task(self._produce(queue))
+        try:
+            while (chunk := await queue.get()) is not None:
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield chunk
+                self.bytes_sent += len(chunk)
+                metrics.BYTES.labels('uploaded').inc(len(chunk))
+                if self.progress_callback:
+                    self.progress_callback(self.bytes_sent, self.total_size)
+        finally:
+            producer.cancel()
+
+    async def _produce(self, queue: asyncio.Queue):
+        spill = await aiofiles.open(self.spill_path, 'wb') if self.spill_path else None
+        try:
+            async for chunk in self._response.content.iter_chunked(self.chunk_size):
+                self.bytes_received += len(chunk)
+                metrics.BYTES.labels('downloaded').inc(len(chunk))
+                if self.bytes_received > self.total_size:
+                    raise PipeUnavailable("server sent more bytes than announced")
+                if spill:
+                    await spill.write(chunk)
+                # Blocks while the upload is behind: this is the backpressure
+                await queue.put(chunk)
+
+            if self.bytes_received != self.total_size:
+                raise PipeUnavailable("download ended early")
+            self.complete = True
+            await queue.put(None)
+        except Exception as e:
+            self.failure = e
+            await queue.put(e)
+        finally:
+            if spill:
+                await spill.close()
+            await self.close()
+
+    async def _read_spill(self):
+        if not (self.complete and self.spill_path and os.path.exists(self.spill_path)):
+            raise PipeUnavailable("stream already consumed")
+        async with aiofiles.open(self.spill_path, 'rb') as f:
+            while chunk := await f.read(self.chunk_size):
+                yield chunk
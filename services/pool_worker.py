@@ -0,0 +1,22 @@
+"""What ProcessBackend's worker processes run.
+
+Workers import this module and services.jobs, nothing else of the bot: no
+caches, job queue or downloader get built in them just to run a job.
+"""
+from services.jobs import trim_progress
+
+# Set in each worker process by init
+_progress_queue = None
+
+
+def init(queue):
+    global _progress_queue
+    _progress_queue = queue
+
+
+def run(fn, args, job_id):
+    hook = None
+    if job_id is not None:
+        def hook(d):
+            _progress_queue.put((job_id, trim_progress(d)))
+    return fn(*args, progress_hook=hook)
@@ -0,0 +1,134 @@
+import asyncio
+from collections import OrderedDict, deque, defaultdict
+from contextlib import asynccontextmanager
+
+from config import MAX_CONCURRENT_JOBS, MAX_JOBS_PER_USER
+from services import metrics
+from utils.urls import canonical_key
+
+# Priority lanes, lower runs first
+HIGH = 0
+NORMAL = 1
+
+
+def job_priority(url: str, quality: str) -> int:
+    """Audio and short clips (TikTok, Instagram, YouTube Shorts) are cheap, let them skip ahead."""
+    if quality == 'audio' or '/shorts/' in url:
+        return HIGH
+    if canonical_key(url).startswith(('tiktok:', 'instagram:')):
+        return HIGH
+    return NORMAL
+
+
+class _Job:
+    def __init__(self, user_id, priority, on_position):
+        self.user_id = user_id
+        self.priority = priority
+        self.on_position = on_position
+        self.position = None
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class Scheduler:
+    """Admission control for downloads.
+
+    At most max_jobs run at once and at most max_jobs_per_user of them belong
+    to the same user. Waiting jobs are served by priority lane, and round-robin
+    across users inside a lane, so one user pasting many links can't starve
+    everybody else.
+    """
+
+    def __init__(self, max_jobs: int, max_jobs_per_user: int):
+        self.max_jobs = max_jobs
+        self.max_jobs_per_user = max_jobs_per_user
+        self.running = 0
+        self._running_per_user = defaultdict(int)
+        # One OrderedDict per lane: user -> deque of jobs, in round-robin order
+        self._lanes = [OrderedDict(), OrderedDict()]
+
+    @property
+    def queued(self) -> int:
+        return sum(len(jobs) for lane in self._lanes for jobs in lane.values())
+
+    @asynccontextmanager
+    async def slot(self, user_id, priority=NORMAL, on_position=None):
+        """Wait for a free slot; on_position(n) is awaited whenever the queue position changes."""
+        job = _Job(user_id, priority, on_position)
+        self._lanes[priority].setdefault(user_id, deque()).append(job)
+        self._dispatch()
+
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled():
+                # Granted right before we got cancelled
+                self._finish(user_id)
+            else:
+                self._remove(job)
+                self._dispatch()
+            raise
+
+        try:
+            yield
+        finally:
+            self._finish(user_id)
+
+    def _remove(self, job: _Job):
+        lane = self._lanes[job.priority]
+        jobs = lane.get(job.user_id)
+        if jobs and job in jobs:
+            jobs.remove(job)
+            if not jobs:
+                del lane[job.user_id]
+
+    def _finish(self, user_id):
+        self.running -= 1
+        self._running_per_user[user_id] -= 1
+        if self._running_per_user[user_id] <= 0:
+            del self._running_per_user[user_id]
+        self._dispatch()
+
+    def _next_job(self):
+        for lane in self._lanes:
+            for user_id, jobs in lane.items():
+                if self._running_per_user[user_id] >= self.max_jobs_per_user:
+                    continue
+                job = jobs.popleft()
+                if jobs:
+                    # Back of the line for this user's remaining jobs
+                    lane.move_to_end(user_id)
+                else:
+                    del lane[user_id]
+                return job
+        return None
+
+    def _dispatch(self):
+        while self.running < self.max_jobs:
+            job = self._next_job()
+            if job is None:
+                break
+            if job.future.done():
+                continue
+            self.running += 1
+            self._running_per_user[job.user_id] += 1
+            job.future.set_result(None)
+        self._notify_positions()
+
+    def _notify_positions(self):
+        position = 0
+        for lane in self._lanes:
+            # Same interleaving _next_job produces: one job per user per round
+            queues = [list(jobs) for jobs in lane.values()]
+            for round_index in range(max((len(q) for q in queues), default=0)):
+                for jobs in queues:
+                    if round_index >= len(jobs):
+                        continue
+                    position += 1
+                    job = jobs[round_index]
+                    if job.position != position and job.on_position:
+                        job.position = position
+                        asyncio.create_task(job.on_position(position))
+
+
+scheduler = Scheduler(MAX_CONCURRENT_JOBS, MAX_JOBS_PER_USER)
+metrics.QUEUED_JOBS.set_function(lambda: scheduler.queued)
@@ -0,0 +1,275 @@
+"""Download one progressive file over several HTTP Range connections.
+
+CDNs throttle per connection, so N connections get roughly N times the
+throughput of yt-dlp's single stream. The output is preallocated and every
+connection writes its ranges in place with os.pwrite, so nothing is merged
+afterwards. Finished ranges are listed in a journal next to the .part file,
+so an interrupted download (a restart) resumes with the ranges still missing.
+Runs inside services.jobs.download (a worker thread or process);
+the host caps are shared by all downloads in that process.
+"""
+import os
+import re
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+from yt_dlp.networking import Request
+from yt_dlp.networking.exceptions import RequestError
+
+from config import MAX_CONNECTIONS_PER_HOST, MAX_SEGMENT_CONNECTIONS
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+
+# Attempts per range before the whole download gives up
+RANGE_RETRIES = 3
+# Next to the .part file: one "start-end" line per range written completely
+JOURNAL_SUFFIX = '.ranges'
+
+
+class RangeUnsupported(Exception):
+    """The server ignored the Range header; let yt-dlp download the file the usual way."""
+
+
+@dataclass
+class SegmentSettings:
+    connections: int  # parallel connections per file
+    chunk_size: int  # bytes per Range request
+    buffer_size: int  # bytes per read() and pwrite()
+
+
+class HostLimiter:
+    """Caps open connections per host and in total, one slot per Range request."""
+
+    def __init__(self, per_host: int, total: int):
+        self.per_host = per_host
+        self._total = threading.BoundedSemaphore(total)
+        self._hosts = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+        self._lock = threading.Lock()
+
+    def slot(self, url: str):
+        with self._lock:
+            host = self._hosts[urlparse(url).hostname]
+        return _Slot(host, self._total)
+
+
+class _Slot:
+    def __init__(self, host, total):
+        self.host = host
+        self.total = total
+
+    def __enter__(self):
+        self.host.acquire()
+        self.total.acquire()
+
+    def __exit__(self, *exc):
+        self.total.release()
+        self.host.release()
+
+
+host_limiter = HostLimiter(MAX_CONNECTIONS_PER_HOST, MAX_SEGMENT_CONNECTIONS)
+
+
+def _load_journal(part_path, total):
+    """Ranges already in part_path from an interrupted run, or an empty set if it can't be trusted."""
+    try:
+        if os.path.getsize(part_path) != total:
+            return set()
+        with open(part_path + JOURNAL_SUFFIX) as f:
+            return {tuple(int(n) for n in line.split('-')) for line in f if line.strip()}
+    except (OSError, ValueError):
+        return set()
+
+
+def discard_partial(path: str):
+    """Delete what an interrupted segmented download of path left, so yt-dlp doesn't take it for its own.
+
+    The .part file is preallocated to the full size; yt-dlp would "resume"
+    it as complete.
+    """
+    part_path = path + '.part'
+    if os.path.exists(part_path + JOURNAL_SUFFIX):
+        for leftover in (part_path, part_path + JOURNAL_SUFFIX):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+class _Progress:
+    """Sums the bytes of all connections into yt-dlp style progress events."""
+
+    def __init__(self, hook, path, total, downloaded=0):
+        self.hook = hook
+        self.path = path
+        self.total = total
+        self.downloaded = downloaded
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.downloaded += count
+            downloaded = self.downloaded
+        if self.hook:
+            # May raise DownloadCancelled, which stops this connection and then the others
+            self.hook({'status': 'downloading', 'downloaded_bytes': downloaded, 'total_bytes': self.total,
+                       'filename': self.path})
+
+
+def download(ydl, url: str, path: str, headers: dict, settings: SegmentSettings, progress_hook=None,
+             limiter: HostLimiter = host_limiter):
+    """Download url to path with up to settings.connections parallel Range requests.
+
+    ydl supplies the network stack (proxy, cookies, impersonation). Raises
+    RangeUnsupported when the server doesn't do ranges; nothing is left behind then.
+    Only the first request decides that: a later range answered without 206
+    is a RequestError like any other failure, which keeps the .part file and
+    its journal for the next try.
+    """
+    part_path = path + '.part'
+    try:
+        first = _open_range(ydl, url, headers, 0, settings.chunk_size - 1, limiter)
+    except RangeUnsupported:
+        discard_partial(path)
+        raise
+    fd = None
+    journal = None
+    try:
+        total = first.total
+        done = _load_journal(part_path, total)
+        if done:
+            fd = os.open(part_path, os.O_WRONLY)
+        else:
+            fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            # Reserve the whole file up front: no fragmentation, and a full disk fails now, not halfway
+            if hasattr(os, 'posix_fallocate'):
+                os.posix_fallocate(fd, 0, total)
+            else:
+                os.ftruncate(fd, total)
+        journal = open(part_path + JOURNAL_SUFFIX, 'a' if done else 'w')
+        journal_lock = threading.Lock()
+
+        progress = _Progress(progress_hook, path, total, sum(end - start + 1 for start, end in done))
+        ranges = [(start, min(start + settings.chunk_size, total) - 1)
+                  for start in range(settings.chunk_size, total, settings.chunk_size)]
+        pending = iter([window for window in ranges if window not in done])
+        pending_lock = threading.Lock()
+        stop = threading.Event()
+
+        def next_range():
+            with pending_lock:
+                return next(pending, None)
+
+        def fetch(window, response=None):
+            if _fetch_range(ydl, url, headers, window, fd, settings.buffer_size, progress, limiter, stop, response):
+                with journal_lock:
+                    journal.write(f'{window[0]}-{window[1]}\n')
+                    journal.flush()
+
+        if (0, first.end) in done:
+            first.close()
+            first = None
+
+        def worker(response=None):
+            if response is not None:
+                # The probe's response already holds the first range
+                fetch((0, response.end), response)
+            while not stop.is_set() and (window := next_range()) is not None:
+                fetch(window)
+
+        connections = max(min(settings.connections, len(ranges) + 1 - len(done)), 1)
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix='segment') as executor:
+            futures = [executor.submit(worker, first)] + [executor.submit(worker) for _ in range(connections - 1)]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            failed = [future for future in done if future.exception() is not None]
+            if failed:
+                stop.set()
+                wait(futures)
+                raise failed[0].exception()
+
+        if progress.downloaded != total:
+            raise RequestError(f'expected {total} bytes, got {progress.downloaded}')
+        os.close(fd)
+        fd = None
+        journal.close()
+        os.remove(part_path + JOURNAL_SUFFIX)
+        os.replace(part_path, path)
+        if progress_hook:
+            progress_hook({'status': 'finished', 'downloaded_bytes': total, 'total_bytes': total, 'filename': path})
+    except BaseException:
+        if first is not None:
+            first.close()
+        if fd is not None:
+            os.close(fd)
+        if journal is not None:
+            journal.close()
+        raise
+
+
+class _RangeResponse:
+    def __init__(self, response, slot, start, end, total):
+        self.response = response
+        self.slot = slot
+        self.start = start
+        self.end = end
+        self.total = total
+        self._closed = False
+
+    def read(self, size):
+        return self.response.read(size)
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.response.close()
+            self.slot.__exit__(None, None, None)
+
+
+def _open_range(ydl, url, headers, start, end, limiter):
+    slot = limiter.slot(url)
+    slot.__enter__()
+    try:
+        response = ydl.urlopen(Request(url, headers=dict(headers, Range=f'bytes={start}-{end}')))
+    except BaseException:
+        slot.__exit__(None, None, None)
+        raise
+
+    match = CONTENT_RANGE.match(response.headers.get('Content-Range') or '')
+    if response.status != 206 or not match or int(match.group(1)) != start:
+        response.close()
+        slot.__exit__(None, None, None)
+        raise RangeUnsupported(f'HTTP {response.status} without a usable Content-Range')
+    return _RangeResponse(response, slot, start, int(match.group(2)), int(match.group(3)))
+
+
+def _fetch_range(ydl, url, headers, window, fd, buffer_size, progress, limiter, stop, response=None):
+    """pwrite bytes window[0]..window[1] of url into fd, reconnecting from where a broken connection stopped.
+
+    Returns whether the whole window was written (False when stopped).
+    """
+    position, end = window
+    for attempt in range(RANGE_RETRIES):
+        try:
+            if response is None:
+                try:
+                    response = _open_range(ydl, url, headers, position, end, limiter)
+                except RangeUnsupported as e:
+                    # Half the file is written already, yt-dlp must not take over the preallocated .part
+                    raise RequestError(f'range {position}-{end}: {e}') from e
+            while position <= end and not stop.is_set():
+                data = response.read(min(buffer_size, end - position + 1))
+                if not data:
+                    break
+                os.pwrite(fd, data, position)
+                position += len(data)
+                progress.add(len(data))
+        except (RequestError, OSError):
+            if attempt == RANGE_RETRIES - 1:
+                raise
+        finally:
+            if response is not None:
+                response.close()
+                response = None
+        if position > end or stop.is_set():
+            return position > end
+    raise RequestError(f'range {window[0]}-{window[1]} incomplete after {RANGE_RETRIES} attempts')
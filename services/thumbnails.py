@@ -0,0 +1,177 @@
+"""Telegram-ready video thumbnails, made in memory.
+
+Telegram only shows a thumbnail that is a JPEG of at most 320px per side and
+under 200KB; anything else (WebP, large JPEGs) is silently dropped. The source
+image is fetched over HTTP while the video downloads, shrunk on a worker
+thread, and the bytes are kept by video id, so no thumbnail ever touches disk.
+"""
+import asyncio
+import io
+import logging
+import threading
+from collections import OrderedDict
+
+import aiohttp
+from PIL import Image, UnidentifiedImageError
+from yt_dlp.utils.networking import std_headers
+
+from config import THUMBNAIL_CACHE_ENTRIES, THUMBNAIL_FETCH_TIMEOUT
+from services import metrics
+
+logger = logging.getLogger(__name__)
+
+MAX_SIDE = 320
+MAX_BYTES = 200 * 1024
+# Tried in order until the JPEG is small enough
+JPEG_QUALITIES = (85, 75, 60, 45, 30)
+# Larger source images are not worth the download
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+
+
+def make_thumbnail(data: bytes):
+    """Shrink any image Pillow can read to a Telegram thumbnail; None if it can't be done."""
+    try:
+        image = Image.open(io.BytesIO(data))
+        # Lets the JPEG decoder skip straight to a reduced size instead of decoding every pixel
+        image.draft('RGB', (MAX_SIDE, MAX_SIDE))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha; put transparent areas on white rather than black
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((MAX_SIDE, MAX_SIDE), Image.LANCZOS)
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+    for quality in JPEG_QUALITIES:
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=quality, optimize=True)
+        if output.tell() <= MAX_BYTES:
+            return output.getvalue()
+    return None
+
+
+def thumbnail_urls(info: dict) -> list:
+    """Candidate (url, headers) pairs from an info dict (or jobs.metadata), best first.
+
+    The smallest image that still covers MAX_SIDE is the cheapest to fetch and
+    decode; images of unknown size come after it, yt-dlp's own pick last.
+    """
+    thumbnails = [thumb for thumb in info.get('thumbnails') or [] if thumb.get('url')]
+    covering = sorted((thumb for thumb in thumbnails if min(thumb.get('width') or 0, thumb.get('height') or 0)
+                       >= MAX_SIDE), key=lambda thumb: thumb['width'] * thumb['height'])
+    # yt-dlp sorts thumbnails worst to best
+    unknown = [thumb for thumb in reversed(thumbnails) if not thumb.get('width')]
+    candidates = [(thumb['url'], thumb.get('http_headers') or {}) for thumb in covering + unknown]
+    if info.get('thumbnail'):
+        candidates.append((info['thumbnail'], {}))
+
+    unique = {}
+    for url, headers in candidates:
+        unique.setdefault(url, headers)
+    return list(unique.items())
+
+
+class ThumbnailCache:
+    """JPEG thumbnail bytes by video id, in an LRU bounded to max_entries.
+
+    Callers asking for the same video while its thumbnail is being made share
+    the work. Failures are not cached; a video without a usable thumbnail is
+    simply sent without one.
+    """
+
+    def __init__(self, max_entries: int, timeout: float = THUMBNAIL_FETCH_TIMEOUT):
+        self.max_entries = max_entries
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(info: dict):
+        if not info.get('id'):
+            return None
+        return f"{info.get('extractor_key')}:{info['id']}"
+
+    def peek(self, key: str):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key: str, data: bytes):
+        with self._lock:
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, info: dict):
+        """JPEG bytes for the video described by info, or None."""
+        key = self.key(info)
+        if key is None:
+            return None
+        data = self.peek(key)
+        metrics.cache_lookup('thumbnail', data is not None)
+        if data is not None:
+            self.hits += 1
+            return data
+        self.misses += 1
+
+        task = self._pending.get(key)
+        if task is None:
+            try:
+                candidates = thumbnail_urls(info)
+            except Exception as e:
+                logger.warning(f"Can't read the thumbnails of {key}: {e!r}")
+                return None
+            if not candidates:
+                return None
+            platform = metrics.platform_label(info.get('webpage_url') or '')
+            task = asyncio.ensure_future(self._make(key, candidates, platform))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        # shield: a caller giving up must not cancel the work for the others
+        return await asyncio.shield(task)
+
+    async def _make(self, key, candidates, platform):
+        headers = {'User-Agent': std_headers['User-Agent']}
+        try:
+            with metrics.timed('thumbnail', platform):
+                async with aiohttp.ClientSession(timeout=self.timeout, headers=headers) as session:
+                    for url, url_headers in candidates:
+                        source = await self._fetch(session, url, url_headers)
+                        if source is None:
+                            continue
+                        data = await asyncio.to_thread(make_thumbnail, source)
+                        if data is not None:
+                            self.put(key, data)
+                            return data
+        except Exception as e:
+            # A thumbnail is optional; whatever goes wrong, the video is sent without one
+            logger.warning(f"No thumbnail for {key}: {e!r}")
+        return None
+
+    @staticmethod
+    async def _fetch(session, url, headers):
+        try:
+            async with session.get(url, headers=headers) as response:
+                if response.status != 200 or (response.content_length or 0) > MAX_SOURCE_BYTES:
+                    return None
+                data = bytearray()
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    data += chunk
+                    if len(data) > MAX_SOURCE_BYTES:
+                        return None
+                return bytes(data)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+
+thumbnail_cache = ThumbnailCache(THUMBNAIL_CACHE_ENTRIES)
@@ -0,0 +1,128 @@
+"""Shrink videos over the upload limit with a two-pass x264 encode.
+
+The target bitrate follows from the real duration (ffprobe) and the byte
+budget. Two passes hit that target far more precisely than a quality-based
+encode: the first pass measures how hard each scene is, the second spends
+the bits accordingly. So a file is encoded once, not tried at several
+qualities. The cost is bounded: at most TRANSCODE_CONCURRENCY encodes run at
+once, videos longer than TRANSCODE_MAX_DURATION are refused, and the
+resolution drops with the bitrate.
+"""
+import asyncio
+import glob
+import os
+import time
+
+from config import (
+    TRANSCODE_OVERSIZE, TRANSCODE_CONCURRENCY, TRANSCODE_PRESET, TRANSCODE_MAX_DURATION, TRANSCODE_MIN_VIDEO_KBPS,
+    TRANSCODE_TIMEOUT,
+)
+from services.ffmpeg import MediaProbe, ffmpeg_pool, probe
+
+AUDIO_KBPS = 96
+# Room for the container and for the encoder missing its target a little
+SIZE_MARGIN = 0.94
+# The largest height worth encoding at a video bitrate (kbps); low bitrates look better at a lower resolution
+HEIGHT_FOR_KBPS = ((500, 360), (1000, 480), (2000, 720))
+
+
+class TranscodeError(Exception):
+    """The video can't be brought under the limit at a watchable quality."""
+
+
+def target_video_kbps(duration: float, budget: int, audio_kbps: int = AUDIO_KBPS) -> float:
+    """Video bitrate that makes duration seconds of video plus audio fit in budget bytes."""
+    return budget * 8 / 1000 / duration * SIZE_MARGIN - audio_kbps
+
+
+def target_height(video_kbps: float, height: int):
+    """Height to scale down to for video_kbps, None to keep the source's."""
+    for max_kbps, max_height in HEIGHT_FOR_KBPS:
+        if video_kbps < max_kbps:
+            return max_height if height and height > max_height else None
+    return None
+
+
+class Transcoder:
+    def __init__(self, pool=ffmpeg_pool, enabled: bool = TRANSCODE_OVERSIZE,
+                 concurrency: int = TRANSCODE_CONCURRENCY, preset: str = TRANSCODE_PRESET,
+                 max_duration: float = TRANSCODE_MAX_DURATION, min_video_kbps: int = TRANSCODE_MIN_VIDEO_KBPS,
+                 timeout: float = TRANSCODE_TIMEOUT):
+        self.pool = pool
+        self.enabled = enabled
+        self.concurrency = concurrency
+        self.preset = preset
+        self.max_duration = max_duration
+        self.min_video_kbps = min_video_kbps
+        self.timeout = timeout
+        self._slots = None
+
+    def can_fit(self, duration: float, budget: int) -> bool:
+        """Whether a video of duration seconds can be encoded into budget bytes at all (before downloading it)."""
+        if not self.enabled or not duration or duration > self.max_duration:
+            return False
+        return target_video_kbps(duration, budget) >= self.min_video_kbps
+
+    async def fit(self, path: str, budget: int, media: MediaProbe = None) -> str:
+        """Encode path into an MP4 of at most budget bytes next to it, delete path and return the new path."""
+        media = media or await probe(path)
+        if not media.duration:
+            raise TranscodeError("The video's length is unknown, so it can't be compressed to fit")
+        if media.duration > self.max_duration:
+            raise TranscodeError(f"The video is too long to compress "
+                                 f"(over {self.max_duration / 60:.0f} minutes)")
+        audio_kbps = AUDIO_KBPS if media.acodec else 0
+        video_kbps = target_video_kbps(media.duration, budget, audio_kbps)
+        if video_kbps < self.min_video_kbps:
+            raise TranscodeError(f"The video is too long to fit in {budget // (1024 * 1024)}MB "
+                                 f"at a watchable quality")
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.concurrency)
+        base = os.path.splitext(path)[0]
+        output = f"{base}.fit.mp4"
+        passlog = f"{base}.x264"
+        try:
+            async with self._slots:
+                deadline = time.monotonic() + self.timeout
+                await self._encode(path, output, passlog, video_kbps, audio_kbps, media, deadline)
+                if os.path.getsize(output) > budget:
+                    # The encoder overshot; once more with the bitrate cut by the overshoot
+                    video_kbps *= budget / os.path.getsize(output) * SIZE_MARGIN
+                    await self._encode(path, output, passlog, video_kbps, audio_kbps, media, deadline)
+                    if os.path.getsize(output) > budget:
+                        raise TranscodeError("Compressing the video didn't make it small enough")
+        except BaseException:
+            if os.path.exists(output):
+                os.remove(output)
+            raise
+        finally:
+            for log in glob.glob(glob.escape(passlog) + '*'):
+                os.remove(log)
+        os.remove(path)
+        return output
+
+    async def _encode(self, source, output, passlog, video_kbps, audio_kbps, media, deadline):
+        video = ['-map', '0:v:0', '-c:v', 'libx264', '-preset', self.preset, '-b:v', f'{video_kbps:.0f}k',
+                 '-passlogfile', passlog, '-pix_fmt', 'yuv420p']
+        height = target_height(video_kbps, media.height)
+        if height:
+            # -2 keeps the aspect ratio with an even width, which yuv420p needs
+            video += ['-vf', f'scale=-2:{height},setsar=1']
+        audio = ['-map', '0:a:0', '-c:a', 'aac', '-b:a', f'{audio_kbps}k'] if audio_kbps else []
+
+        await self.pool.run(['-i', source], video + ['-pass', '1', '-an', '-f', 'null', os.devnull],
+                            operation='transcode', timeout=self._remaining(deadline))
+        # +faststart puts the index first, so Telegram can play the video while it loads
+        await self.pool.run(['-i', source], video + ['-pass', '2'] + audio + ['-movflags', '+faststart', output],
+                            operation='transcode', timeout=self._remaining(deadline))
+
+    @staticmethod
+    def _remaining(deadline):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TranscodeError("Compressing the video took too long")
+        return remaining
+
+
+transcoder = Transcoder()
@@ -0,0 +1,115 @@
+"""The bot's single HTTP server: Telegram webhook updates, health probes, metrics and graceful drain.
+
+It runs on the bot's own event loop, so there is no extra thread, and in
+webhook mode several replicas can sit behind one load balancer.
+"""
+import asyncio
+import hmac
+import logging
+import signal
+
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from config import WEBHOOK_PATH, WEBHOOK_SECRET, DRAIN_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebServer:
+    """aiohttp application with /healthz, /readyz, /metrics and, when handle_update is given, the webhook.
+
+    handle_update(update_dict) is run as a background task per update so
+    Telegram gets its 200 right away; drain() waits for those tasks.
+    """
+
+    def __init__(self, handle_update=None, secret_token: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH,
+                 drain_timeout: float = DRAIN_TIMEOUT):
+        self.handle_update = handle_update
+        self.secret_token = secret_token
+        self.path = path
+        self.drain_timeout = drain_timeout
+        self.ready = False
+        self.draining = False
+        self._tasks = set()
+        self._runner = None
+
+        self.app = web.Application()
+        self.app.router.add_get('/healthz', self._healthz)
+        self.app.router.add_get('/readyz', self._readyz)
+        self.app.router.add_get('/metrics', self._metrics)
+        if handle_update is not None:
+            self.app.router.add_post(path, self._webhook)
+
+    def add_route(self, method: str, path: str, handler):
+        self.app.router.add_route(method, path, handler)
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"HTTP server listening on {host}:{port}")
+
+    async def wait_for_signal(self):
+        """Block until SIGTERM/SIGINT (Render sends SIGTERM before a redeploy)."""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.remove_signal_handler(sig)
+
+    async def drain(self):
+        """Stop taking updates, fail readiness, and wait for in-flight updates to finish."""
+        self.draining = True
+        self.ready = False
+        if self._tasks:
+            logger.info(f"Draining {len(self._tasks)} in-flight updates...")
+            done, pending = await asyncio.wait(set(self._tasks), timeout=self.drain_timeout)
+            for task in pending:
+                task.cancel()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _healthz(self, request):
+        return web.Response(text='ok')
+
+    async def _readyz(self, request):
+        if self.ready and not self.draining:
+            return web.Response(text='ready')
+        return web.Response(status=503, text='not ready')
+
+    async def _metrics(self, request):
+        return web.Response(body=generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+    async def _webhook(self, request):
+        if self.secret_token:
+            token = request.headers.get(SECRET_HEADER, '')
+            if not hmac.compare_digest(token, self.secret_token):
+                return web.Response(status=401)
+        if self.draining:
+            # Telegram retries non-2xx answers, by then another replica can take it
+            return web.Response(status=503)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._handle(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _handle(self, update):
+        try:
+            await self.handle_update(update)
+        except Exception:
+            logger.exception("Error while handling a webhook update")
@@ -0,0 +1,257 @@
+"""Private working directories for downloads, with a disk budget and a janitor.
+
+Every job gets its own directory, so nothing is shared between jobs and one
+rmtree cleans up everything a job wrote. Before a job may start it reserves
+the bytes it expects to write; while the budget or the disk's free space
+can't cover that, it waits. Small media can go to a tmpfs directory instead,
+which saves disk I/O entirely. A named workspace survives its job being
+cancelled (a restart), so the next job with that name resumes the partial
+files in it.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+from config import (
+    MEDIA_CACHE_DIR, UPLOAD_LIMIT_BYTES, WORKSPACE_MAX_BYTES, WORKSPACE_MIN_FREE_BYTES, WORKSPACE_TMPFS_DIR,
+    WORKSPACE_TMPFS_MAX_FILE, WORKSPACE_TMPFS_MAX_BYTES, WORKSPACE_ADMIT_TIMEOUT, WORKSPACE_JANITOR_INTERVAL,
+    WORKSPACE_STALE_AFTER,
+)
+from services import metrics
+from services.media_cache import RESUMABLE_PREFIX, STAGING_DIR, lock_dir, owner_alive, owner_prefix
+
+# Leftovers of interrupted yt-dlp runs, and the thumbnails written next to them
+STALE_SUFFIXES = ('.part', '.ytdl', '.temp', '.jpg', '.jpeg', '.png', '.webp')
+
+
+class DiskBudgetExceeded(Exception):
+    """No room for the job's files within the disk budget."""
+
+
+@dataclass
+class Workspace:
+    path: str
+    reserved: int
+    tmpfs: bool = False
+    resumable: bool = False
+    created_at: float = field(default_factory=time.time)
+    lock: int = None  # fd holding the lock on a resumable directory, see media_cache.lock_dir
+
+
+class WorkspaceManager:
+    """Hands out job directories under root (or tmpfs_root) against a byte budget.
+
+    Used from the event loop only. open() waits up to admit_timeout for a
+    reservation to fit, close() deletes the directory and frees its bytes.
+    A janitor task removes directories and yt-dlp leftovers nobody owns.
+    """
+
+    def __init__(self, root: str, max_bytes: int, min_free_bytes: int, tmpfs_root: str = None,
+                 tmpfs_max_file: int = 0, tmpfs_max_bytes: int = 0, admit_timeout: float = WORKSPACE_ADMIT_TIMEOUT,
+                 janitor_interval: float = WORKSPACE_JANITOR_INTERVAL, stale_after: float = WORKSPACE_STALE_AFTER):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+        self.tmpfs_root = tmpfs_root
+        self.tmpfs_max_file = tmpfs_max_file
+        self.tmpfs_max_bytes = tmpfs_max_bytes
+        self.admit_timeout = admit_timeout
+        self.janitor_interval = janitor_interval
+        self.stale_after = stale_after
+        self.reserved = 0
+        self.tmpfs_reserved = 0
+        self._active = {}
+        self._released = None
+        self._janitor = None
+        # Directories are created on first use, importing this module must not touch the disk
+        self._created = False
+
+    def startup(self):
+        """Clean up after a previous run; call once, from main()."""
+        self._create_roots()
+        if not self.tmpfs_root:
+            return
+        # Job directories of processes that are gone; other processes may share the directory
+        for name in os.listdir(self.tmpfs_root):
+            if owner_alive(name) is False:
+                shutil.rmtree(os.path.join(self.tmpfs_root, name), ignore_errors=True)
+
+    def _create_roots(self):
+        for root in filter(None, (self.root, self.tmpfs_root)):
+            os.makedirs(root, exist_ok=True)
+        self._created = True
+
+    @asynccontextmanager
+    async def workspace(self, size: int = None, name: str = None):
+        """A job directory for the duration of the block.
+
+        It is deleted however the block ends, except that a named directory
+        is kept when the block is cancelled; the janitor removes it if no job
+        comes back for it within stale_after.
+        """
+        workspace = await self.open(size, name)
+        keep = False
+        try:
+            yield workspace
+        except asyncio.CancelledError:
+            keep = workspace.resumable
+            raise
+        finally:
+            self.close(workspace.path, keep)
+
+    async def open(self, size: int = None, name: str = None) -> Workspace:
+        """Reserve size bytes (the upload limit when unknown) and create a job directory.
+
+        With a name, the directory is the same for every job with that name
+        (unless one is using it right now) and whatever is in it stays.
+        """
+        size = size or UPLOAD_LIMIT_BYTES
+        if not self._created:
+            self._create_roots()
+        if self._janitor is None or self._janitor.done():
+            self._janitor = asyncio.get_running_loop().create_task(self._sweep_forever())
+
+        if self._fits_tmpfs(size):
+            self.tmpfs_reserved += size
+            return self._create(self.tmpfs_root, size, name, tmpfs=True)
+
+        if size > self.max_bytes:
+            raise DiskBudgetExceeded(f"A job needs about {size // (1024 * 1024)}MB, "
+                                     f"more than the {self.max_bytes // (1024 * 1024)}MB disk budget")
+        if self._released is None:
+            self._released = asyncio.Event()
+        deadline = time.monotonic() + self.admit_timeout
+        while not self._fits(size):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DiskBudgetExceeded("The server is short on disk space right now, please try again later")
+            self._released.clear()
+            try:
+                await asyncio.wait_for(self._released.wait(), min(remaining, 5))
+            except asyncio.TimeoutError:
+                # Free space also changes behind our back (cache eviction), look again
+                pass
+        self.reserved += size
+        return self._create(self.root, size, name)
+
+    def close(self, path: str, keep: bool = False):
+        """Delete a job directory (unless keep) and free its reservation; unknown paths are just deleted."""
+        workspace = self._active.pop(path, None)
+        if not keep:
+            shutil.rmtree(path, ignore_errors=True)
+        if workspace is None:
+            return
+        if workspace.lock is not None:
+            os.close(workspace.lock)
+        if workspace.tmpfs:
+            self.tmpfs_reserved -= workspace.reserved
+        else:
+            self.reserved -= workspace.reserved
+        if self._released is not None:
+            self._released.set()
+
+    def _create(self, root, size, name=None, tmpfs=False):
+        path = os.path.join(root, RESUMABLE_PREFIX + name) if name else None
+        lock = None
+        if path is not None and path not in self._active:
+            os.makedirs(path, exist_ok=True)
+            # Another process sharing the directory may be downloading the same media into it
+            lock = lock_dir(path)
+        if lock is None:
+            path, resumable = tempfile.mkdtemp(prefix=owner_prefix(), dir=root), False
+        else:
+            # Fresh for the janitor, which goes by mtime
+            os.utime(path)
+            resumable = True
+        workspace = Workspace(path, size, tmpfs, resumable, lock=lock)
+        self._active[path] = workspace
+        return workspace
+
+    def _fits(self, size):
+        if self.reserved + size > self.max_bytes:
+            return False
+        # Reserved bytes may not be on disk yet, count them as used
+        return shutil.disk_usage(self.root).free - self.reserved - size >= self.min_free_bytes
+
+    def _fits_tmpfs(self, size):
+        return bool(self.tmpfs_root) and size <= self.tmpfs_max_file and \
+            self.tmpfs_reserved + size <= self.tmpfs_max_bytes
+
+    async def _sweep_forever(self):
+        while self._active:
+            await asyncio.sleep(self.janitor_interval)
+            active = set(self._active)
+            await asyncio.to_thread(self.sweep, active)
+
+    def sweep(self, active=None) -> int:
+        """Delete job directories and yt-dlp leftovers older than stale_after that no job owns.
+
+        Returns the number of bytes freed.
+        """
+        active = set(self._active) if active is None else active
+        cutoff = time.time() - self.stale_after
+        freed = 0
+        for root in filter(None, (self.root, self.tmpfs_root)):
+            try:
+                names = os.listdir(root)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stale = os.path.getmtime(path) < cutoff
+                except OSError:
+                    continue
+                if path in active or not stale:
+                    continue
+                if not name.startswith(owner_prefix()) and owner_alive(name):
+                    # Another process's job, only it knows whether it is still running
+                    continue
+                if name.startswith(RESUMABLE_PREFIX):
+                    try:
+                        lock = lock_dir(path)
+                    except OSError:
+                        continue
+                    if lock is None:
+                        continue
+                    freed += _tree_size(path)
+                    shutil.rmtree(path, ignore_errors=True)
+                    os.close(lock)
+                elif os.path.isdir(path):
+                    freed += _tree_size(path)
+                    shutil.rmtree(path, ignore_errors=True)
+                elif name.endswith(STALE_SUFFIXES) or '.part-Frag' in name:
+                    freed += _tree_size(path)
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+        return freed
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for base, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(base, name))
+            except OSError:
+                pass
+    return total
+
+
+workspaces = WorkspaceManager(
+    os.path.join(MEDIA_CACHE_DIR, STAGING_DIR),
+    WORKSPACE_MAX_BYTES,
+    WORKSPACE_MIN_FREE_BYTES,
+    WORKSPACE_TMPFS_DIR,
+    WORKSPACE_TMPFS_MAX_FILE,
+    WORKSPACE_TMPFS_MAX_BYTES,
+)
+metrics.WORKSPACE_RESERVED_BYTES.set_function(lambda: workspaces.reserved)
@@ -0,0 +1,51 @@
+"""Settings for an isolated bot, and the local servers of benchmarks.servers as fixtures.
+
+    python -m pytest -q
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix='bot-tests-')
+
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# The bot's modules read their settings at import time
+os.environ.update({
+    'BOT_TOKEN': '123456:test',
+    'FILE_ID_CACHE_PATH': os.path.join(WORKDIR, 'file_ids.sqlite3'),
+    'JOB_QUEUE_PATH': os.path.join(WORKDIR, 'jobs.sqlite3'),
+    'MEDIA_CACHE_DIR': os.path.join(WORKDIR, 'media'),
+    'COOKIE_DIR': WORKDIR,
+    'TELEGRAM_API_LOCAL': '0',
+    'PROGRESS_EDIT_INTERVAL': '0.1',
+})
+for name in ('INFO_CACHE_PATH', 'BROKER_URL', 'TELEGRAM_API_URL'):
+    os.environ.pop(name, None)
+
+
+@pytest.fixture
+def serve():
+    """Start benchmarks.servers servers on an event loop of their own, for tests that block."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    servers = []
+
+    def start(server):
+        asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
@@ -0,0 +1,62 @@
+import asyncio
+import shutil
+import subprocess
+
+import pytest
+
+from services.audio import AudioConverter, copy_container, telegram_tags
+from services.ffmpeg import FFmpegPool
+
+pytestmark = pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+
+
+def make_audio(path, codec):
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=2',
+                    '-c:a', codec, str(path)], check=True)
+
+
+def convert(path, metadata):
+    async def run():
+        return await AudioConverter(FFmpegPool(1, 1)).convert(str(path), metadata)
+
+    return asyncio.run(run())
+
+
+def codec_of(path):
+    err = subprocess.run(['ffmpeg', '-hide_banner', '-i', path], capture_output=True, text=True).stderr
+    return err.split('Audio: ')[1].split()[0].rstrip(',')
+
+
+def test_copy_container():
+    assert copy_container({'acodec': 'mp4a.40.2', 'ext': 'webm'}) == 'm4a'
+    assert copy_container({'acodec': 'mp3'}) == 'mp3'
+    assert copy_container({'acodec': 'opus', 'ext': 'm4a'}) is None
+    # Direct links without codec information: the extension is trusted
+    assert copy_container({'ext': 'mp3'}) == 'mp3'
+    assert telegram_tags({'title': 'Video', 'uploader': 'Someone', 'duration': 12.7}) == \
+        {'title': 'Video', 'performer': 'Someone', 'duration': 12}
+
+
+def test_aac_is_stream_copied(tmp_path):
+    source = tmp_path / 'song.mp4'
+    make_audio(source, 'aac')
+    result = convert(source, {'acodec': 'mp4a.40.2', 'title': 'Song', 'duration': 2})
+    assert (result.operation, result.path) == ('copy', str(tmp_path / 'song.m4a'))
+    assert codec_of(result.path) == 'aac'
+    assert not source.exists()
+
+
+def test_other_codecs_are_transcoded(tmp_path):
+    source = tmp_path / 'song.webm'
+    make_audio(source, 'libopus')
+    result = convert(source, {'acodec': 'opus', 'duration': 2})
+    assert (result.operation, codec_of(result.path)) == ('transcode', 'mp3')
+
+
+def test_wrong_codec_information_falls_back_to_a_transcode(tmp_path):
+    source = tmp_path / 'song.mka'
+    make_audio(source, 'flac')
+    # The extractor said AAC; FLAC doesn't go into M4A as it is
+    result = convert(source, {'acodec': 'mp4a.40.2', 'duration': 2})
+    assert (result.operation, codec_of(result.path)) == ('transcode', 'mp3')
+    assert [path.name for path in tmp_path.iterdir()] == ['song.mp3']
@@ -0,0 +1,43 @@
+import asyncio
+import os
+
+import pytest
+import yt_dlp
+
+from services.backends import ProcessBackend, ThreadBackend
+
+
+def fails(progress_hook=None):
+    raise yt_dlp.utils.DownloadError('ERROR: Private video')
+
+
+def pid(progress_hook=None):
+    return os.getpid()
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_errors_reach_the_caller(kind):
+    async def run():
+        backend = ThreadBackend(1) if kind == 'thread' else ProcessBackend(1, 2)
+        try:
+            with pytest.raises(yt_dlp.utils.DownloadError, match='Private video'):
+                await backend.run(fails)
+            return await backend.run(pid)
+        finally:
+            backend.shutdown()
+
+    ran_in = asyncio.run(run())
+    assert (ran_in == os.getpid()) == (kind == 'thread')
+
+
+def test_process_workers_are_replaced():
+    async def run():
+        backend = ProcessBackend(1, 2)
+        try:
+            return [await backend.run(pid) for _ in range(4)]
+        finally:
+            backend.shutdown()
+
+    pids = asyncio.run(run())
+    # Two jobs per worker, then a fresh one
+    assert pids[0] == pids[1] != pids[2] == pids[3]
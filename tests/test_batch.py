@@ -0,0 +1,72 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.types import Chat, Message
+
+from benchmarks.servers import FakeBotApi, MediaServer
+from handlers import messages
+from services.bot_api import BotApiBackend
+from services.job_queue import BATCH, DONE, JobQueue
+
+
+def test_oversized_album_entry(monkeypatch):
+    async def run():
+        small, big = MediaServer(os.urandom(64 * 1024)), MediaServer(os.urandom(256 * 1024))
+        api = FakeBotApi()
+        for server in (small, big, api):
+            await server.start()
+        backend = BotApiBackend(api.url, is_local=False)
+        monkeypatch.setattr(messages, 'bot_api', backend)
+        # Bigger than the size guessed up front, found out only once it is downloaded
+        monkeypatch.setattr(messages, 'UPLOAD_LIMIT_BYTES', 128 * 1024)
+        bot = Bot(token=os.environ['BOT_TOKEN'], session=backend.create_session())
+        try:
+            message = Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type='private')).as_(bot)
+            await messages.process_batch(message, [f'{small.url}/media/batch-small.mp4',
+                                                   f'{big.url}/media/batch-big.mp4'], 'best', 42)
+        finally:
+            await bot.session.close()
+            for server in (small, big, api):
+                await server.stop()
+        return api
+
+    api = asyncio.run(run())
+    assert [method for method, _ in api.requests if method.startswith('send')] == ['sendMessage', 'sendVideo']
+    edits = [fields['text'] for method, fields in api.requests if method == 'editMessageText']
+    assert edits[-1].startswith('✅ Sent 1 of 2. 1 failed, e.g.: This video is too large for Telegram')
+
+
+def test_resume_batch(monkeypatch, tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    # The batch the last run was killed in the middle of
+    before = JobQueue(path, 3, 3600)
+    after = JobQueue(path, 3, 3600)
+    monkeypatch.setattr(messages, 'job_queue', after)
+
+    async def run():
+        media = MediaServer(os.urandom(64 * 1024))
+        api = FakeBotApi()
+        await media.start()
+        await api.start()
+        backend = BotApiBackend(api.url, is_local=False)
+        monkeypatch.setattr(messages, 'bot_api', backend)
+        bot = Bot(token=os.environ['BOT_TOKEN'], session=backend.create_session())
+        urls = [f'{media.url}/media/resumed-1.mp4', f'{media.url}/media/resumed-2.mp4']
+        job_id = before.add(42, 'private', 42, '\n'.join(urls), 'best', 5, kind=BATCH)
+        try:
+            assert await messages.resume_jobs(bot) == 1
+            await asyncio.gather(*messages._resumed_jobs)
+        finally:
+            await bot.session.close()
+            await media.stop()
+            await api.stop()
+        return api, job_id
+
+    api, job_id = asyncio.run(run())
+    albums = [fields for method, fields in api.requests if method == 'sendMediaGroup']
+    assert len(albums) == 1
+    assert [item['caption'] for item in json.loads(albums[0]['media'])] == ['resumed-1', 'resumed-2']
+    assert after._db().execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone() == (DONE,)
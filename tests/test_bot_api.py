@@ -0,0 +1,46 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from aiogram import Bot
+from aiogram.types import Chat, Message
+
+from benchmarks.servers import FakeBotApi, MediaServer
+from handlers import messages
+from services.bot_api import BotApiBackend
+
+FIXTURE_SIZE = 256 * 1024
+
+
+@pytest.mark.parametrize('is_local', [True, False])
+def test_upload_by_backend(monkeypatch, is_local):
+    async def run():
+        media = MediaServer(os.urandom(FIXTURE_SIZE))
+        api = FakeBotApi()
+        await media.start()
+        await api.start()
+        backend = BotApiBackend(api.url, is_local=is_local)
+        monkeypatch.setattr(messages, 'bot_api', backend)
+        bot = Bot(token=os.environ['BOT_TOKEN'], session=backend.create_session())
+        try:
+            message = Message(message_id=1, date=datetime.now(), chat=Chat(id=42, type='private')).as_(bot)
+            url = f'{media.url}/media/{"local" if is_local else "cloud"}.mp4'
+            await messages.process_download(message, url, 'best', 42)
+        finally:
+            await bot.session.close()
+            await media.stop()
+            await api.stop()
+        return api
+
+    api = asyncio.run(run())
+    uploads = [fields for method, fields in api.requests if method == 'sendVideo']
+    assert len(uploads) == 1
+    if is_local:
+        # Only the path goes to a local server, it reads the file itself
+        assert uploads[0]['video'].startswith('file://')
+        assert os.path.getsize(uploads[0]['video'][len('file://'):]) == FIXTURE_SIZE
+        assert api.bytes_received == 0
+    else:
+        assert uploads[0]['video'].startswith('attach://')
+        assert api.bytes_received == FIXTURE_SIZE
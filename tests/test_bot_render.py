@@ -0,0 +1,89 @@
+import asyncio
+import os
+import time
+from types import SimpleNamespace
+
+import bot_render
+from benchmarks.servers import MediaServer
+from services.downloader import Downloader
+from services.info_cache import InfoCache
+from services.media_cache import MediaCache
+
+FIXTURE_SIZE = 1024 * 1024
+
+
+class FakeMessage:
+    """The parts of telegram.Message handle_url uses."""
+
+    def __init__(self, text):
+        self.text = text
+        self.videos = []
+        self.statuses = []
+
+    async def reply_text(self, text):
+        status = SimpleNamespace(texts=[text], deleted=False)
+
+        async def edit_text(text):
+            status.texts.append(text)
+
+        async def delete():
+            status.deleted = True
+
+        status.edit_text, status.delete = edit_text, delete
+        self.statuses.append(status)
+        return status
+
+    async def reply_video(self, video, **kwargs):
+        self.videos.append(len(video))
+
+
+def test_downloads_run_concurrently_off_the_loop(monkeypatch, tmp_path):
+    async def run():
+        media = MediaServer(os.urandom(FIXTURE_SIZE), mbps=4)
+        await media.start()
+        downloader = Downloader(cache=MediaCache(str(tmp_path / 'media'), 1 << 30), infos=InfoCache(3600, 60, 100))
+        monkeypatch.setattr(bot_render, 'downloader', downloader)
+        # Only YouTube, TikTok and Instagram links are picked out of messages; the local server is neither
+        monkeypatch.setattr(bot_render, 'extract_urls', lambda text: [text])
+        messages = [FakeMessage(f'{media.url}/media/{name}.mp4') for name in ('first', 'second')]
+        updates = [SimpleNamespace(effective_user=SimpleNamespace(id=n), message=message)
+                   for n, message in enumerate(messages)]
+
+        spans = []
+        download_video = downloader.download_video
+
+        async def timed_download(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return await download_video(*args, **kwargs)
+            finally:
+                spans.append((start, time.monotonic()))
+
+        monkeypatch.setattr(downloader, 'download_video', timed_download)
+
+        # How long the event loop was unable to run anything else
+        stalls = []
+
+        async def heartbeat():
+            while True:
+                before = time.monotonic()
+                await asyncio.sleep(0.01)
+                stalls.append(time.monotonic() - before - 0.01)
+
+        beating = asyncio.ensure_future(heartbeat())
+        try:
+            await asyncio.gather(*(bot_render.handle_url(update, None) for update in updates))
+        finally:
+            beating.cancel()
+            downloader.shutdown()
+            await media.stop()
+        return messages, spans, max(stalls)
+
+    messages, spans, stall = asyncio.run(run())
+    assert [message.videos for message in messages] == [[FIXTURE_SIZE], [FIXTURE_SIZE]]
+    assert all(message.statuses[0].deleted for message in messages)
+    # The second download started before the first one was done
+    (first_start, first_end), (second_start, second_end) = sorted(spans)
+    assert second_start < first_end
+    # Never blocked for a whole download (about a second each); the threads compete for the GIL, though
+    assert stall < 0.5
@@ -0,0 +1,255 @@
+import asyncio
+import os
+import random
+from collections import defaultdict
+from datetime import datetime
+
+import pytest
+from aiogram import Bot
+from aiogram.types import Chat, Message
+
+import worker
+from benchmarks.servers import FakeBotApi, FakeRedis
+from handlers import messages
+from services.bot_api import BotApiBackend
+from services.broker import (
+    BrokerError, InProcessBroker, RedisBroker, EVENTS_QUEUE, _encode, _read_reply, create_broker, jobs_queue,
+    shard_for,
+)
+from services.job_queue import JobQueue
+from worker import RemoteStatus
+
+
+def read(data: bytes):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await _read_reply(reader)
+    return asyncio.run(run())
+
+
+def test_encode():
+    assert _encode(('LPUSH', 'q', 'é')) == b'*3\r\n$5\r\nLPUSH\r\n$1\r\nq\r\n$2\r\n\xc3\xa9\r\n'
+    assert _encode(('BRPOP', 'q', 0)) == b'*3\r\n$5\r\nBRPOP\r\n$1\r\nq\r\n$1\r\n0\r\n'
+
+
+def test_read_reply():
+    assert read(b'+OK\r\n') == 'OK'
+    assert read(b':42\r\n') == 42
+    assert read(b'$5\r\nhe\r\no\r\n') == b'he\r\no'
+    assert read(b'$-1\r\n') is None
+    assert read(b'*-1\r\n') is None
+    assert read(b'_\r\n') is None
+    assert read(b'*2\r\n$1\r\nq\r\n*1\r\n:1\r\n') == [b'q', [1]]
+    with pytest.raises(BrokerError, match='WRONGTYPE'):
+        read(b'-WRONGTYPE Operation against a key\r\n')
+    with pytest.raises(BrokerError):
+        read(b'+OK')
+
+
+def test_shard_for_is_stable():
+    # sha1, not hash(): every process and every restart agrees
+    assert [shard_for(key, 8) for key in ('youtube:dQw4w9WgXcQ', 'tiktok:7000000000000000000',
+                                          'instagram:Cabc123')] == [4, 4, 6]
+    assert shard_for('youtube:dQw4w9WgXcQ', 1) == 0
+    assert len({shard_for(f'tiktok:{n}', 4) for n in range(100)}) == 4
+
+
+def test_create_broker():
+    assert create_broker(None) is None
+    assert isinstance(create_broker('memory://'), InProcessBroker)
+    broker = create_broker('redis://:secret@example.com:6380/2')
+    assert (broker.host, broker.port, broker.password, broker.db) == ('example.com', 6380, 'secret', 2)
+    with pytest.raises(ValueError):
+        create_broker('amqp://localhost')
+
+
+def test_redis_round_trip():
+    async def run():
+        server = FakeRedis()
+        await server.start()
+        broker = RedisBroker(server.url)
+        try:
+            # BRPOP blocks until something is pushed
+            waiting = asyncio.ensure_future(broker.pop('jobs'))
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+            await broker.push('jobs', {'n': 1, 'text': 'é'})
+            assert await waiting == {'n': 1, 'text': 'é'}
+
+            for n in range(5):
+                await broker.push('jobs', {'n': n})
+            assert [(await broker.pop('jobs'))['n'] for _ in range(5)] == [0, 1, 2, 3, 4]
+            assert await broker.pop('jobs', timeout=0.1) is None
+            assert server.commands['SELECT'] == 0  # db 0 needs none
+        finally:
+            await broker.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+
+def test_redis_unreachable():
+    async def run():
+        server = FakeRedis()
+        await server.start()
+        url = server.url
+        await server.stop()
+        with pytest.raises(BrokerError):
+            await RedisBroker(url).push('jobs', {})
+
+    asyncio.run(run())
+
+
+def test_in_process_round_trip():
+    async def run():
+        broker = InProcessBroker()
+        await broker.push('jobs', {'n': 1})
+        assert await broker.pop('jobs') == {'n': 1}
+        assert await broker.pop('jobs', timeout=0.05) is None
+
+    asyncio.run(run())
+
+
+class RecordingBot:
+    """Applies status edits slowly and in random time, like the real Bot API under load."""
+
+    def __init__(self):
+        self.applied = defaultdict(list)
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        await asyncio.sleep(random.random() / 100)
+        self.applied[chat_id, message_id].append(text)
+
+    async def delete_message(self, chat_id, message_id):
+        await asyncio.sleep(random.random() / 100)
+        self.applied[chat_id, message_id].append('<deleted>')
+
+
+@pytest.mark.parametrize('kind', ['memory', 'redis'])
+def test_status_events_keep_their_order(kind):
+    async def run():
+        server = None
+        if kind == 'redis':
+            server = FakeRedis()
+            await server.start()
+            broker = RedisBroker(server.url)
+        else:
+            broker = InProcessBroker()
+        bot = RecordingBot()
+        relay = asyncio.ensure_future(messages.relay_status_events(bot, broker))
+        try:
+            async def job(chat_id, message_id):
+                # A worker's job: progress edits, then the status message goes away
+                status = RemoteStatus(broker, chat_id, message_id)
+                for n in range(20):
+                    await status.edit_text(f'{n}%')
+                await status.delete()
+
+            await asyncio.gather(job(1, 10), job(1, 11), job(2, 10))
+            for _ in range(200):
+                if sum(len(texts) for texts in bot.applied.values()) == 63:
+                    break
+                await asyncio.sleep(0.02)
+        finally:
+            relay.cancel()
+            await broker.close()
+            if server:
+                await server.stop()
+        return bot.applied
+
+    applied = asyncio.run(run())
+    expected = [f'{n}%' for n in range(20)] + ['<deleted>']
+    assert applied == {(1, 10): expected, (1, 11): expected, (2, 10): expected}
+
+
+@pytest.mark.parametrize('kind', ['memory', 'redis'])
+def test_take_and_ack(kind):
+    async def run():
+        server = None
+        if kind == 'redis':
+            server = FakeRedis()
+            await server.start()
+            broker = RedisBroker(server.url)
+        else:
+            broker = InProcessBroker()
+        try:
+            for n in range(3):
+                await broker.push('jobs', {'n': n, 'text': 'é'})
+            first = await broker.take('jobs', 'w1')
+            second = await broker.take('jobs', 'w1')
+            third = await broker.take('jobs', 'w2')
+            assert [first['n'], second['n'], third['n']] == [0, 1, 2]
+            assert await broker.take('jobs', 'w1', timeout=0.1) is None
+            await broker.ack('jobs', 'w1', first)
+            assert await broker.taken('jobs', 'w1') == [second]
+            assert await broker.taken('jobs', 'w2') == [third]
+        finally:
+            await broker.close()
+            if server:
+                await server.stop()
+
+    asyncio.run(run())
+
+
+def test_worker_runs_the_jobs_its_last_run_took(monkeypatch, tmp_path):
+    jobs = JobQueue(str(tmp_path / 'jobs.sqlite3'), 3, 3600)
+    monkeypatch.setattr(worker, 'job_queue', jobs)
+    ran = []
+
+    async def run_job(bot, job, broker):
+        ran.append(job['status_message_id'])
+
+    monkeypatch.setattr(worker, 'run_job', run_job)
+
+    async def run():
+        server = FakeRedis()
+        await server.start()
+        broker = RedisBroker(server.url)
+        try:
+            for message_id in (1, 2):
+                await broker.push(jobs_queue(0), {'chat_id': 7, 'status_message_id': message_id})
+            # The last run took both and died; it had recorded the second, so resume_jobs() has that one
+            await broker.take(jobs_queue(0), 'w')
+            await broker.take(jobs_queue(0), 'w')
+            jobs.add(7, 'private', 7, 'https://example.com/a', 'best', 2)
+            await broker.push(jobs_queue(0), {'chat_id': 7, 'status_message_id': 3})
+
+            task = asyncio.ensure_future(worker.run_worker(None, 0, broker, jobs=1, name='w'))
+            for _ in range(100):
+                if len(ran) == 2 and not await broker.taken(jobs_queue(0), 'w'):
+                    break
+                await asyncio.sleep(0.02)
+            task.cancel()
+            return await broker.taken(jobs_queue(0), 'w')
+        finally:
+            await broker.close()
+            await server.stop()
+
+    assert asyncio.run(run()) == []
+    assert ran == [1, 3]
+
+
+def test_memory_jobs_survive_a_restart(monkeypatch, tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    monkeypatch.setattr(messages, 'broker', InProcessBroker())
+    monkeypatch.setattr(messages, 'job_queue', JobQueue(path, 3, 3600))
+
+    async def run():
+        api = FakeBotApi()
+        await api.start()
+        bot = Bot(token=os.environ['BOT_TOKEN'], session=BotApiBackend(api.url, is_local=False).create_session())
+        try:
+            message = Message(message_id=1, date=datetime.now(), chat=Chat(id=7, type='private')).as_(bot)
+            await messages.enqueue_links(message, ['https://example.com/video.mp4'], 'best', 7)
+        finally:
+            await bot.session.close()
+            await api.stop()
+
+    # Queued, and the process died before a worker took it
+    asyncio.run(run())
+    [job], _, _ = JobQueue(path, 3, 3600).recover()
+    assert (job.chat_id, job.url, job.kind) == (7, 'https://example.com/video.mp4', 'download')
+    # resume_jobs() replaces the "Queued..." message with a fresh status message
+    assert job.status_message_id is not None
@@ -0,0 +1,33 @@
+import pytest
+
+from services.cookies import CookieAccount, CookiePool
+from services.info_cache import KNOWN_FAILURES
+
+
+@pytest.mark.parametrize('message', [
+    'ERROR: [youtube] abc: Sign in to confirm you’re not a bot. Use --cookies-from-browser',
+    "ERROR: [youtube] abc: Sign in to confirm you're not a bot",
+    'ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests',
+    'ERROR: [Instagram] abc: Requested content is not available, rate-limit reached or login required',
+    'ERROR: [youtube] The provided YouTube account cookies are no longer valid',
+])
+def test_account_failures_cool_down(message):
+    pool = CookiePool([CookieAccount('youtube', 'a'), CookieAccount('youtube', 'b')], cooldown=60)
+    account = pool.checkout('youtube')
+    assert pool.report_failure(account, Exception(message))
+    assert not account.healthy
+    assert pool.checkout('youtube') is not account
+
+
+@pytest.mark.parametrize('message', [
+    'ERROR: [youtube] abc: Sign in to confirm your age. This video may be inappropriate for some users.',
+    'ERROR: [Instagram] abc: You need to log in to see this post',
+    'ERROR: [youtube] abc: Video unavailable',
+])
+def test_content_restrictions_leave_accounts_alone(message):
+    pool = CookiePool([CookieAccount('youtube', 'a')], cooldown=60)
+    account = pool.checkout('youtube')
+    assert not pool.report_failure(account, Exception(message))
+    assert account.healthy
+    # Cached as a failure of the video instead
+    assert KNOWN_FAILURES.search(message)
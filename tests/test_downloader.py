@@ -0,0 +1,118 @@
+import asyncio
+import os
+
+from benchmarks.servers import MediaServer
+from services import downloader as downloader_module
+from services.downloader import Downloader
+from services.info_cache import InfoCache
+from services.media_cache import MediaCache
+from utils.urls import canonical_key
+
+URL = 'https://example.com/watch/video.mp4'
+
+
+def fmt(format_id, height):
+    return {'format_id': format_id, 'url': f'https://cdn.example.com/{format_id}.mp4', 'protocol': 'https',
+            'ext': 'mp4', 'height': height}
+
+
+def make_downloader(tmp_path, info):
+    infos = InfoCache(3600, 60, 100)
+    infos.put(canonical_key(URL), info)
+    return Downloader(cache=MediaCache(str(tmp_path / 'media'), 1 << 30), infos=infos)
+
+
+def pipe_source(downloader, quality):
+    async def run():
+        source = await downloader.pipe_source(URL, quality)
+        if source is not None:
+            downloader._end_pipe(source)
+        return source
+
+    return asyncio.run(run())
+
+
+def test_pipe_source_ignores_another_qualitys_pick(tmp_path):
+    # Extracted for 'best' first: the top-level fields are the 1080p file, no codecs known so no plan is made
+    info = dict(fmt('1080', 1080), id='video', extractor_key='Generic', title='video',
+                formats=[fmt('360', 360), fmt('1080', 1080)])
+    downloader = make_downloader(tmp_path, info)
+
+    # Which of the two yt-dlp would pick for 360 only the regular download path knows
+    assert pipe_source(downloader, '360') is None
+
+
+def test_pipe_source_single_format(tmp_path):
+    info = dict(id='video', extractor_key='Generic', title='video', formats=[fmt('mp4', 720)])
+    source = pipe_source(make_downloader(tmp_path, info), '360')
+    assert source.url == 'https://cdn.example.com/mp4.mp4'
+
+
+def test_cache_hits_reuse_the_published_probe(tmp_path, monkeypatch):
+    probes = []
+
+    async def probe(path):
+        probes.append(path)
+        raise AssertionError('probed a cache hit')
+
+    monkeypatch.setattr(downloader_module, 'probe', probe)
+    info = dict(fmt('mp4', 720), id='video', extractor_key='Generic', title='video', duration=10)
+    downloader = make_downloader(tmp_path, info)
+
+    async def run():
+        _, _, key, _ = await downloader._prepare(URL, 'best')
+        staging = downloader.cache.staging_dir()
+        path = os.path.join(staging, 'video.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'video')
+        downloader.cache.release(downloader.cache.publish(key, staging, path, 'video',
+                                                          {'width': 1280, 'height': 720, 'duration': 9.5}).path)
+        results = [await downloader.download_video(URL, 'best') for _ in range(2)]
+        for result in results:
+            downloader.release(result.path)
+        return results
+
+    results = asyncio.run(run())
+    # The probed numbers win over the extractor's
+    assert [(result.metadata['width'], result.metadata['duration']) for result in results] == [(1280, 9.5)] * 2
+    assert probes == []
+    # Kept in the meta file, so a restarted process doesn't probe either
+    reloaded = MediaCache(downloader.cache.root, 1 << 30)
+    assert reloaded.acquire(results[0].path.split(os.sep)[-2]).metadata['height'] == 720
+
+
+def test_concurrent_requests_share_one_download(tmp_path):
+    size = 2 * 1024 * 1024
+
+    async def run():
+        media = MediaServer(os.urandom(size), mbps=8)
+        await media.start()
+        downloader = Downloader(cache=MediaCache(str(tmp_path / 'media'), 1 << 30), infos=InfoCache(3600, 60, 100))
+        try:
+            url = f'{media.url}/media/shared.mp4'
+            progress = [[], [], []]
+            calls = [downloader.download_video(url, progress_hook=events.append) for events in progress]
+            # One of them gives up half way, the others still get the file
+            quitter = asyncio.ensure_future(calls.pop())
+            results = asyncio.gather(*calls)
+            await asyncio.sleep(0.1)
+            quitter.cancel()
+            first, second = await results
+            sent = media.bytes_sent
+            # Finished: the next request is a media cache hit
+            third = await downloader.download_video(url)
+            assert downloader._inflight == {}
+            for result in (first, second, third):
+                downloader.release(result.path)
+            return first, second, third, progress, sent, media.bytes_sent
+        finally:
+            downloader.shutdown()
+            await media.stop()
+
+    first, second, third, progress, sent, sent_after = asyncio.run(run())
+    assert first.path == second.path == third.path
+    assert os.path.getsize(first.path) == size
+    # One download, plus what yt-dlp's generic extractor reads to sniff the file
+    assert size <= sent < 2 * size
+    assert sent_after == sent
+    assert progress[0] and progress[1]
@@ -0,0 +1,44 @@
+import sqlite3
+import time
+
+from services.file_id_cache import FileIdCache
+
+
+def test_get_put_invalidate(tmp_path):
+    cache = FileIdCache(str(tmp_path / 'file_ids.sqlite3'), ttl=3600)
+    assert cache.get('youtube:a', 'best') is None
+    cache.put('youtube:a', 'best', 'file-1', 'video', 'caption')
+    cache.put('youtube:a', 'audio', 'file-2', 'audio')
+    assert cache.get('youtube:a', 'best') == ('file-1', 'video', 'caption')
+    # Qualities are separate uploads
+    assert cache.get('youtube:a', '720') is None
+    cache.put('youtube:a', 'best', 'file-3', 'video')
+    assert cache.get('youtube:a', 'best') == ('file-3', 'video', None)
+
+    cache.invalidate('youtube:a', 'best')
+    assert cache.get('youtube:a', 'best') is None
+    assert cache.get('youtube:a', 'audio') == ('file-2', 'audio', None)
+    cache.invalidate('youtube:a')
+    assert cache.get('youtube:a', 'audio') is None
+    # Stored on disk, a restart keeps them
+    cache.put('youtube:b', 'best', 'file-4', 'video')
+    assert FileIdCache(cache.path, ttl=3600).get('youtube:b', 'best') == ('file-4', 'video', None)
+
+
+def test_expired_entries_are_dropped(tmp_path):
+    path = str(tmp_path / 'file_ids.sqlite3')
+    cache = FileIdCache(path, ttl=3600)
+    for key in ('old', 'older', 'fresh'):
+        cache.put(key, 'best', f'file-{key}', 'video')
+    with sqlite3.connect(path) as conn:
+        conn.execute("UPDATE file_ids SET created_at = ? WHERE key != 'fresh'", (time.time() - 7200,))
+
+    def keys():
+        with sqlite3.connect(path) as conn:
+            return sorted(row[0] for row in conn.execute("SELECT key FROM file_ids"))
+
+    assert cache.get('old', 'best') is None
+    assert keys() == ['fresh', 'older']
+    cache.purge_expired()
+    assert keys() == ['fresh']
+    assert cache.get('fresh', 'best') == ('file-fresh', 'video', None)
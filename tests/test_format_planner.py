@@ -0,0 +1,63 @@
+import pytest
+
+from services.format_planner import FormatTooLarge, estimate_size, plan_formats, selection_size
+
+MB = 1024 * 1024
+
+
+def video(format_id, height, size, vcodec='avc1.64001f', ext='mp4', acodec='none'):
+    return {'format_id': format_id, 'height': height, 'filesize': size, 'vcodec': vcodec, 'ext': ext,
+            'acodec': acodec, 'protocol': 'https'}
+
+
+def audio(format_id, size, acodec='mp4a.40.2', ext='m4a', abr=128):
+    return {'format_id': format_id, 'filesize': size, 'vcodec': 'none', 'acodec': acodec, 'ext': ext, 'abr': abr,
+            'protocol': 'https'}
+
+
+INFO = {
+    'duration': 600,
+    'formats': [
+        {'format_id': 'sb0', 'protocol': 'mhtml', 'vcodec': 'none', 'acodec': 'none'},
+        video('18', 360, 20 * MB, acodec='mp4a.40.2'),
+        video('136', 720, 40 * MB),
+        video('137', 1080, 90 * MB),
+        video('248', 1080, 60 * MB, vcodec='vp9', ext='webm'),
+        audio('140', 10 * MB),
+        audio('251', 8 * MB, acodec='opus', ext='webm', abr=160),
+    ],
+}
+
+
+def test_best_that_fits():
+    # 1080p H.264 + AAC is 100MB; VP9 would need re-encoding to play everywhere
+    assert plan_formats(INFO, 'best', 50 * MB).selector == '136+140'
+    assert plan_formats(INFO, 'best', 200 * MB).selector == '137+140'
+    plan = plan_formats(INFO, '360', 200 * MB)
+    assert (plan.selector, plan.progressive) == ('18', True)
+
+
+def test_nothing_fits():
+    with pytest.raises(FormatTooLarge) as error:
+        plan_formats(INFO, 'best', 10 * MB)
+    assert error.value.smallest == 20 * MB
+    assert '20MB' in str(error.value)
+
+
+def test_audio():
+    assert plan_formats(INFO, 'audio', 50 * MB).selector == '140'
+    opus_only = {'duration': 600, 'formats': [audio('251', 8 * MB, acodec='opus', ext='webm')]}
+    # Transcoded to a 192kbps MP3: about 14MB whatever the source size
+    assert plan_formats(opus_only, 'audio', 50 * MB).selector == '251'
+    with pytest.raises(FormatTooLarge):
+        plan_formats(opus_only, 'audio', 10 * MB)
+
+
+def test_unknown_sizes():
+    # Direct links: keep yt-dlp's selection
+    assert plan_formats({'url': 'https://example.com/a.mp4'}, 'best', MB) is None
+    info = {'formats': [dict(video('22', 720, None, acodec='mp4a.40.2'), tbr=1000)], 'duration': 80}
+    assert estimate_size(info['formats'][0], 80) == int(1000 * 1000 / 8 * 80 * 1.05)
+    assert plan_formats(info, 'best', 50 * MB).selector == '22'
+    assert selection_size(INFO, '137+140') == 100 * MB
+    assert selection_size(INFO, '137+missing') is None
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import pytest
+import yt_dlp
+
+from services.downloader import Downloader
+from services.info_cache import InfoCache, trim_info
+
+PRIVATE = 'ERROR: [youtube] abc: Private video. Sign in if you\'ve been granted access to this video'
+
+
+def test_ttl_and_lru():
+    cache = InfoCache(ttl=3600, negative_ttl=60, max_entries=2)
+    for key in ('a', 'b'):
+        cache.put(key, {'id': key})
+    assert cache.get('a') == {'id': 'a'}
+    cache.put('c', {'id': 'c'})
+    # b was used least recently
+    assert cache.get('b') is None
+    assert cache.get('a') == {'id': 'a'} and cache.get('c') == {'id': 'c'}
+
+    cache._entries['a'] = ({'id': 'a'}, None, time.time() - 1)
+    assert cache.get('a') is None
+    assert 'a' not in cache._entries
+
+
+def test_negative_caching():
+    cache = InfoCache(ttl=3600, negative_ttl=60, max_entries=10)
+    assert cache.put_failure('dead', yt_dlp.utils.DownloadError(PRIVATE))
+    with pytest.raises(yt_dlp.utils.DownloadError, match='Private video'):
+        cache.get('dead')
+    # Timeouts and rate limits fix themselves, the next request tries again
+    assert not cache.put_failure('flaky', yt_dlp.utils.DownloadError('ERROR: HTTP Error 429: Too Many Requests'))
+    assert cache.get('flaky') is None
+
+
+def test_survives_a_restart(tmp_path):
+    path = str(tmp_path / 'info.sqlite3')
+    first = InfoCache(3600, 60, 10, path)
+    first.put('video', {'id': 'video', 'title': 'title'})
+    first.put_failure('dead', yt_dlp.utils.DownloadError(PRIVATE))
+
+    second = InfoCache(3600, 60, 10, path)
+    assert second.get('video') == {'id': 'video', 'title': 'title'}
+    with pytest.raises(yt_dlp.utils.DownloadError):
+        second.get('dead')
+    second.invalidate('video')
+    assert InfoCache(3600, 60, 10, path).get('video') is None
+
+
+def test_trim_info():
+    info = {
+        'id': 'video', 'description': 'x' * 10000, 'subtitles': {'en': []}, 'requested_formats': [{}],
+        'thumbnails': [{'url': str(n)} for n in range(10)],
+        'formats': [
+            {'format_id': 'sb0', 'protocol': 'mhtml', 'url': 'storyboard'},
+            {'format_id': 'drm', 'protocol': 'https', 'url': 'drm', 'has_drm': True},
+            {'format_id': '18', 'protocol': 'https', 'url': 'video', 'height': 360, 'http_headers': {},
+             'fragments_debug': 'dropped'},
+        ],
+    }
+    assert trim_info(info) == {
+        'id': 'video', 'thumbnails': [{'url': '7'}, {'url': '8'}, {'url': '9'}],
+        'formats': [{'format_id': '18', 'protocol': 'https', 'url': 'video', 'height': 360, 'http_headers': {}}],
+    }
+    # Direct links have their format at the top level, kept as is
+    assert trim_info({'id': 'file', 'url': 'direct', 'ext': 'mp4'}) == {'id': 'file', 'url': 'direct', 'ext': 'mp4'}
+
+
+class CountingBackend:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+
+    async def run(self, fn, *args, progress_hook=None):
+        self.calls += 1
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_get_info_extracts_once():
+    downloader = Downloader(infos=InfoCache(3600, 60, 10))
+    downloader._backend = backend = CountingBackend({'id': 'video', 'title': 'title', 'description': 'long'})
+    url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+    async def run():
+        first = await downloader.get_info(url)
+        # Another link to the same video
+        second = await downloader.get_info('https://youtu.be/dQw4w9WgXcQ?t=10')
+        return first, second
+
+    assert asyncio.run(run()) == ({'id': 'video', 'title': 'title'},) * 2
+    assert backend.calls == 1
+
+    downloader._backend = backend = CountingBackend(yt_dlp.utils.DownloadError(PRIVATE))
+    for _ in range(2):
+        with pytest.raises(yt_dlp.utils.DownloadError):
+            asyncio.run(downloader.get_info('https://www.youtube.com/watch?v=private0000'))
+    assert backend.calls == 1
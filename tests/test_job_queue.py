@@ -0,0 +1,62 @@
+import sqlite3
+
+from services.job_queue import JobQueue, BATCH, DOWNLOAD, DOWNLOADING, UPLOADING, QUEUED
+
+
+def test_recover(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    before = JobQueue(path, max_attempts=2, retention=3600)
+    downloading = before.add(1, 'private', 1, 'https://example.com/a', 'best')
+    uploading = before.add(2, 'private', 2, 'https://example.com/b', 'best')
+    done = before.add(3, 'private', 3, 'https://example.com/c', 'best')
+    before.set_state(downloading, DOWNLOADING)
+    before.set_state(uploading, UPLOADING)
+    before.complete(done)
+
+    after = JobQueue(path, max_attempts=2, retention=3600)
+    resumed, given_up, interrupted = after.recover()
+    assert [(job.id, job.state, job.attempts) for job in resumed] == [(downloading, QUEUED, 2)]
+    assert given_up == []
+    # Telegram may have the file already: not sent again
+    assert [job.id for job in interrupted] == [uploading]
+    assert not after.set_state(uploading, UPLOADING)
+    # The old process can't finish jobs it lost
+    assert not before.complete(downloading)
+    assert after.complete(downloading)
+
+
+def test_give_up_after_max_attempts(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    job_id = JobQueue(path, max_attempts=2, retention=3600).add(1, 'private', 1, 'https://example.com/a', 'best')
+    assert [job.id for job in JobQueue(path, max_attempts=2, retention=3600).recover()[0]] == [job_id]
+
+    resumed, given_up, _ = JobQueue(path, max_attempts=2, retention=3600).recover()
+    assert resumed == []
+    assert [(job.id, job.attempts) for job in given_up] == [(job_id, 2)]
+    assert JobQueue(path, max_attempts=2, retention=3600).recover() == ([], [], [])
+
+
+def test_batches(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    urls = ['https://example.com/a', 'https://example.com/b']
+    job_id = JobQueue(path, max_attempts=2, retention=3600).add(1, 'private', 1, '\n'.join(urls), 'best', 5,
+                                                               kind=BATCH)
+
+    [job], _, _ = JobQueue(path, max_attempts=2, retention=3600).recover()
+    assert (job.id, job.kind, job.urls, job.status_message_id) == (job_id, BATCH, urls, 5)
+
+
+def test_queue_file_from_before_batches(tmp_path):
+    path = str(tmp_path / 'jobs.sqlite3')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER NOT NULL,"
+                 " chat_type TEXT NOT NULL, user_id INTEGER, url TEXT NOT NULL, quality TEXT NOT NULL,"
+                 " state TEXT NOT NULL, status_message_id INTEGER, attempts INTEGER NOT NULL DEFAULT 1,"
+                 " boot TEXT NOT NULL, error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)")
+    conn.execute("INSERT INTO jobs (chat_id, chat_type, url, quality, state, boot, created_at, updated_at)"
+                 " VALUES (1, 'private', 'https://example.com/a', 'best', 'queued', 'old', 0, 0)")
+    conn.commit()
+    conn.close()
+
+    [job], _, _ = JobQueue(path, max_attempts=2, retention=3600).recover()
+    assert (job.kind, job.urls) == (DOWNLOAD, ['https://example.com/a'])
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+from conftest import ROOT
+
+# Everything a node's processes import; none of it may touch the disk until startup()
+IMPORT_EVERYTHING = 'import bot, worker, bot_render, services.downloader, handlers.messages, handlers.commands'
+
+
+def run_python(code, env):
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True, timeout=120)
+
+
+def test_importing_has_no_side_effects(tmp_path):
+    media = tmp_path / 'media'
+    tmpfs = tmp_path / 'tmpfs'
+    crashed = media / '.staging' / '999999999-crashed'
+    resumable = media / '.staging' / 'resume-abc'
+    tmpfs_leftover = tmpfs / '999999999-leftover'  # pids never get that high
+    for path in (crashed, resumable, tmpfs_leftover):
+        path.mkdir(parents=True)
+    env = dict(os.environ, MEDIA_CACHE_DIR=str(media), WORKSPACE_TMPFS_DIR=str(tmpfs),
+               FILE_ID_CACHE_PATH=str(tmp_path / 'db' / 'file_ids.sqlite3'),
+               JOB_QUEUE_PATH=str(tmp_path / 'db' / 'jobs.sqlite3'),
+               INFO_CACHE_PATH=str(tmp_path / 'db' / 'info.sqlite3'),
+               TELEGRAM_BOT_TOKEN='123456:test')
+
+    run_python(IMPORT_EVERYTHING, env)
+    assert crashed.exists() and resumable.exists() and tmpfs_leftover.exists()
+    assert not (tmp_path / 'db').exists()
+
+    run_python('from services.lifecycle import startup; startup()', env)
+    assert not crashed.exists() and not tmpfs_leftover.exists()
+    assert resumable.exists()
+
+
+def bot_modules_loaded(progress_hook=None):
+    progress_hook({'status': 'downloading', 'downloaded_bytes': 1, 'info_dict': {'big': 'x' * 1000}})
+    # Hooks go away with the job, give the relay time to deliver
+    time.sleep(0.5)
+    return sorted(name for name in sys.modules if name.split('.')[0] in ('services', 'handlers', 'bot', 'worker'))
+
+
+def test_process_backend_workers_stay_minimal(tmp_path):
+    # Not at the top: the worker imports this module to find bot_modules_loaded
+    from services.backends import ProcessBackend
+
+    async def run():
+        backend = ProcessBackend(1, 1)
+        try:
+            return await backend.run(bot_modules_loaded, progress_hook=progress.append)
+        finally:
+            backend.shutdown()
+
+    progress = []
+    loaded = asyncio.run(run())
+    assert loaded == ['services', 'services.jobs', 'services.pool_worker', 'services.segmented']
+    # Relayed to the parent's hook, trimmed of the info dict
+    assert progress == [{'status': 'downloading', 'downloaded_bytes': 1}]
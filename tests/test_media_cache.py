@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from services import media_cache
+from services.media_cache import MediaCache, lock_dir
+
+DEAD = '999999999'  # pids never get that high
+
+
+def stage(cache, content):
+    staging = cache.staging_dir()
+    path = os.path.join(staging, 'video.mp4')
+    with open(path, 'wb') as f:
+        f.write(content)
+    return staging, path
+
+
+def test_processes_share_the_directory(tmp_path):
+    first, second = MediaCache(str(tmp_path), 1 << 30), MediaCache(str(tmp_path), 1 << 30)
+    key = MediaCache.make_key('Generic', 'video', 'best')
+    # Both downloaded the same media at once
+    first_staging, first_path = stage(first, b'first')
+    second_staging, second_path = stage(second, b'second')
+
+    published = first.publish(key, first_staging, first_path, 'title')
+    adopted = second.publish(key, second_staging, second_path, 'title')
+
+    assert adopted.path == published.path
+    with open(adopted.path, 'rb') as f:
+        assert f.read() == b'first'
+    assert not os.path.exists(second_staging)
+    assert os.listdir(tmp_path / '.staging') == []
+    # Published by another process after this one loaded its index
+    third = MediaCache(str(tmp_path), 1 << 30)
+    assert third.acquire('missing') is None
+    other_key = MediaCache.make_key('Generic', 'other', 'best')
+    staging, path = stage(first, b'other')
+    first.publish(other_key, staging, path)
+    assert third.acquire(other_key).path.endswith('video.mp4')
+
+
+def test_startup_keeps_other_processes_staging(tmp_path):
+    staging = tmp_path / '.staging'
+    for name in (f'{DEAD}-crashed', '1-running', 'resume-partial', 'resume-published', 'resume-publishing'):
+        (staging / name).mkdir(parents=True)
+    for name in ('resume-published', 'resume-publishing'):
+        (staging / name / 'meta.json').write_text('{}')
+    # Another process is publishing this one right now
+    lock = lock_dir(str(staging / 'resume-publishing'))
+    try:
+        MediaCache(str(tmp_path), 1 << 30).startup()
+    finally:
+        os.close(lock)
+
+    assert sorted(os.listdir(staging)) == ['1-running', 'resume-partial', 'resume-publishing']
+
+
+def test_publish_copies_and_evicts_outside_the_lock(tmp_path, monkeypatch):
+    if os.stat('/dev/shm').st_dev == os.stat(tmp_path).st_dev:
+        pytest.skip('needs a tmpfs on another filesystem')
+    cache = MediaCache(str(tmp_path), 150)  # one entry, video and meta file
+    held = []
+
+    def watch(function):
+        def watched(*args, **kwargs):
+            held.append(cache._lock.locked())
+            return function(*args, **kwargs)
+        return watched
+
+    monkeypatch.setattr(media_cache.shutil, 'copytree', watch(shutil.copytree))
+    monkeypatch.setattr(media_cache.shutil, 'rmtree', watch(shutil.rmtree))
+    paths = []
+    for name in ('first', 'second'):
+        # Staged on tmpfs, like a workspace under WORKSPACE_TMPFS_DIR
+        staging = tempfile.mkdtemp(dir='/dev/shm')
+        path = os.path.join(staging, 'video.mp4')
+        with open(path, 'wb') as f:
+            f.write(b'video')
+        media = cache.publish(MediaCache.make_key('Generic', name, 'best'), staging, path)
+        assert not os.path.exists(staging)
+        cache.release(media.path)
+        paths.append(media.path)
+
+    # Over the budget: the first one went
+    assert not os.path.exists(paths[0]) and os.path.exists(paths[1])
+    assert held and not any(held)
+    assert os.listdir(tmp_path / '.staging') == []
+
+
+def test_eviction_order(tmp_path):
+    def fill(cache, names):
+        paths = {}
+        for name in names:
+            staging, path = stage(cache, b'x' * 1000)
+            media = cache.publish(MediaCache.make_key('Generic', name, 'best'), staging, path)
+            cache.release(media.path)
+            paths[name] = media.path
+        return paths
+
+    def key(name):
+        return MediaCache.make_key('Generic', name, 'best')
+
+    # Room for two entries (video and meta file)
+    lru = MediaCache(str(tmp_path / 'lru'), 2300)
+    paths = fill(lru, ['a', 'b'])
+    held = lru.acquire(key('a'))
+    fill(lru, ['c'])
+    # b was used least recently; a is in use and would be kept anyway
+    assert [os.path.exists(paths[name]) for name in 'ab'] == [True, False]
+    lru.release(held.path)
+    # Recency survives a restart
+    assert lru.acquire(key('a')) is not None
+    lru.release(paths['a'])
+    restarted = MediaCache(str(tmp_path / 'lru'), 2300)
+    fill(restarted, ['d'])
+    assert restarted.contains(key('a')) and not restarted.contains(key('c'))
+
+    lfu = MediaCache(str(tmp_path / 'lfu'), 2300, policy='lfu')
+    fill(lfu, ['a', 'b'])
+    for _ in range(3):
+        lfu.release(lfu.acquire(key('a')).path)
+    lfu.release(lfu.acquire(key('b')).path)
+    fill(lfu, ['c'])
+    # b was used last, but a more often
+    assert lfu.contains(key('a')) and not lfu.contains(key('b'))
@@ -0,0 +1,61 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+import yt_dlp
+from aiogram import Bot
+from aiogram.types import Chat, Message
+from prometheus_client import REGISTRY
+
+from benchmarks.servers import FakeBotApi, MediaServer
+from handlers import messages
+from services import metrics
+from services.bot_api import BotApiBackend
+
+FIXTURE_SIZE = 256 * 1024
+STAGES = ('queue', 'extract', 'pipe', 'total')
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_stage_timings_of_a_download(monkeypatch):
+    before = {stage: sample('bot_stage_seconds_count', stage=stage, platform='other') for stage in STAGES}
+    uploaded = sample('bot_bytes_total', direction='uploaded')
+
+    async def run():
+        media = MediaServer(os.urandom(FIXTURE_SIZE))
+        api = FakeBotApi()
+        await media.start()
+        await api.start()
+        backend = BotApiBackend(api.url, is_local=False)
+        monkeypatch.setattr(messages, 'bot_api', backend)
+        bot = Bot(token=os.environ['BOT_TOKEN'], session=backend.create_session())
+        try:
+            message = Message(message_id=1, date=datetime.now(), chat=Chat(id=9, type='private')).as_(bot)
+            await messages.process_download(message, f'{media.url}/media/metrics.mp4', 'best', 9)
+        finally:
+            await bot.session.close()
+            await media.stop()
+            await api.stop()
+
+    asyncio.run(run())
+    # Piped: download and upload are one stage
+    assert {stage: sample('bot_stage_seconds_count', stage=stage, platform='other') - before[stage]
+            for stage in STAGES} == {stage: 1 for stage in STAGES}
+    assert sample('bot_bytes_total', direction='uploaded') - uploaded == FIXTURE_SIZE
+
+
+def test_errors_by_stage_and_cause():
+    cause = ConnectionResetError('reset')
+    error = yt_dlp.utils.DownloadError('ERROR: reset', exc_info=(type(cause), cause, None))
+    assert metrics.error_class(error) == 'ConnectionResetError'
+    assert metrics.error_class(yt_dlp.utils.DownloadError('ERROR: Private video')) == 'DownloadError'
+
+    before = sample('bot_errors_total', stage='upload', error='ConnectionResetError')
+    with pytest.raises(yt_dlp.utils.DownloadError):
+        with metrics.timed('upload', 'youtube'):
+            raise error
+    assert sample('bot_errors_total', stage='upload', error='ConnectionResetError') - before == 1
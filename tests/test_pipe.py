@@ -0,0 +1,104 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from aiogram import Bot
+from aiogram.types import Chat, Message
+
+from benchmarks.servers import FakeBotApi, MediaServer
+from handlers import messages
+from services.bot_api import BotApiBackend
+from services.job_queue import JobQueue, job_queue
+from services.pipe import PipeInputFile, PipeSource, PipeUnavailable
+
+FIXTURE_SIZE = 4 * 1024 * 1024
+
+
+def run_downloads(monkeypatch, names, job_id=None):
+    """Send each /media/<name> through process_download, one after the other; return both servers."""
+    async def run():
+        media = MediaServer(os.urandom(FIXTURE_SIZE))
+        api = FakeBotApi()
+        await media.start()
+        await api.start()
+        backend = BotApiBackend(api.url, is_local=False)
+        monkeypatch.setattr(messages, 'bot_api', backend)
+        bot = Bot(token=os.environ['BOT_TOKEN'], session=backend.create_session())
+        try:
+            message = Message(message_id=1, date=datetime.now(), chat=Chat(id=7, type='private')).as_(bot)
+            for name in names:
+                await messages.process_download(message, f'{media.url}/media/{name}', 'best', 7, job_id=job_id)
+        finally:
+            await bot.session.close()
+            await media.stop()
+            await api.stop()
+        return media, api
+
+    return asyncio.run(run())
+
+
+def test_pipe_upload(monkeypatch):
+    media, api = run_downloads(monkeypatch, ['piped.mp4', 'piped.mp4'])
+
+    sent = [fields for method, fields in api.requests if method == 'sendVideo']
+    assert len(sent) == 2
+    # Streamed straight into the upload, then resent by file_id
+    assert sent[0]['video'].startswith('attach://') and sent[1]['video'].startswith('bench-')
+    assert api.bytes_received == FIXTURE_SIZE
+    # One download, plus what yt-dlp's generic extractor reads to sniff the file
+    assert FIXTURE_SIZE <= media.bytes_sent < 2 * FIXTURE_SIZE
+
+
+def test_pipe_aborts_a_job_taken_over(monkeypatch):
+    # Owned by another process now, this one must neither send nor download it
+    other = JobQueue(job_queue.path, job_queue.max_attempts, job_queue.retention)
+    job_id = other.add(7, 'private', 7, 'http://example.com/taken.mp4', 'best', 1)
+    downloads = []
+
+    async def download_video(*args, **kwargs):
+        downloads.append(args)
+        raise AssertionError("no fallback download for a job taken over")
+
+    monkeypatch.setattr(messages.downloader, 'download_video', download_video)
+    media, api = run_downloads(monkeypatch, ['taken.mp4'], job_id=job_id)
+
+    assert [method for method, _ in api.requests if method.startswith('send')] == ['sendMessage']
+    assert 'deleteMessage' in [method for method, _ in api.requests]
+    assert downloads == []
+
+
+def test_pipe_input_file(tmp_path):
+    fixture = os.urandom(FIXTURE_SIZE)
+
+    async def read_all(media_file):
+        return b''.join([chunk async for chunk in media_file.read(None)])
+
+    async def run():
+        media = MediaServer(fixture)
+        await media.start()
+        try:
+            url = f'{media.url}/media/video.mp4'
+            spill = str(tmp_path / 'video.mp4')
+            media_file = PipeInputFile(PipeSource(url, 'video.mp4', 'video', 'key'), FIXTURE_SIZE, spill)
+            await media_file.open()
+            streamed = await read_all(media_file)
+            # aiogram retrying the request gets the spilled copy
+            retried = await read_all(media_file)
+
+            too_large = PipeInputFile(PipeSource(url, 'video.mp4', 'video', 'key'), FIXTURE_SIZE - 1)
+            with pytest.raises(PipeUnavailable, match='over the upload limit'):
+                await too_large.open()
+            # The extractor announced another size: not the file we asked for
+            other = PipeInputFile(PipeSource(url, 'video.mp4', 'video', 'key', size=1), FIXTURE_SIZE)
+            with pytest.raises(PipeUnavailable):
+                await other.open()
+        finally:
+            await media.stop()
+        return media_file, streamed, retried, spill
+
+    media_file, streamed, retried, spill = asyncio.run(run())
+    assert streamed == retried == fixture
+    assert media_file.complete and media_file.bytes_sent == FIXTURE_SIZE
+    with open(spill, 'rb') as f:
+        assert f.read() == fixture
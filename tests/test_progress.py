@@ -0,0 +1,102 @@
+import asyncio
+import os
+import time
+
+from aiogram import Bot
+
+from benchmarks.servers import FakeBotApi
+from services.bot_api import BotApiBackend
+from utils.progress import ProgressBroker, ProgressInputFile, ProgressJob, format_eta
+
+
+def test_streaming_upload(tmp_path):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(os.urandom(1024 * 1024 + 1))
+    progress, chunks = [], []
+
+    async def run():
+        api = FakeBotApi()
+        await api.start()
+        bot = Bot(token=os.environ['BOT_TOKEN'], session=BotApiBackend(api.url, is_local=False).create_session())
+        try:
+            video = ProgressInputFile(str(path), lambda sent, total: progress.append((sent, total)),
+                                      chunk_size=256 * 1024)
+            read = video.read
+
+            async def watched(bot):
+                async for chunk in read(bot):
+                    chunks.append(len(chunk))
+                    yield chunk
+
+            video.read = watched
+            await bot.send_video(7, video)
+        finally:
+            await bot.session.close()
+            await api.stop()
+        return api
+
+    api = asyncio.run(run())
+    assert api.bytes_received == path.stat().st_size
+    # Never more than one chunk in memory
+    assert max(chunks) == 256 * 1024 and len(chunks) == 5
+    assert [sent for sent, _ in progress] == [256 * 1024 * n for n in range(1, 5)] + [path.stat().st_size]
+    assert {total for _, total in progress} == {path.stat().st_size}
+
+
+class SlowMessage:
+    def __init__(self, delay):
+        self.delay = delay
+        self.edits = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+
+    async def edit_text(self, text):
+        self.in_flight += 1
+        self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        self.edits.append(text)
+
+
+def test_edits_are_coalesced():
+    async def run():
+        broker = ProgressBroker(interval=0.05)
+        message = SlowMessage(delay=0.12)
+        job = broker.track(message)
+        total = 100 * 1024 * 1024
+
+        def download():
+            # yt-dlp calls the hook from its download thread, far more often than edits may go out
+            for n in range(1, 20001):
+                job.hook({'status': 'downloading', 'downloaded_bytes': n * total // 20000, 'total_bytes': total})
+                if n % 1000 == 0:
+                    time.sleep(0.02)
+
+        await asyncio.to_thread(download)
+        await asyncio.sleep(0.3)
+        job.set_text('Done')
+        await asyncio.sleep(0.3)
+        last = list(message.edits)
+        # Nothing new to say: no edit
+        await asyncio.sleep(0.2)
+        job.close()
+        return message, last
+
+    message, last = asyncio.run(run())
+    assert 2 <= len(message.edits) <= 10
+    assert message.most_in_flight == 1
+    assert message.edits[-2].startswith('Downloading... 100.0%')
+    assert message.edits[-1] == 'Done' and message.edits == last
+
+
+def test_render():
+    job = ProgressJob(None, None)
+    assert job.render() is None
+    job.hook({'status': 'downloading', 'downloaded_bytes': 3 * 1024 * 1024})
+    assert job.render() == 'Downloading... 3.0MB ⬇️'
+    job.upload(1024 * 1024, 4 * 1024 * 1024)
+    assert job.render() == 'Uploading... 25.0% ⬆️\n(1.0MB / 4.0MB)'
+    job._latest = ('upload', 3 * 1024 * 1024, 4 * 1024 * 1024, job._sample[2] + 2)
+    # 2MB in 2s
+    assert job.render() == 'Uploading... 75.0% ⬆️\n(3.0MB / 4.0MB, 1.0MB/s, ETA 0:01)'
+    assert format_eta(3725) == '1:02:05'
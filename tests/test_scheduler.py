@@ -0,0 +1,84 @@
+import asyncio
+
+from services.scheduler import HIGH, NORMAL, Scheduler, job_priority
+
+
+def test_job_priority():
+    assert job_priority('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'best') == NORMAL
+    assert job_priority('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'audio') == HIGH
+    assert job_priority('https://www.youtube.com/shorts/dQw4w9WgXcQ', 'best') == HIGH
+    assert job_priority('https://www.tiktok.com/@user/video/7000000000000000000', 'best') == HIGH
+
+
+def run_jobs(scheduler, jobs):
+    """Queue (name, user, priority) jobs behind busy slots; returns the order they got a slot and the positions seen."""
+    started, positions = [], {}
+    release = asyncio.Event()
+
+    async def job(name, user_id, priority):
+        async def on_position(position):
+            positions.setdefault(name, []).append(position)
+
+        async with scheduler.slot(user_id, priority, on_position):
+            started.append(name)
+            await release.wait()
+
+    async def run():
+        # Every slot is taken while the jobs arrive, so the order is the scheduler's, not the arrival's
+        busy = asyncio.Event()
+        blockers = [asyncio.ensure_future(hold(scheduler, f'busy{n}', busy)) for n in range(scheduler.max_jobs)]
+        await asyncio.sleep(0)
+        tasks = [asyncio.ensure_future(job(*spec)) for spec in jobs]
+        await asyncio.sleep(0)
+        busy.set()
+        await asyncio.gather(*blockers)
+        while len(started) < len(jobs):
+            await asyncio.sleep(0)
+            release.set()
+            await asyncio.sleep(0)
+            release.clear()
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    return started, positions
+
+
+async def hold(scheduler, user_id, event):
+    async with scheduler.slot(user_id):
+        await event.wait()
+
+
+def test_round_robin_across_users():
+    scheduler = Scheduler(max_jobs=1, max_jobs_per_user=1)
+    jobs = [('a1', 'a', NORMAL), ('a2', 'a', NORMAL), ('a3', 'a', NORMAL), ('b1', 'b', NORMAL), ('c1', 'c', NORMAL)]
+    started, positions = run_jobs(scheduler, jobs)
+    # One user pasting many links doesn't make the others wait for all of them
+    assert started == ['a1', 'b1', 'c1', 'a2', 'a3']
+    assert max(positions['a3']) == 5 and positions['a3'][-1] == 1
+    assert scheduler.running == 0 and scheduler.queued == 0
+
+
+def test_high_lane_and_per_user_limit():
+    scheduler = Scheduler(max_jobs=2, max_jobs_per_user=1)
+    jobs = [('a1', 'a', NORMAL), ('b1', 'b', NORMAL), ('c1', 'c', HIGH), ('c2', 'c', HIGH)]
+    started, _ = run_jobs(scheduler, jobs)
+    # c's short clips skip ahead, but only one at a time: c2 waits for c1
+    assert started == ['c1', 'a1', 'c2', 'b1']
+
+
+def test_cancelled_while_waiting():
+    async def run():
+        scheduler = Scheduler(max_jobs=1, max_jobs_per_user=1)
+        async with scheduler.slot('a'):
+            waiting = asyncio.ensure_future(scheduler.slot('b').__aenter__())
+            await asyncio.sleep(0)
+            assert scheduler.queued == 1
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            assert scheduler.queued == 0
+        assert scheduler.running == 0
+        async with scheduler.slot('c'):
+            assert scheduler.running == 1
+
+    asyncio.run(run())
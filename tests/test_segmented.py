@@ -0,0 +1,85 @@
+import os
+
+import pytest
+import yt_dlp
+from yt_dlp.networking.exceptions import RequestError
+
+from benchmarks.servers import MediaServer
+from services import segmented
+from services.segmented import HostLimiter, RangeUnsupported, SegmentSettings
+
+CHUNK = 64 * 1024
+SETTINGS = SegmentSettings(connections=4, chunk_size=CHUNK, buffer_size=16 * 1024)
+
+
+@pytest.fixture
+def fixture_bytes():
+    return os.urandom(10 * CHUNK + 1234)
+
+
+def fetch(server, path, progress_hook=None):
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        segmented.download(ydl, f'{server.url}/media/video.mp4', path, {}, SETTINGS, progress_hook,
+                           limiter=HostLimiter(8, 8))
+
+
+def test_full_download(serve, tmp_path, fixture_bytes):
+    server = serve(MediaServer(fixture_bytes))
+    path = str(tmp_path / 'video.mp4')
+    finished = []
+
+    fetch(server, path, lambda d: finished.append(d) if d['status'] == 'finished' else None)
+
+    with open(path, 'rb') as f:
+        assert f.read() == fixture_bytes
+    assert server.bytes_sent == len(fixture_bytes)
+    assert finished and finished[0]['total_bytes'] == len(fixture_bytes)
+    assert os.listdir(tmp_path) == ['video.mp4']
+
+
+def test_resume_from_journal(serve, tmp_path, fixture_bytes):
+    server = serve(MediaServer(fixture_bytes))
+    path = str(tmp_path / 'video.mp4')
+
+    def stop_halfway(d):
+        if d['downloaded_bytes'] > len(fixture_bytes) // 2:
+            raise yt_dlp.utils.DownloadCancelled()
+
+    with pytest.raises(yt_dlp.utils.DownloadCancelled):
+        fetch(server, path, stop_halfway)
+    assert os.path.exists(path + '.part' + segmented.JOURNAL_SUFFIX)
+    first_run = server.bytes_sent
+
+    fetch(server, path)
+    with open(path, 'rb') as f:
+        assert f.read() == fixture_bytes
+    # Only the ranges missing from the journal were fetched again
+    assert server.bytes_sent - first_run < len(fixture_bytes) - CHUNK
+    assert os.listdir(tmp_path) == ['video.mp4']
+
+
+def test_server_without_ranges(serve, tmp_path, fixture_bytes):
+    server = serve(MediaServer(fixture_bytes, range_requests=0))
+    path = str(tmp_path / 'video.mp4')
+
+    with pytest.raises(RangeUnsupported):
+        fetch(server, path)
+    # Nothing yt-dlp could mistake for a download of its own
+    assert os.listdir(tmp_path) == []
+
+
+def test_ranges_refused_mid_download(serve, tmp_path, fixture_bytes):
+    server = serve(MediaServer(fixture_bytes, range_requests=1))
+    path = str(tmp_path / 'video.mp4')
+
+    # Not RangeUnsupported: that would let yt-dlp "resume" the preallocated .part as complete
+    with pytest.raises(RequestError):
+        fetch(server, path)
+    assert not os.path.exists(path)
+    # Kept for the next try, which resumes it
+    assert os.path.exists(path + '.part' + segmented.JOURNAL_SUFFIX)
+
+    server.range_requests = None
+    fetch(server, path)
+    with open(path, 'rb') as f:
+        assert f.read() == fixture_bytes
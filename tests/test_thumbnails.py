@@ -0,0 +1,51 @@
+import asyncio
+import io
+
+from PIL import Image
+
+from benchmarks.servers import MediaServer
+from services import thumbnails
+from services.thumbnails import MAX_SIDE, ThumbnailCache
+
+
+def jpeg(width, height) -> bytes:
+    output = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(output, 'JPEG')
+    return output.getvalue()
+
+
+def get(info, fixture=None):
+    async def run():
+        media = MediaServer(fixture or b'')
+        await media.start()
+        try:
+            info.setdefault('thumbnail', f'{media.url}/media/thumbnail.jpg')
+            return await ThumbnailCache(10).get(info)
+        finally:
+            await media.stop()
+    return asyncio.run(run())
+
+
+def test_thumbnail():
+    data = get({'id': 'a', 'extractor_key': 'Test'}, jpeg(1280, 720))
+    image = Image.open(io.BytesIO(data))
+    assert image.format == 'JPEG'
+    assert max(image.size) == MAX_SIDE
+
+
+def test_broken_image():
+    # Truncated: Pillow reads the header, then fails decoding
+    assert get({'id': 'a', 'extractor_key': 'Test'}, jpeg(1280, 720)[:2000]) is None
+    assert get({'id': 'a', 'extractor_key': 'Test'}, b'not an image') is None
+
+
+def test_unexpected_errors_are_not_fatal(monkeypatch):
+    def explode(data):
+        raise Image.DecompressionBombError('too many pixels')
+
+    monkeypatch.setattr(thumbnails, 'make_thumbnail', explode)
+    assert get({'id': 'a', 'extractor_key': 'Test'}, jpeg(1280, 720)) is None
+    assert get({'id': 'b', 'extractor_key': 'Test', 'thumbnail': 'ftp://[bad'}) is None
+    # A width that isn't a number
+    thumbnail = {'url': 'x', 'width': '1280', 'height': 720}
+    assert get({'id': 'c', 'extractor_key': 'Test', 'thumbnails': [thumbnail]}) is None
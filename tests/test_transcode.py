@@ -0,0 +1,62 @@
+import asyncio
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from services.ffmpeg import FFmpegPool, MediaProbe
+from services.transcode import TranscodeError, Transcoder, target_height, target_video_kbps
+
+KB = 1024
+
+
+def transcoder(**kwargs):
+    options = dict(enabled=True, concurrency=1, preset='ultrafast', max_duration=3600, min_video_kbps=100,
+                   timeout=120)
+    options.update(kwargs)
+    return Transcoder(FFmpegPool(1, 2), **options)
+
+
+def test_targets():
+    # 50MB over 10 minutes: about 560kbps of video next to 96kbps of audio
+    assert 555 < target_video_kbps(600, 50 * KB * KB) < 565
+    assert target_height(400, 1080) == 360
+    assert target_height(1500, 1080) == 720
+    assert target_height(1500, 480) is None
+    assert target_height(5000, 2160) is None
+    assert not transcoder(enabled=False).can_fit(60, 50 * KB * KB)
+    assert not transcoder(max_duration=60).can_fit(61, 50 * KB * KB)
+    assert transcoder().can_fit(600, 50 * KB * KB) and not transcoder().can_fit(36000, 50 * KB * KB)
+
+
+@pytest.mark.skipif(shutil.which('ffmpeg') is None, reason='needs ffmpeg')
+def test_two_pass_fit(tmp_path):
+    source = tmp_path / 'video.mp4'
+    subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', 'testsrc2=size=1280x720:rate=25:duration=4',
+                    '-f', 'lavfi', '-i', 'sine=duration=4', '-c:v', 'libx264', '-preset', 'ultrafast',
+                    '-b:v', '6M', '-c:a', 'aac', '-shortest', str(source)], check=True)
+    budget = 300 * KB
+    assert source.stat().st_size > budget
+    media = MediaProbe(duration=4, width=1280, height=720, vcodec='h264', acodec='aac')
+
+    output = asyncio.run(transcoder().fit(str(source), budget, media))
+
+    assert os.path.getsize(output) <= budget
+    # About 480kbps of video is too little for 720p
+    err = subprocess.run(['ffmpeg', '-hide_banner', '-i', output], capture_output=True, text=True).stderr
+    assert ' 640x360' in err and 'Audio: aac' in err
+    # The source and the first pass's logs are gone
+    assert os.listdir(tmp_path) == ['video.fit.mp4']
+
+
+def test_refused_before_encoding(tmp_path):
+    async def fit(media, budget=300 * KB):
+        return await transcoder(max_duration=60).fit(str(tmp_path / 'video.mp4'), budget, media)
+
+    with pytest.raises(TranscodeError, match='length is unknown'):
+        asyncio.run(fit(MediaProbe()))
+    with pytest.raises(TranscodeError, match='too long to compress'):
+        asyncio.run(fit(MediaProbe(duration=61)))
+    with pytest.raises(TranscodeError, match='watchable quality'):
+        asyncio.run(fit(MediaProbe(duration=60, acodec='aac'), budget=KB * KB))
@@ -0,0 +1,69 @@
+import asyncio
+
+from aiohttp import web
+
+from utils.urls import ShortLinkResolver, canonical_key, detect_platform, extract_urls, is_playlist, is_short_link, parse
+
+
+def test_same_video_same_key():
+    links = [
+        'https://www.youtube.com/watch?v=dQw4w9WgXcQ',
+        'youtube.com/watch?feature=share&v=dQw4w9WgXcQ&si=abc',
+        'https://youtu.be/dQw4w9WgXcQ?si=abc',
+        'https://m.youtube.com/shorts/dQw4w9WgXcQ',
+        'https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ',
+    ]
+    assert {canonical_key(url) for url in links} == {'youtube:dQw4w9WgXcQ'}
+    assert parse(links[2]).url == 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+    assert canonical_key('https://www.tiktok.com/@user.name/video/7000000000000000000?is_from_webapp=1') \
+        == 'tiktok:7000000000000000000'
+    assert canonical_key('https://www.instagram.com/reel/Cabc123/?igsh=xyz') == 'instagram:Cabc123'
+    # Anything else is keyed by its clean URL
+    assert canonical_key('https://example.com/a/video.mp4/?utm_source=x&id=2#t=1') == 'example.com/a/video.mp4?id=2'
+
+
+def test_links_in_a_message():
+    text = ('look: youtu.be/dQw4w9WgXcQ, and (https://www.tiktok.com/@a/video/1). '
+            'again youtu.be/dQw4w9WgXcQ https://example.com/other')
+    assert extract_urls(text) == ['youtu.be/dQw4w9WgXcQ', 'https://www.tiktok.com/@a/video/1']
+    assert detect_platform('https://vm.tiktok.com/ZM123/') == 'tiktok'
+    assert detect_platform('https://nottiktok.com/x') is None
+    assert is_short_link('https://vm.tiktok.com/ZM123/') and not is_short_link('https://www.tiktok.com/@a/video/1')
+    assert is_playlist('https://www.youtube.com/playlist?list=PL1') and is_playlist('https://www.tiktok.com/@a')
+    assert not is_playlist('https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PL1')
+
+
+def test_short_links_are_resolved_once():
+    requests = []
+
+    async def short(request):
+        requests.append(request.path)
+        raise web.HTTPFound('/@user/video/7000000000000000000')
+
+    async def video(request):
+        return web.Response(text='video page')
+
+    async def run():
+        app = web.Application()
+        app.router.add_get('/t/abc', short)
+        app.router.add_get('/@user/video/7000000000000000000', video)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        resolver = ShortLinkResolver()
+        try:
+            first = await resolver.resolve(f'http://127.0.0.1:{port}/t/abc?_r=1')
+            second = await resolver.resolve(f'http://127.0.0.1:{port}/t/abc')
+        finally:
+            await runner.cleanup()
+        # Unreachable: yt-dlp gets the link as it was
+        unreachable = await resolver.resolve(f'http://127.0.0.1:{port}/t/gone')
+        return port, first, second, unreachable
+
+    port, first, second, unreachable = asyncio.run(run())
+    assert first == second == f'http://127.0.0.1:{port}/@user/video/7000000000000000000'
+    assert requests == ['/t/abc']
+    assert unreachable == f'http://127.0.0.1:{port}/t/gone'
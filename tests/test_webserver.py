@@ -0,0 +1,56 @@
+import asyncio
+
+import aiohttp
+
+from services.webserver import SECRET_HEADER, WebServer
+
+
+def test_webhook_and_drain():
+    handled = []
+
+    async def run():
+        slow = asyncio.Event()
+
+        async def handle_update(update):
+            await slow.wait()
+            handled.append(update['update_id'])
+
+        server = WebServer(handle_update, secret_token='secret', path='/webhook', drain_timeout=5)
+        await server.start('127.0.0.1', 0)
+        port = server._runner.addresses[0][1]
+        base = f'http://127.0.0.1:{port}'
+        statuses = {}
+        try:
+            async with aiohttp.ClientSession() as session:
+                async def status(method, path, **kwargs):
+                    async with session.request(method, base + path, **kwargs) as response:
+                        return response.status
+
+                statuses['healthz'] = await status('GET', '/healthz')
+                statuses['not ready'] = await status('GET', '/readyz')
+                server.ready = True
+                statuses['ready'] = await status('GET', '/readyz')
+                statuses['no secret'] = await status('POST', '/webhook', json={'update_id': 0})
+                # Answered before the update is handled
+                statuses['update'] = await status('POST', '/webhook', json={'update_id': 1},
+                                                  headers={SECRET_HEADER: 'secret'})
+                statuses['bad json'] = await status('POST', '/webhook', data=b'{', headers={SECRET_HEADER: 'secret'})
+                assert handled == []
+
+                drain = asyncio.ensure_future(server.drain())
+                await asyncio.sleep(0.05)
+                statuses['draining'] = await status('POST', '/webhook', json={'update_id': 2},
+                                                    headers={SECRET_HEADER: 'secret'})
+                statuses['draining ready'] = await status('GET', '/readyz')
+                assert not drain.done()
+                slow.set()
+                await drain
+        finally:
+            await server.stop()
+        return statuses
+
+    statuses = asyncio.run(run())
+    assert statuses == {'healthz': 200, 'not ready': 503, 'ready': 200, 'no secret': 401, 'update': 200,
+                        'bad json': 400, 'draining': 503, 'draining ready': 503}
+    # The in-flight update finished before drain() returned; the one sent while draining is Telegram's to retry
+    assert handled == [1]
@@ -0,0 +1,55 @@
+import asyncio
+import os
+
+from services.workspace import WorkspaceManager
+
+DEAD = '999999999'  # pids never get that high
+
+
+def make_dirs(root, *names):
+    for name in names:
+        os.makedirs(os.path.join(root, name))
+
+
+def test_startup_removes_only_dead_processes_dirs(tmp_path):
+    tmpfs = str(tmp_path / 'tmpfs')
+    make_dirs(tmpfs, f'{DEAD}-crashed', f'{os.getpid()}-mine', '1-init', 'resume-abc')
+    manager = WorkspaceManager(str(tmp_path / 'staging'), 1 << 30, 0, tmpfs, 1 << 20, 1 << 20)
+
+    manager.startup()
+
+    assert sorted(os.listdir(tmpfs)) == sorted([f'{os.getpid()}-mine', '1-init', 'resume-abc'])
+    assert os.path.isdir(tmp_path / 'staging')
+
+
+def test_janitor_leaves_live_processes_dirs_alone(tmp_path):
+    root = str(tmp_path / 'staging')
+    manager = WorkspaceManager(root, 1 << 30, 0, stale_after=0)
+
+    async def run():
+        workspace = await manager.open(1024)
+        assert os.path.basename(workspace.path).startswith(f'{os.getpid()}-')
+        make_dirs(root, f'{DEAD}-crashed', f'{os.getpid()}-orphan', '1-other', 'resume-abc')
+        manager.sweep()
+        return workspace
+
+    workspace = asyncio.run(run())
+    assert sorted(os.listdir(root)) == sorted(['1-other', os.path.basename(workspace.path)])
+
+
+def test_resumable_directory_has_one_owner(tmp_path):
+    root = str(tmp_path / 'staging')
+    # Two processes sharing the directory, downloading the same media
+    first, second = WorkspaceManager(root, 1 << 30, 0), WorkspaceManager(root, 1 << 30, 0)
+
+    async def run():
+        taken = await first.open(1024, name='key')
+        other = await second.open(1024, name='key')
+        assert taken.resumable and not other.resumable
+        second.close(other.path)
+        first.close(taken.path, keep=True)
+        # Free again once its job is over
+        return await second.open(1024, name='key')
+
+    again = asyncio.run(run())
+    assert again.resumable and again.path.endswith('resume-key')
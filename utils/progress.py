@@ -2,50 +2,169 @@ import os
 import typing
 import time
 import asyncio
+import aiofiles
+from aiogram.types import InputFile
+from config import PROGRESS_EDIT_INTERVAL
+from services import metrics
 
-class ProgressFileReader(typing.BinaryIO):
-    def __init__(self, path: str, progress_callback: typing.Callable[[int, int], typing.Awaitable[None]]):
-        self.file = open(path, 'rb')
+# 256 KB keeps syscalls low while bounding memory per upload
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# Weight of the newest sample in the smoothed speed
+SPEED_SMOOTHING = 0.3
+
+
+def format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class ProgressJob:
+    """Progress state of one download/upload, shown in one status message.
+
+    hook() and upload() may be called from any thread at any rate: they only
+    replace a tuple, which is atomic, and never touch the event loop. The
+    broker reads the latest tuple when it is time to edit the message.
+    """
+
+    def __init__(self, broker, message):
+        self.broker = broker
+        self.message = message
+        self.last_text = None
+        self._latest = None
+        self._edit = None
+        # Raw byte counters for speed and ETA
+        self._sample = None
+        self._speed = None
+
+    def hook(self, d):
+        """yt-dlp progress hook."""
+        if d.get('status') == 'downloading':
+            total = d.get('total_bytes') or d.get('total_bytes_estimate')
+            self._latest = ('download', d.get('downloaded_bytes') or 0, total, time.monotonic())
+        elif d.get('status') == 'transcoding':
+            # Sent by the downloader, not yt-dlp: the file is being re-encoded to fit the upload limit
+            self.set_text("Compressing to fit Telegram's size limit... 🗜️")
+
+    def upload(self, current: int, total: int):
+        self._latest = ('upload', current, total, time.monotonic())
+
+    def set_text(self, text: str):
+        self._latest = ('text', text, None, time.monotonic())
+
+    def close(self):
+        self.broker.untrack(self)
+
+    def render(self):
+        latest = self._latest
+        if latest is None:
+            return None
+        stage, current, total, now = latest
+        if stage == 'text':
+            return current
+
+        speed = self._update_speed(stage, current, now)
+        verb, arrow = ('Downloading', '⬇️') if stage == 'download' else ('Uploading', '⬆️')
+        if not total:
+            return f"{verb}... {current / (1024 * 1024):.1f}MB {arrow}"
+
+        details = f"{current / (1024 * 1024):.1f}MB / {total / (1024 * 1024):.1f}MB"
+        if speed:
+            details += f", {speed / (1024 * 1024):.1f}MB/s, ETA {format_eta(max(total - current, 0) / speed)}"
+        return f"{verb}... {current / total * 100:.1f}% {arrow}\n({details})"
+
+    def _update_speed(self, stage, current, now):
+        if self._sample and self._sample[0] == stage and current >= self._sample[1] and now > self._sample[2]:
+            instant = (current - self._sample[1]) / (now - self._sample[2])
+            self._speed = instant if self._speed is None else (
+                SPEED_SMOOTHING * instant + (1 - SPEED_SMOOTHING) * self._speed)
+        elif not self._sample or self._sample[0] != stage or current < self._sample[1]:
+            # New stage or new file (e.g. the audio track after the video): start over
+            self._speed = None
+        self._sample = (stage, current, now)
+        return self._speed
+
+
+class ProgressBroker:
+    """Turns progress events into at most one edit_text per job per interval.
+
+    Edits whose text didn't change are skipped, since Telegram rejects them
+    with "message is not modified", and a job never has two edits in flight.
+    """
+
+    def __init__(self, interval: float = PROGRESS_EDIT_INTERVAL):
+        self.interval = interval
+        self._jobs = set()
+        self._flusher = None
+
+    def track(self, message) -> ProgressJob:
+        job = ProgressJob(self, message)
+        self._jobs.add(job)
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_forever())
+        return job
+
+    def untrack(self, job: ProgressJob):
+        self._jobs.discard(job)
+        if job._edit and not job._edit.done():
+            job._edit.cancel()
+
+    async def _flush_forever(self):
+        while self._jobs:
+            await asyncio.sleep(self.interval)
+            for job in list(self._jobs):
+                self._flush(job)
+
+    def _flush(self, job: ProgressJob):
+        if job._edit and not job._edit.done():
+            return
+        text = job.render()
+        if text is None or text == job.last_text:
+            return
+        job.last_text = text
+        job._edit = asyncio.create_task(self._edit_text(job.message, text))
+
+    @staticmethod
+    async def _edit_text(message, text):
+        try:
+            await message.edit_text(text)
+        except Exception:
+            pass
+
+
+progress_broker = ProgressBroker()
+
+
+class ProgressInputFile(InputFile):
+    """Uploads a file from disk in fixed-size chunks and reports upload progress.
+
+    Only one chunk is held in memory at a time, whatever the file size. aiohttp
+    pulls the next chunk only after the previous one was written to the
+    connection, so progress follows the bytes actually sent, not read() calls.
+    progress_callback(sent, total) is called after every chunk and must be cheap,
+    e.g. ProgressJob.upload.
+
+    There is no sendfile() path: the body is encrypted for TLS in user space,
+    so every byte passes through Python anyway. The zero-copy upload is a
+    local Bot API server, which gets the file's path instead (bot_api.input_file).
+    """
+
+    def __init__(self, path: str, progress_callback: typing.Callable[[int, int], None] = None,
+                 filename: str = None, chunk_size: int = UPLOAD_CHUNK_SIZE):
+        super().__init__(filename=filename or os.path.basename(path), chunk_size=chunk_size)
+        self.path = path
         self.total_size = os.path.getsize(path)
-        self.bytes_read = 0
+        self.bytes_sent = 0
         self.progress_callback = progress_callback
-        self.last_update_time = 0
-
-    def read(self, size: int = -1) -> bytes:
-        chunk = self.file.read(size)
-        self.bytes_read += len(chunk)
-        
-        # Trigger callback (non-blocking)
-        current_time = time.time()
-        if current_time - self.last_update_time > 3 or self.bytes_read == self.total_size:
-            self.last_update_time = current_time
-            try:
-                # We can't await here easily because read is sync.
-                # But we can schedule a task on the running loop.
-                loop = asyncio.get_running_loop()
-                if loop.is_running():
-                    loop.create_task(self.progress_callback(self.bytes_read, self.total_size))
-            except RuntimeError:
-                pass
-                
-        return chunk
 
-    def close(self):
-        self.file.close()
-
-    # Proxy other methods
-    def seek(self, offset, whence=0): return self.file.seek(offset, whence)
-    def tell(self): return self.file.tell()
-    def fileno(self): return self.file.fileno()
-    def flush(self): return self.file.flush()
-    def isatty(self): return self.file.isatty()
-    def readable(self): return self.file.readable()
-    def readline(self, size=-1): return self.file.readline(size)
-    def readlines(self, hint=-1): return self.file.readlines(hint)
-    def seekable(self): return self.file.seekable()
-    def truncate(self, size=None): return self.file.truncate(size)
-    def writable(self): return self.file.writable()
-    def write(self, b): return self.file.write(b)
-    def writelines(self, lines): return self.file.writelines(lines)
-    def __enter__(self): return self
-    def __exit__(self, *args): self.close()
+    async def read(self, bot) -> typing.AsyncGenerator[bytes, None]:
+        # Restart from zero if aiogram retries the request
+        self.bytes_sent = 0
+        async with aiofiles.open(self.path, 'rb') as f:
+            while chunk := await f.read(self.chunk_size):
+                yield chunk
+                self.bytes_sent += len(chunk)
+                metrics.BYTES.labels('uploaded').inc(len(chunk))
+                if self.progress_callback:
+                    self.progress_callback(self.bytes_sent, self.total_size)
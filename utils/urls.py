@@ -0,0 +1,163 @@
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+import aiohttp
+
+# Every http(s) link in a message, also bare "youtu.be/..." style links
+URL_PATTERN = re.compile(
+    r'(?:https?://)?(?:[\w-]+\.)*(?:youtube\.com|youtube-nocookie\.com|youtu\.be|tiktok\.com|instagram\.com)'
+    r'/[^\s<>"\']*',
+    re.IGNORECASE,
+)
+
+# One pass over the URL tells both the platform (named group) and the video id
+VIDEO_PATTERN = re.compile(
+    r'^(?:https?://)?(?:[\w-]+\.)*(?:'
+    r'(?:youtube\.com|youtube-nocookie\.com)/(?:watch\?(?:.*&)?v=|shorts/|embed/|live/|v/)(?P<youtube>[\w-]{11})'
+    r'|youtu\.be/(?P<youtube_short>[\w-]{11})'
+    r'|tiktok\.com/(?:@[\w.-]*/(?:video|photo)/|embed(?:/v2)?/|v/)(?P<tiktok>\d+)'
+    r'|instagram\.com/(?:[\w.]+/)?(?:p|reel|reels|tv)/(?P<instagram>[\w-]+)'
+    r')',
+    re.IGNORECASE,
+)
+
+# Links that only redirect to the real video page
+SHORT_LINK_PATTERN = re.compile(
+    r'^(?:https?://)?(?:(?:vm|vt)\.tiktok\.com/|(?:www\.)?tiktok\.com/t/|(?:www\.)?instagram\.com/share/)',
+    re.IGNORECASE,
+)
+
+# Links to many videos at once: playlists, channels and profiles
+PLAYLIST_PATTERN = re.compile(
+    r'^(?:https?://)?(?:[\w-]+\.)*(?:'
+    r'youtube\.com/(?:playlist\?|@[\w.-]+/?(?:videos|shorts|streams)?/?(?:$|\?)|(?:channel|c|user)/)'
+    r'|tiktok\.com/@[\w.-]+/?(?:$|\?)'
+    r')',
+    re.IGNORECASE,
+)
+
+PLATFORM_HOSTS = {
+    'youtube': ('youtube.com', 'youtu.be', 'youtube-nocookie.com'),
+    'tiktok': ('tiktok.com',),
+    'instagram': ('instagram.com',),
+}
+
+TRACKING_PARAMS = {
+    'si', 'feature', 'pp', 'ab_channel', 'igshid', 'igsh', 'img_index', 'is_from_webapp', 'is_copy_url',
+    'sender_device', 'sender_web_id', 'share_app_id', 'share_item_id', 'share_link_id', 'social_sharing',
+    'source', 'tt_from', 'u_code', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content',
+    '_r', '_t', 'fbclid', 'gclid',
+}
+
+RESOLVE_TIMEOUT = aiohttp.ClientTimeout(total=10)
+RESOLVE_CACHE_SIZE = 5000
+
+
+@dataclass(frozen=True)
+class ParsedURL:
+    platform: str
+    video_id: str
+    url: str
+
+    @property
+    def key(self) -> str:
+        """Stable identifier for caching, deduplication and metrics."""
+        if self.video_id:
+            return f'{self.platform}:{self.video_id}'
+        parsed = urlparse(self.url)
+        return f"{parsed.hostname}{parsed.path.rstrip('/')}" + (f'?{parsed.query}' if parsed.query else '')
+
+
+def extract_urls(text: str) -> list:
+    """All supported links in a message, in order, without duplicates."""
+    urls = []
+    for match in URL_PATTERN.finditer(text or ''):
+        url = match.group(0).rstrip('.,!?)]}')
+        if url not in urls:
+            urls.append(url)
+    return urls
+
+
+def detect_platform(url: str):
+    host = (urlparse(url if '://' in url else f'https://{url}').hostname or '').lower()
+    for platform, hosts in PLATFORM_HOSTS.items():
+        if any(host == h or host.endswith('.' + h) for h in hosts):
+            return platform
+    return None
+
+
+def strip_tracking(url: str) -> str:
+    parsed = urlparse(url if '://' in url else f'https://{url}')
+    query = [(k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS and not k.startswith('utm_')]
+    return urlunparse(parsed._replace(query=urlencode(query), fragment=''))
+
+
+def parse(url: str) -> ParsedURL:
+    """Split a link into (platform, video id, clean URL) without touching the network."""
+    url = strip_tracking(url.strip())
+    match = VIDEO_PATTERN.match(url)
+    if not match:
+        return ParsedURL(detect_platform(url), None, url)
+
+    platform = match.lastgroup
+    video_id = match.group(platform)
+    if platform == 'youtube_short':
+        platform = 'youtube'
+    if platform == 'youtube':
+        # Shorts, embeds, youtu.be and mobile links all play as a regular watch page
+        url = f'https://www.youtube.com/watch?v={video_id}'
+    return ParsedURL(platform, video_id, url)
+
+
+def canonical_key(url: str) -> str:
+    return parse(url).key
+
+
+def is_short_link(url: str) -> bool:
+    return bool(SHORT_LINK_PATTERN.match(url.strip()))
+
+
+def is_playlist(url: str) -> bool:
+    """Whether url is known to stand for many videos without asking the site (carousels aren't)."""
+    return bool(PLAYLIST_PATTERN.match(url.strip()))
+
+
+class ShortLinkResolver:
+    """Follows vm.tiktok.com / instagram share redirects once and remembers the target."""
+
+    def __init__(self, max_entries: int = RESOLVE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+
+    async def resolve(self, url: str) -> str:
+        url = strip_tracking(url.strip())
+        if url in self._cache:
+            self._cache.move_to_end(url)
+            return self._cache[url]
+
+        try:
+            async with aiohttp.ClientSession(timeout=RESOLVE_TIMEOUT) as session:
+                # Some short-link hosts answer HEAD with 405, GET without reading the body works everywhere
+                async with session.get(url, allow_redirects=True) as response:
+                    target = str(response.url)
+        except (aiohttp.ClientError, TimeoutError):
+            # Let yt-dlp try the original link itself
+            return url
+
+        self._cache[url] = target
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return target
+
+
+resolver = ShortLinkResolver()
+
+
+async def canonicalize(url: str) -> ParsedURL:
+    """parse(), after following short-link redirects (cached)."""
+    if is_short_link(url):
+        url = await resolver.resolve(url)
+    return parse(url)
@@ -0,0 +1,195 @@
+"""Download worker: takes jobs off the broker, downloads and uploads them.
+
+    BROKER_URL=redis://localhost:6379/0 BROKER_SHARDS=2 python worker.py --shard 0
+    BROKER_URL=redis://localhost:6379/0 BROKER_SHARDS=2 python worker.py --shard 1
+
+bot.py started with the same BROKER_URL only receives updates and queues the
+jobs (see services.broker). Workers run them with the bot's own handlers and
+send the files to the chat themselves; only the edits of the status message
+go back through the broker, for the dispatcher to apply. Run any number of
+workers per shard, on any node, each with its own JOB_QUEUE_PATH (and
+WORKER_NAME, see config).
+
+A job stays on the worker's taken list (services.broker) until it is over,
+and is recorded in the worker's job queue once it starts. A worker killed
+in between runs it again on its next start: from the job queue if it got
+that far, otherwise from the taken list.
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.types import Chat, Message
+
+from config import BOT_TOKEN, BROKER_SHARDS, WORKER_JOBS, WORKER_NAME
+from services.broker import broker as default_broker, BrokerError, EVENTS_QUEUE, jobs_queue
+from services.job_queue import job_queue
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = 1
+
+
+class RemoteStatus:
+    """The status message the dispatcher sent for a job; edits and deletes go back through the broker."""
+
+    def __init__(self, broker, chat_id: int, message_id: int):
+        self.broker = broker
+        self.chat_id = chat_id
+        self.message_id = message_id
+        # One event at a time, so they arrive in the order they were made
+        self._lock = asyncio.Lock()
+
+    async def edit_text(self, text: str, **kwargs):
+        await self._send({'op': 'edit', 'text': text})
+
+    async def delete(self, **kwargs):
+        await self._send({'op': 'delete'})
+
+    async def _send(self, event):
+        async with self._lock:
+            await self.broker.push(EVENTS_QUEUE, dict(event, chat_id=self.chat_id, message_id=self.message_id))
+
+
+async def run_job(bot: Bot, job: dict, broker=default_broker):
+    # Not a top-level import: download worker processes re-import this file, and need none of it
+    from handlers import messages
+
+    message = Message(message_id=job['status_message_id'], date=datetime.now(),
+                      chat=Chat(id=job['chat_id'], type=job['chat_type'])).as_(bot)
+    status_msg = RemoteStatus(broker, job['chat_id'], job['status_message_id'])
+    # Recorded by the dispatcher already when it shares the job queue (memory://)
+    job_id = job.get('job_id')
+    if job['kind'] == 'batch':
+        await messages.process_batch(message, job['urls'], job['quality'], job['user_id'], status_msg=status_msg,
+                                     job_id=job_id)
+    else:
+        await messages.process_download(message, job['urls'][0], job['quality'], job['user_id'], job_id=job_id,
+                                        status_msg=status_msg)
+
+
+async def run_worker(bot: Bot, shard: int, broker=default_broker, jobs: int = WORKER_JOBS,
+                     name: str = WORKER_NAME):
+    """Run the jobs of shard's queue, up to jobs at once, until cancelled.
+
+    Jobs still running when it's cancelled stay unfinished in the job queue
+    and on the taken list, and the next start resumes them.
+    """
+    queue = jobs_queue(shard)
+    slots = asyncio.Semaphore(jobs)
+    running = set()
+
+    async def run(job):
+        try:
+            await run_job(bot, job, broker)
+        except Exception:
+            logger.error("Job failed", exc_info=True)
+        await ack(job)
+
+    async def ack(job):
+        try:
+            await broker.ack(queue, name, job)
+        except BrokerError as e:
+            # Still on the taken list at the next start, which finds it recorded in the job queue and drops it
+            logger.warning(f"Can't acknowledge a job: {e}")
+
+    def start(job):
+        task = asyncio.create_task(run(job))
+        running.add(task)
+        task.add_done_callback(finished)
+
+    def finished(task):
+        running.discard(task)
+        slots.release()
+
+    try:
+        while True:
+            try:
+                leftovers = await broker.taken(queue, name)
+                break
+            except BrokerError as e:
+                logger.warning(f"{e}, retrying in {RETRY_DELAY}s")
+                await asyncio.sleep(RETRY_DELAY)
+        for job in leftovers:
+            if job_queue.knows(job['chat_id'], job['status_message_id']):
+                # Recorded before the last run ended: resume_jobs() has taken care of it
+                await ack(job)
+                continue
+            await slots.acquire()
+            start(job)
+
+        while True:
+            # Only take a job when there's room for it, the rest wait for other workers of the shard
+            await slots.acquire()
+            try:
+                job = await broker.take(queue, name)
+            except BrokerError as e:
+                slots.release()
+                logger.warning(f"{e}, retrying in {RETRY_DELAY}s")
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+            except BaseException:
+                slots.release()
+                raise
+            if job is None:
+                slots.release()
+                continue
+            start(job)
+    finally:
+        for task in running:
+            task.cancel()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shard', type=int, default=0, help=f"queue to take jobs from, 0 to {BROKER_SHARDS - 1}")
+    parser.add_argument('--port', type=int, help="serve /healthz and /metrics on this port")
+    args = parser.parse_args()
+
+    if not BOT_TOKEN:
+        print("Error: BOT_TOKEN is not set in .env file")
+        return
+    if default_broker is None:
+        print("Error: BROKER_URL is not set, there is nothing to take jobs from")
+        return
+    if not 0 <= args.shard < BROKER_SHARDS:
+        print(f"Error: --shard must be between 0 and {BROKER_SHARDS - 1} (BROKER_SHARDS)")
+        return
+
+    from handlers import messages
+    from services.bot_api import bot_api
+    from services.lifecycle import startup
+
+    startup()
+    bot = Bot(token=BOT_TOKEN, session=bot_api.create_session())
+
+    server = None
+    if args.port:
+        from services.webserver import WebServer
+        server = WebServer()
+        await server.start("0.0.0.0", args.port)
+        server.ready = True
+
+    # Jobs the last run of this worker was killed in the middle of
+    resumed = await messages.resume_jobs(bot)
+    if resumed:
+        print(f"Resuming {resumed} interrupted download(s)...")
+
+    print(f"Worker started (shard {args.shard})...")
+    try:
+        await run_worker(bot, args.shard)
+    finally:
+        if server:
+            await server.stop()
+        await default_broker.close()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Worker stopped")